@@ -13,20 +13,24 @@
 #
 # Open vStorage is distributed in the hope that it will be useful,
 # but WITHOUT ANY WARRANTY of any kind.
-import os
-from functools import wraps
 
+"""
+Caching decorators
+"""
 
-_files_cache = {}
+import os
+from functools import wraps
+from ovs_extensions.caching.lrucache import LRUCache
+from ovs_extensions.caching.watcher import FileWatcher
 
 
 class FileCache(object):
     """
-    File caching object which stores both mtime and contents
+    File caching object which stores both the stat information and contents
     Can be used to compare too
     """
-    def __init__(self, path, mtime, contents):
-        # type: (str, float, Union[str, dict]) -> None
+    def __init__(self, path, mtime, contents, size=None, inode=None):
+        # type: (str, float, Union[str, dict], Optional[int], Optional[int]) -> None
         """
         Initializes a new FileCache object
         :param path: Path to the file
@@ -35,59 +39,152 @@ class FileCache(object):
         :type mtime: int
         :param contents: Contents of the file
         :type contents: str or dict
+        :param size: Size of the file
+        :type size: int
+        :param inode: Inode of the file
+        :type inode: int
         """
         self.path = path
+        self.size = size
         self.mtime = mtime
+        self.inode = inode
         self.contents = contents
 
+    @staticmethod
+    def get_signature(path):
+        # type: (str) -> Optional[Tuple[float, int, int]]
+        """
+        Stats the file once to identify its current version
+        :param path: Path to the file
+        :type path: str
+        :return: The modification time, size and inode of the file. None if the file does not exist
+        :rtype: tuple(float, int, int)
+        """
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+        return stat.st_mtime, stat.st_size, stat.st_ino
+
     def __eq__(self, other):
         # type: (FileCache) -> bool
         if not isinstance(other, FileCache):
             raise ValueError('The item to compare is not of type {0}'.format(FileCache))
-        return self.path == other.path and self.mtime == other.mtime
+        return self.path == other.path and self.mtime == other.mtime and self.size == other.size and self.inode == other.inode
 
     def __ne__(self, other):
         # type: (FileCache) -> bool
         return not self.__eq__(other)
 
 
-def cache_file(path):
-    # type: (str) -> callable
+def _make_key(args, kwargs):
+    # type: (tuple, dict) -> tuple
+    """
+    Builds the cache key for a call
+    :param args: Positional arguments of the call
+    :type args: tuple
+    :param kwargs: Keyword arguments of the call
+    :type kwargs: dict
+    :return: The key
+    :rtype: tuple
+    """
+    if kwargs:
+        return args + (tuple(sorted(kwargs.iteritems())),)
+    return args
+
+
+def _cached(f, cache, get_signature):
+    # type: (callable, LRUCache, callable) -> callable
+    """
+    Wraps a function, caching its results per set of arguments
+    Unhashable arguments bypass the cache. Concurrent misses for the same arguments all execute the function,
+    the function itself is never executed while holding the lock of the cache
+    :param f: Function to wrap
+    :type f: callable
+    :param cache: Cache to store the results in
+    :type cache: LRUCache
+    :param get_signature: Function returning the current signature the results must match
+    :type get_signature: callable
+    :return: The wrapped function, exposing the cache as `cache`
+    :rtype: callable
+    """
+    @wraps(f)
+    def return_cache(*args, **kwargs):
+        # type: (*any, **any) -> any
+        key = _make_key(args, kwargs)
+        try:
+            hash(key)
+        except TypeError:
+            return f(*args, **kwargs)
+        signature = get_signature()  # Determined before executing the function, so changes during its execution are never masked
+        value = cache.lookup(key, signature)
+        if value is LRUCache.NOT_FOUND:
+            value = f(*args, **kwargs)
+            cache.set(key, value, signature)
+        return value
+    return_cache.cache = cache
+    return return_cache
+
+
+def cache_result(max_size=128, ttl=None):
+    # type: (Optional[int], Optional[float]) -> callable
+    """
+    Caches the result of the decorated function per set of arguments (memoization)
+    The cache of the decorated function is available as `cache`: `function.cache.get_stats()`, `function.cache.clear()`
+    :param max_size: Maximum amount of results to keep, the least recently used result is evicted first. None for no limit
+    :type max_size: int
+    :param ttl: Amount of seconds a result is re-used. None to re-use results indefinitely
+    :type ttl: float
+    """
+    def decorator(f):
+        # type: (callable) -> callable
+        return _cached(f, LRUCache(max_size=max_size, ttl=ttl), lambda: None)
+    return decorator
+
+
+def cache_file(path, max_size=128, ttl=None, watch=False):
+    # type: (str, Optional[int], Optional[float], bool) -> callable
     """
     The result of the decorated function is tied to a file
     This means that the result of the function should be based of the file that is specified
     On evaluation either:
-    - Returns the result of the decorated function if it runs for the first time or the file has changed
+    - Returns the result of the decorated function if it runs for the first time (for the given arguments)
+      or the file has changed
         or
     - Returns the previous result if the file did not change
+    The file is stat-ed once per call: it is considered changed when its modification time, size or inode differs
+    Files of which the stat information does not change (e.g. files under /proc) require a ttl
+    With `watch`, the file is watched using inotify instead (see FileWatcher): a cache hit does not require any system
+    call and the results are invalidated when the kernel reports a change. Changes are noticed asynchronously, a call
+    right after changing the file might still return the previous result. When the file cannot be watched, the stat
+    information is compared instead. This includes paths going through a symbolic link, as the stat information
+    follows the link to the changing file.
+    The cache of the decorated function is available as `cache`: `function.cache.get_stats()`, `function.cache.clear()`
     :param path: Path to the file
     :type path: str
+    :param max_size: Maximum amount of results to keep, the least recently used result is evicted first. None for no limit
+    :type max_size: int
+    :param ttl: Amount of seconds a result is re-used at most. None to re-use results as long as the file does not change
+    :type ttl: float
+    :param watch: Watch the file for changes instead of stat-ing it on every call
+    :type watch: bool
     """
-    def is_cache_valid():
-        # type: () -> bool
+    watched_path = os.path.abspath(path)
+
+    def get_signature():
+        # type: () -> any
         """
-        Determine if the cache is still valid
-        :return: True if the cache is still valid else false
-        :rtype: bool
+        Identifies the current version of the file
+        :return: The version reported by the file watcher or the stat information of the file
+        :rtype: any
         """
-        if path in _files_cache:
-            file_cache = _files_cache[path]  # type: FileCache
-            return file_cache.mtime == os.path.getmtime(path)
-        return False
+        if watch is True:
+            version = FileWatcher.get_version(watched_path)
+            if version is not None:
+                return version
+        return FileCache.get_signature(path)
 
     def decorator(f):
         # type: (callable) -> callable
-        @wraps(f)
-        def return_cache(*args, **kwargs):
-            # type: (*any, **any) -> any
-            if path in _files_cache and is_cache_valid():
-                file_cache = _files_cache[path]  # type: FileCache
-                return file_cache.contents
-            else:
-                # Store to cache
-                contents = f(*args, **kwargs)
-                file_cache = FileCache(path, os.path.getmtime(path), contents)
-                _files_cache[path] = file_cache
-                return file_cache.contents
-        return return_cache
+        return _cached(f, LRUCache(max_size=max_size, ttl=ttl), get_signature)
     return decorator
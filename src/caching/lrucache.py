@@ -0,0 +1,170 @@
+# Copyright (C) 2019 iNuron NV
+#
+# This file is part of Open vStorage Open Source Edition (OSE),
+# as available from
+#
+#      http://www.openvstorage.org and
+#      http://www.openvstorage.com.
+#
+# This file is free software; you can redistribute it and/or modify it
+# under the terms of the GNU Affero General Public License v3 (GNU AGPLv3)
+# as published by the Free Software Foundation, in version 3 as it comes
+# in the LICENSE.txt file of the Open vStorage OSE distribution.
+#
+# Open vStorage is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY of any kind.
+
+
+"""
+LRU cache module
+"""
+
+import time
+from collections import OrderedDict
+from threading import Lock
+
+
+class LRUCache(object):
+    """
+    Thread safe key-value cache which holds at most `max_size` entries, evicting the least recently used entry first.
+    Entries optionally expire `ttl` seconds after they were stored.
+    Every entry can carry a signature (e.g. the stat information of the file it was built from): retrieving an entry
+    with a different signature invalidates it.
+    """
+    NOT_FOUND = object()
+
+    def __init__(self, max_size=128, ttl=None):
+        # type: (Optional[int], Optional[float]) -> None
+        """
+        Initializes a new cache
+        :param max_size: Maximum amount of entries. None for an unbounded cache
+        :type max_size: int
+        :param ttl: Amount of seconds entries remain valid. None for entries which do not expire
+        :type ttl: float
+        """
+        if max_size is not None and max_size < 1:
+            raise ValueError('The maximum size must be at least 1')
+        self.max_size = max_size
+        self.ttl = ttl
+        self._lock = Lock()
+        self._entries = OrderedDict()  # Key - (value, signature, expiration time), the least recently used first
+        self._stats = {'hits': 0,
+                       'misses': 0,
+                       'evictions': 0,
+                       'expirations': 0,
+                       'invalidations': 0}
+
+    def get(self, key, signature=None, default=None):
+        # type: (Hashable, any, any) -> any
+        """
+        Retrieves an entry, marking it as the most recently used one
+        :param key: Key of the entry
+        :type key: Hashable
+        :param signature: Signature the entry must have been stored with
+        :type signature: any
+        :param default: Value returned when the entry is not cached (or no longer valid)
+        :type default: any
+        :return: The cached value or the default
+        :rtype: any
+        """
+        value = self.lookup(key, signature)
+        return default if value is LRUCache.NOT_FOUND else value
+
+    def lookup(self, key, signature=None):
+        # type: (Hashable, any) -> any
+        """
+        Retrieves an entry, like `get`, but returns LRUCache.NOT_FOUND when it is not cached. This allows to cache None
+        :param key: Key of the entry
+        :type key: Hashable
+        :param signature: Signature the entry must have been stored with
+        :type signature: any
+        :return: The cached value or LRUCache.NOT_FOUND
+        :rtype: any
+        """
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is None:
+                self._stats['misses'] += 1
+                return LRUCache.NOT_FOUND
+            value, entry_signature, expiration = entry
+            if expiration is not None and expiration <= time.time():
+                self._stats['expirations'] += 1
+                self._stats['misses'] += 1
+                return LRUCache.NOT_FOUND
+            if entry_signature != signature:
+                self._stats['invalidations'] += 1
+                self._stats['misses'] += 1
+                return LRUCache.NOT_FOUND
+            self._entries[key] = entry  # Re-inserted as the most recently used entry
+            self._stats['hits'] += 1
+            return value
+
+    def set(self, key, value, signature=None):
+        # type: (Hashable, any, any) -> None
+        """
+        Stores an entry, evicting the least recently used entry when the cache is full
+        :param key: Key of the entry
+        :type key: Hashable
+        :param value: Value to cache
+        :type value: any
+        :param signature: Signature to validate the entry with on retrieval
+        :type signature: any
+        :return: None
+        :rtype: NoneType
+        """
+        expiration = None if self.ttl is None else time.time() + self.ttl
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = (value, signature, expiration)
+            if self.max_size is not None:
+                while len(self._entries) > self.max_size:
+                    self._entries.popitem(last=False)
+                    self._stats['evictions'] += 1
+
+    def invalidate(self, key=None):
+        # type: (Optional[Hashable]) -> None
+        """
+        Removes an entry
+        :param key: Key of the entry. None to remove all entries
+        :type key: Hashable
+        :return: None
+        :rtype: NoneType
+        """
+        with self._lock:
+            if key is None:
+                self._stats['invalidations'] += len(self._entries)
+                self._entries.clear()
+            elif self._entries.pop(key, None) is not None:
+                self._stats['invalidations'] += 1
+
+    def clear(self):
+        # type: () -> None
+        """
+        Removes all entries and resets the statistics
+        :return: None
+        :rtype: NoneType
+        """
+        with self._lock:
+            self._entries.clear()
+            for key in self._stats:
+                self._stats[key] = 0
+
+    def get_stats(self):
+        # type: () -> Dict[str, int]
+        """
+        Retrieve the statistics of this cache
+        :return: The amount of hits and misses, the amount of entries removed because the cache was full (evictions),
+        because they expired (expirations) or because they were no longer valid (invalidations), and the current size
+        :rtype: dict
+        """
+        with self._lock:
+            stats = dict(self._stats)
+            stats['size'] = len(self._entries)
+        return stats
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        return key in self._entries
+
@@ -0,0 +1,197 @@
+# Copyright (C) 2019 iNuron NV
+#
+# This file is part of Open vStorage Open Source Edition (OSE),
+# as available from
+#
+#      http://www.openvstorage.org and
+#      http://www.openvstorage.com.
+#
+# This file is free software; you can redistribute it and/or modify it
+# under the terms of the GNU Affero General Public License v3 (GNU AGPLv3)
+# as published by the Free Software Foundation, in version 3 as it comes
+# in the LICENSE.txt file of the Open vStorage OSE distribution.
+#
+# Open vStorage is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY of any kind.
+
+
+"""
+Test module for the caching decorators
+"""
+
+import os
+import time
+import shutil
+import tempfile
+import threading
+import unittest
+from ovs_extensions.caching.decorators import cache_file, cache_result
+from ovs_extensions.caching.lrucache import LRUCache
+from ovs_extensions.caching.watcher import FileWatcher
+
+
+class CachingTest(unittest.TestCase):
+    """
+    Tests the LRU cache and the caching decorators
+    """
+
+    def setUp(self):
+        """ Creates a temporary folder """
+        self.folder = tempfile.mkdtemp()
+
+    def tearDown(self):
+        """ Removes the temporary folder """
+        shutil.rmtree(self.folder)
+
+    def _write(self, path, contents):
+        """ Writes a file and makes sure its modification time changes """
+        with open(path, 'w') as the_file:
+            the_file.write(contents)
+        os.utime(path, (time.time(), time.time() + len(contents)))
+
+    def test_lru_cache(self):
+        """ Validates the eviction, expiration and signature validation of the LRU cache """
+        cache = LRUCache(max_size=2)
+        cache.set('a', 1)
+        cache.set('b', 2)
+        self.assertEqual(cache.get('a'), 1)  # 'b' becomes the least recently used entry
+        cache.set('c', 3)
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual(cache.get('a'), 1)
+        cache.set('d', None, signature=1)
+        self.assertIs(cache.lookup('d', signature=1), None)
+        self.assertIs(cache.lookup('d', signature=2), LRUCache.NOT_FOUND)
+        self.assertEqual(cache.get_stats(), {'hits': 3, 'misses': 2, 'evictions': 2, 'expirations': 0, 'invalidations': 1, 'size': 1})
+
+        cache = LRUCache(max_size=None, ttl=0.05)
+        cache.set('a', 1)
+        self.assertEqual(cache.get('a'), 1)
+        time.sleep(0.1)
+        self.assertIsNone(cache.get('a'))
+        self.assertEqual(cache.get_stats()['expirations'], 1)
+        with self.assertRaises(ValueError):
+            LRUCache(max_size=0)
+
+    def test_cache_result(self):
+        """ Validates the argument aware memoization """
+        calls = []
+
+        @cache_result(max_size=10)
+        def _add(first, second=0):
+            calls.append((first, second))
+            return first + second
+
+        self.assertEqual(_add(1, second=2), 3)
+        self.assertEqual(_add(1, second=2), 3)
+        self.assertEqual(_add(2), 2)
+        self.assertEqual(_add([1], [2]), [1, 2])  # Unhashable arguments bypass the cache
+        self.assertEqual(calls, [(1, 2), (2, 0), ([1], [2])])
+        self.assertEqual(_add.cache.get_stats()['hits'], 1)
+        _add.cache.clear()
+        self.assertEqual(_add(1, second=2), 3)
+        self.assertEqual(len(calls), 4)
+
+    def test_cache_file(self):
+        """ Validates that results are re-used until the file changes """
+        path = os.path.join(self.folder, 'config')
+        self._write(path, 'first')
+        calls = []
+
+        @cache_file(path)
+        def _read(strip=False):
+            calls.append(strip)
+            with open(path) as the_file:
+                contents = the_file.read()
+            return contents.strip('f') if strip is True else contents
+
+        self.assertEqual(_read(), 'first')
+        self.assertEqual(_read(), 'first')
+        self.assertEqual(_read(strip=True), 'irst')
+        self.assertEqual(len(calls), 2)
+        self._write(path, 'second version')
+        self.assertEqual(_read(), 'second version')
+        os.rename(path, path + '.old')  # Replaced by a file with the same modification time and size
+        self._write(path, 'second version')
+        os.utime(path, (os.stat(path + '.old').st_atime, os.stat(path + '.old').st_mtime))
+        self.assertEqual(_read(), 'second version')
+        self.assertEqual(len(calls), 4)
+        self.assertEqual(_read.cache.get_stats()['invalidations'], 2)
+
+    def test_cache_file_watch(self):
+        """ Validates the inotify based invalidation and the fallback to stat information """
+        path = os.path.join(self.folder, 'config')
+        self._write(path, 'first')
+
+        def _read():
+            with open(path) as the_file:
+                return the_file.read()
+
+        def _wait_for(function, expected):
+            """ Changes are processed asynchronously by the watcher thread """
+            start = time.time()
+            while function() != expected and time.time() - start < 5:
+                time.sleep(0.01)
+            return function()
+
+        watched = cache_file(path, watch=True)(_read)
+        self.assertEqual(watched(), 'first')
+        self.assertIsNotNone(FileWatcher.get_version(path))
+        self.assertEqual(watched(), 'first')
+        self.assertEqual(watched.cache.get_stats()['hits'], 1)
+        self._write(path, 'second')
+        self.assertEqual(_wait_for(watched, 'second'), 'second')
+        replacement = os.path.join(self.folder, 'replacement')
+        self._write(replacement, 'third')
+        os.rename(replacement, path)
+        self.assertEqual(_wait_for(watched, 'third'), 'third')
+
+        # A link to a file in another directory is not watched, the stat information of its target is compared instead
+        target_folder = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, target_folder)
+        target = os.path.join(target_folder, 'target')
+        self._write(target, 'first')
+        link = os.path.join(self.folder, 'link')
+        os.symlink(target, link)
+        linked = cache_file(link, watch=True)(lambda: open(link).read())
+        self.assertEqual(linked(), 'first')
+        self.assertIsNone(FileWatcher.get_version(link))
+        self._write(target, 'second')
+        self.assertEqual(linked(), 'second')
+
+        FileWatcher.ENABLED = False
+        try:
+            other_path = os.path.join(self.folder, 'other')
+            self._write(other_path, 'first')
+            polled = cache_file(other_path, watch=True)(lambda: open(other_path).read())
+            self.assertEqual(polled(), 'first')
+            self.assertIsNone(FileWatcher.get_version(other_path))
+            self._write(other_path, 'second')
+            self.assertEqual(polled(), 'second')  # Stat information is compared synchronously
+        finally:
+            FileWatcher.ENABLED = True
+
+    def test_thread_safety(self):
+        """ Validates the cache under concurrent use """
+        @cache_result(max_size=50)
+        def _square(value):
+            return value * value
+
+        errors = []
+
+        def _run():
+            try:
+                for index in xrange(2000):
+                    if _square(index % 100) != (index % 100) ** 2:
+                        errors.append(index)
+            except Exception as ex:
+                errors.append(ex)
+
+        threads = [threading.Thread(target=_run) for _ in xrange(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(errors, [])
+        stats = _square.cache.get_stats()
+        self.assertEqual(stats['hits'] + stats['misses'], 8 * 2000)
+        self.assertLessEqual(stats['size'], 50)
@@ -0,0 +1,188 @@
+# Copyright (C) 2019 iNuron NV
+#
+# This file is part of Open vStorage Open Source Edition (OSE),
+# as available from
+#
+#      http://www.openvstorage.org and
+#      http://www.openvstorage.com.
+#
+# This file is free software; you can redistribute it and/or modify it
+# under the terms of the GNU Affero General Public License v3 (GNU AGPLv3)
+# as published by the Free Software Foundation, in version 3 as it comes
+# in the LICENSE.txt file of the Open vStorage OSE distribution.
+#
+# Open vStorage is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY of any kind.
+
+
+"""
+File watcher module
+"""
+
+import os
+import errno
+import ctypes
+import select
+import struct
+import logging
+import itertools
+import ctypes.util
+from threading import Lock, Thread
+
+
+class FileWatcher(object):
+    """
+    Watches files for changes using Linux inotify, from a single background thread per process.
+    Every watched file has a version, which changes whenever the kernel reports a change to the file, so checking
+    whether a file changed comes down to a dictionary lookup. Versions are never re-used within a process.
+    The parent directory of a file is watched instead of the file itself, so replacing a file (e.g. by renaming a new
+    file over it) is noticed as well.
+    Notes:
+    * Changes are noticed once the watcher thread processed the event, which happens asynchronously
+    * When inotify is unavailable (or a directory cannot be watched), `get_version` returns None and callers should
+      fall back to polling (e.g. comparing stat information)
+    * Symbolic links are not watched either: changes to their target happen in another directory (and the link can be
+      pointed elsewhere), so `get_version` returns None for paths of which the file or any parent directory is a link
+    """
+    ENABLED = True
+
+    # Event masks, see inotify(7)
+    IN_MODIFY = 0x00000002
+    IN_ATTRIB = 0x00000004
+    IN_CLOSE_WRITE = 0x00000008
+    IN_MOVED_FROM = 0x00000040
+    IN_MOVED_TO = 0x00000080
+    IN_CREATE = 0x00000100
+    IN_DELETE = 0x00000200
+    IN_DELETE_SELF = 0x00000400
+    IN_MOVE_SELF = 0x00000800
+    IN_Q_OVERFLOW = 0x00004000
+    IN_IGNORED = 0x00008000
+    IN_CLOEXEC = 0o2000000
+    WATCH_MASK = IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE | IN_DELETE_SELF | IN_MOVE_SELF
+
+    _EVENT_HEADER = struct.Struct('iIII')  # Watch descriptor, mask, cookie, length of the name
+
+    _logger = logging.getLogger(__name__)
+    _lock = Lock()
+    _libc = None
+    _fd = None
+    _thread = None
+    _counter = itertools.count()
+    _versions = {}  # Path - version (None when the path cannot be watched)
+    _watches = {}  # Directory - watch descriptor
+    _directories = {}  # Watch descriptor - directory
+    _UNKNOWN = object()
+
+    @classmethod
+    def get_version(cls, path):
+        # type: (str) -> Optional[int]
+        """
+        Retrieves the version of a file, starting to watch the file when called for the first time
+        :param path: Absolute path of the file
+        :type path: str
+        :return: The version of the file. None if the file cannot be watched
+        :rtype: int
+        """
+        version = cls._versions.get(path, cls._UNKNOWN)
+        if version is cls._UNKNOWN or cls._thread is None or not cls._thread.is_alive():  # The thread is gone after forking
+            return cls._watch(path)
+        return version
+
+    @classmethod
+    def _watch(cls, path):
+        """ Starts watching the given file. Check `get_version` """
+        with cls._lock:
+            if cls.ENABLED is False:
+                return None
+            if cls._thread is None or not cls._thread.is_alive():
+                cls._start()
+            if cls._fd is None:
+                return None
+            if path not in cls._versions:
+                if os.path.realpath(path) != path:
+                    cls._versions[path] = None
+                    return None
+                directory = os.path.dirname(path)
+                if directory not in cls._watches:
+                    watch_descriptor = cls._libc.inotify_add_watch(cls._fd, directory, cls.WATCH_MASK)
+                    if watch_descriptor < 0:
+                        cls._logger.warning('Unable to watch {0}: {1}'.format(directory, os.strerror(ctypes.get_errno())))
+                        cls._versions[path] = None
+                        return None
+                    cls._watches[directory] = watch_descriptor
+                    cls._directories[watch_descriptor] = directory
+                cls._versions[path] = next(cls._counter)
+            return cls._versions[path]
+
+    @classmethod
+    def _start(cls):
+        """ Initializes inotify and starts the watcher thread. Must be called while holding the lock """
+        if cls._fd is not None:  # Inherited from the parent process
+            try:
+                os.close(cls._fd)
+            except OSError:
+                pass
+        cls._fd = None
+        cls._versions = {}
+        cls._watches = {}
+        cls._directories = {}
+        try:
+            if cls._libc is None:
+                cls._libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+            fd = cls._libc.inotify_init1(cls.IN_CLOEXEC)
+        except (OSError, AttributeError) as ex:
+            cls._logger.warning('Inotify is not available: {0}'.format(ex))
+            return
+        if fd < 0:
+            cls._logger.warning('Inotify is not available: {0}'.format(os.strerror(ctypes.get_errno())))
+            return
+        cls._fd = fd
+        cls._thread = Thread(target=cls._run, args=(fd,), name='file_watcher')
+        cls._thread.daemon = True
+        cls._thread.start()
+
+    @classmethod
+    def _run(cls, fd):
+        """ Processes the inotify events of the given file descriptor """
+        while cls._fd == fd:
+            try:
+                select.select([fd], [], [])  # Cooperative when monkey patched by gevent
+                data = os.read(fd, 65536)
+            except (OSError, select.error) as ex:
+                if ex.args[0] == errno.EINTR:
+                    continue
+                cls._logger.exception('Watching files failed, no longer using inotify')
+                with cls._lock:
+                    cls.ENABLED = False
+                    cls._versions = {}
+                return
+            cls._process(data)
+
+    @classmethod
+    def _process(cls, data):
+        """ Changes the versions of the files changed by the given inotify events """
+        offset = 0
+        with cls._lock:
+            while offset < len(data):
+                watch_descriptor, mask, _, length = cls._EVENT_HEADER.unpack_from(data, offset)
+                name = data[offset + cls._EVENT_HEADER.size:offset + cls._EVENT_HEADER.size + length].rstrip('\0')
+                offset += cls._EVENT_HEADER.size + length
+                if mask & cls.IN_Q_OVERFLOW:  # Events were lost, consider all files changed
+                    for path, version in cls._versions.items():
+                        if version is not None:
+                            cls._versions[path] = next(cls._counter)
+                    continue
+                directory = cls._directories.get(watch_descriptor)
+                if directory is None:
+                    continue
+                if mask & (cls.IN_IGNORED | cls.IN_DELETE_SELF | cls.IN_MOVE_SELF):  # The directory is gone, its files are watched again on next use
+                    for path in [path for path in cls._versions if os.path.dirname(path) == directory]:
+                        cls._versions.pop(path)
+                    if mask & cls.IN_IGNORED:
+                        cls._directories.pop(watch_descriptor)
+                        cls._watches.pop(directory, None)
+                    continue
+                path = os.path.join(directory, name)
+                if cls._versions.get(path) is not None:
+                    cls._versions[path] = next(cls._counter)
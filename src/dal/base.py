@@ -18,9 +18,17 @@
 This package contains the DAL object's base class.
 """
 
+import os
 import json
+import types
 import sqlite3
+from ovs_extensions.dal.connectionpool import ConnectionPool
 from ovs_extensions.dal.relations import RelationMapper
+from ovs_extensions.dal.schemaregistry import SchemaRegistry
+from ovs_extensions.dal.serializers import JSONSerializer, deserialize
+from ovs_extensions.dal.session import Session
+from ovs_extensions.dal.structures import LazyProperty
+from ovs_extensions.dal.transaction import Transaction
 from ovs_extensions.generic.filemutex import file_mutex
 
 
@@ -29,6 +37,25 @@ class ObjectNotFoundException(Exception):
     pass
 
 
+class MetaClass(type):
+    """
+    Metaclass of all DAL objects. It gives every DAL object a compact, slot based layout built from its properties and
+    relations, instead of a per-instance dictionary. Classes explicitly defining __slots__ are left untouched.
+    Note: Base keeps a `__dict__` slot so attributes outside the properties and relations can still be set. That
+    dictionary is only allocated when such an attribute is actually set.
+    """
+    def __new__(mcs, name, bases, attrs):
+        if '__slots__' not in attrs:
+            inherited = set()
+            for base in bases:
+                for base_class in base.__mro__:
+                    inherited.update(base_class.__dict__.get('__slots__', ()))
+            slots = set(prop.name for prop in attrs.get('_properties', []))
+            slots.update('_{0}'.format(relation[0]) for relation in attrs.get('_relations', []))
+            attrs['__slots__'] = tuple(sorted(slots - inherited - set(attrs)))
+        return super(MetaClass, mcs).__new__(mcs, name, bases, attrs)
+
+
 # noinspection SqlDialectInspection,SqlNoDataSourceInspection,PyTypeChecker,PyProtectedMember
 class Base(object):
     """
@@ -39,16 +66,34 @@ class Base(object):
       2. The `ensure_table` function is called at some points in the DAL query. This function does -what's in a name-,
          ensures that the table for given requested object exists in the database, before continuing and performing
          other actions. Be sure to not unnecessarily call this function however, as it may result in unnecessary DB calls,
-         causing needless stress.
+         causing needless stress. The outcome of `ensure_table` is cached process wide by the SchemaRegistry: a table
+         is only checked again when the database file got replaced or its schema changed.
+      3. By default, every `connector` call opens a new SQLite connection. Calling `Base.enable_connection_pool()`
+         switches all DAL objects to a connection per thread (and per process) which is kept open and re-used.
+      4. Relations and foreign relations are loaded on access. Use a `Session` to re-use loaded instances and
+         `DataList.prefetch` (or the `prefetch` argument of `DataList.query`) to load them for many objects at once.
+      5. Every `save` and `delete` is committed on its own. Use `Base.transaction()`, `Base.bulk_save` or
+         `Base.bulk_delete` to group many writes into a single SQLite transaction.
+      6. The relation, foreign relation and dynamic properties are installed on the class once, when the first
+         instance of the class is created. Instances use slots (see MetaClass) instead of a dictionary.
+      7. List, dict and None typed properties are serialized by the SERIALIZER of the object (or of the property) and
+         only deserialized when accessed. Stored values are read regardless of the serializer that wrote them, so
+         switching serializers does not require migrating existing rows. Check ovs_extensions.dal.serializers
     """
+    __metaclass__ = MetaClass
+    __slots__ = ('id', '_original', '_foreign_relations', '__dict__', '__weakref__')
+
     NAME = None
     SOURCE_FOLDER = None
     DATABASE_FOLDER = None
+    USE_CONNECTION_POOL = False
+    SERIALIZER = JSONSerializer
 
     _table = None
     _dynamics = []
     _relations = []
     _properties = []
+    _lazy_properties = frozenset()
 
     def __init__(self, identifier=None, ensure_table=True):
         """
@@ -58,73 +103,195 @@ class Base(object):
         :param ensure_table: Indicates whether the constructor should make sure that the table exists. Check class description for more info
         :type ensure_table: bool
         """
+        self._prepare()
         self.id = identifier
+        self._original = {}
+        self._foreign_relations = None
         if ensure_table:
             self._ensure_table()
-        with self.connector() as connection:
-            if identifier is not None:
+        if identifier is not None:
+            with self.connector() as connection:
                 cursor = connection.cursor()
                 cursor.execute('SELECT * FROM {0} WHERE id=?'.format(self._table), [self.id])
                 row = cursor.fetchone()
-                if row is None:
-                    raise ObjectNotFoundException()
-                for prop in self._properties:
-                    setattr(self, prop.name, Base._deserialize(prop.property_type, row[prop.name]))
-                for relation in self._relations:
-                    setattr(self, '_{0}'.format(relation[0]), {'id': row['_{0}_id'.format(relation[0])],
-                                                               'object': None})
-            else:
-                for prop in self._properties:
-                    setattr(self, prop.name, None)
-                for relation in self._relations:
-                    setattr(self, '_{0}'.format(relation[0]), {'id': None,
-                                                               'object': None})
+            if row is None:
+                raise ObjectNotFoundException()
+            self._load(row)
+        else:
+            for prop in self._properties:
+                setattr(self, prop.name, None)
+            for relation in self._relations:
+                setattr(self, '_{0}'.format(relation[0]), {'id': None,
+                                                           'object': None})
+        session = Session.get_current()
+        if session is not None:
+            session.add(self)
+
+    @classmethod
+    def _from_row(cls, row):
+        """
+        Creates an object out of a full database row (as returned by `SELECT * FROM {table}`) without querying the database
+        Within a session, the instance already known to the session is returned instead
+        :param row: Row containing the primary key and all property and relation columns
+        :type row: sqlite3.Row
+        :return: The object
+        :rtype: Base
+        """
+        session = Session.get_current()
+        if session is not None:
+            instance = session.get(cls, row['id'])
+            if instance is not None:
+                return instance
+        cls._prepare()
+        instance = cls.__new__(cls)
+        instance.id = row['id']
+        instance._foreign_relations = None
+        instance._load(row)
+        if session is not None:
+            session.add(instance)
+        return instance
+
+    @classmethod
+    def _get_instance(cls, identifier):
+        """
+        Retrieves the object with the given identifier. Within a session, the instance known to the session is re-used
+        :param identifier: Identifier (primary key)
+        :type identifier: int
+        :return: The object
+        :rtype: Base
+        """
+        session = Session.get_current()
+        if session is not None:
+            instance = session.get(cls, identifier)
+            if instance is not None:
+                return instance
+        return cls(identifier)
+
+    @classmethod
+    def _get_columns(cls):
+        """ Returns the names of all columns of the table of this object """
+        return ['id'] + [prop.name for prop in cls._properties] + ['_{0}_id'.format(relation[0]) for relation in cls._relations]
+
+    def _load(self, row):
+        """ Loads the properties and relations from a database row. The row is kept to detect changes on save """
+        self._original = row
+        for prop in self._properties:
+            if prop.name not in self._lazy_properties:  # Lazy properties are deserialized from the row on access
+                setattr(self, prop.name, Base._deserialize(prop.property_type, row[prop.name]))
         for relation in self._relations:
-            self._add_relation(relation)
-        for key, relation_info in RelationMapper.load_foreign_relations(self.__class__).iteritems():
-            self._add_foreign_relation(key, relation_info)
-        for key in self._dynamics:
-            self._add_dynamic(key)
+            setattr(self, '_{0}'.format(relation[0]), {'id': row['_{0}_id'.format(relation[0])],
+                                                       'object': None})
+
+    @classmethod
+    def _prepare(cls):
+        """ Adds the relation, foreign relation, dynamic and lazy properties to the class. Only executed once per class """
+        if cls.__dict__.get('_prepared') is True:
+            return
+        for prop in cls._properties:
+            if prop.property_type in [list, dict, None]:
+                cls._add_lazy(prop)
+        cls._lazy_properties = frozenset(prop.name for prop in cls._properties if isinstance(getattr(cls, prop.name, None), LazyProperty))
+        for relation in cls._relations:
+            cls._add_relation(relation)
+        for key, relation_info in RelationMapper.load_foreign_relations(cls).iteritems():
+            cls._add_foreign_relation(key, relation_info)
+        for key in cls._dynamics:
+            cls._add_dynamic(key)
+        cls._prepared = True
 
     @classmethod
     def connector(cls):
-        """ Creates and returns a new connection to SQLite. """
-        connection = sqlite3.connect('{0}/main.db'.format(cls.DATABASE_FOLDER), timeout=60.0)
+        """ Returns a connection to SQLite. The connection is only newly created when the connection pool is not used and no transaction is running. """
+        database = cls._get_database()
+        if Transaction.is_active():
+            return Transaction.get_connection(database, lambda: cls._connect(database))
+        return cls._connect(database)
+
+    @classmethod
+    def _connect(cls, database):
+        """ Returns a pooled or a new connection to the given database """
+        if cls.USE_CONNECTION_POOL is True:
+            return ConnectionPool.get_connection(database)
+        connection = sqlite3.connect(database, timeout=60.0)
         connection.row_factory = sqlite3.Row
         return connection
 
-    def _add_dynamic(self, key):
+    @classmethod
+    def _get_database(cls):
+        """ Returns the path to the SQLite database file """
+        return '{0}/main.db'.format(cls.DATABASE_FOLDER)
+
+    @classmethod
+    def enable_connection_pool(cls, enabled=True):
+        # type: (bool) -> None
+        """
+        Toggles the use of the connection pool. When called on Base, it applies to all DAL objects
+        :param enabled: Use the connection pool or not
+        :type enabled: bool
+        :return: None
+        :rtype: NoneType
+        """
+        cls.USE_CONNECTION_POOL = enabled
+
+    @classmethod
+    def _add_lazy(cls, prop):
+        """ Wraps the slot of a property with a LazyProperty. Properties without slot (see MetaClass) are loaded eagerly """
+        for klass in cls.__mro__:
+            member = klass.__dict__.get(prop.name)
+            if isinstance(member, types.MemberDescriptorType):
+                setattr(klass, prop.name, LazyProperty(member, lambda s: Base._deserialize(prop.property_type, s._original[prop.name])))
+                return
+            if member is not None:  # Already lazy or overruled
+                return
+
+    @classmethod
+    def _add_dynamic(cls, key):
         """ Generates a new dynamic value on an object. """
-        setattr(self.__class__, key, property(lambda s: getattr(s, '_{0}'.format(key))()))
+        setattr(cls, key, property(lambda s: getattr(s, '_{0}'.format(key))()))
 
-    def _add_foreign_relation(self, key, relation_info):
+    @classmethod
+    def _add_foreign_relation(cls, key, relation_info):
         """ Generates a new foreign relation on an object. """
-        setattr(self.__class__, key, property(lambda s: s._get_foreign_relation(relation_info)))
+        setattr(cls, key, property(lambda s: s._get_foreign_relation(relation_info)))
 
     def _get_foreign_relation(self, relation_info):
-        """ Getter logic for a foreign relation. """
+        """
+        Getter logic for a foreign relation.
+        Prefetched entries (see DataList.prefetch) are re-used. Within a session, the loaded entries are kept as well.
+        """
         remote_class = relation_info['class']
+        cache_key = (remote_class, relation_info['key'])
+        if self._foreign_relations is not None and cache_key in self._foreign_relations:
+            return list(self._foreign_relations[cache_key])
         remote_class._ensure_table()
         entries = []
         with self.connector() as connection:
             cursor = connection.cursor()
-            cursor.execute('SELECT id FROM {0} WHERE _{1}_id=?'.format(remote_class._table, relation_info['key']),
+            cursor.execute('SELECT * FROM {0} WHERE _{1}_id=? ORDER BY id'.format(remote_class._table, relation_info['key']),
                            [self.id])
             for row in cursor.fetchall():
-                entries.append(remote_class(row['id'], ensure_table=False))
+                entries.append(remote_class._from_row(row))
+        session = Session.get_current()
+        if session is not None:
+            if self._foreign_relations is None:
+                self._foreign_relations = {}
+            self._foreign_relations[cache_key] = entries
+            session.hold_relations(self)
+            return list(entries)
         return entries
 
-    def _add_relation(self, relation):
+    @classmethod
+    def _add_relation(cls, relation):
         """ Generates a new relation on an object. """
-        setattr(self.__class__, relation[0], property(lambda s: s._get_relation(relation),
-                                                      lambda s, v: s._set_relation(relation, v)))
-        setattr(self.__class__, '{0}_id'.format(relation[0]), property(lambda s: s._get_relation_id(relation)))
+        setattr(cls, relation[0], property(lambda s: s._get_relation(relation),
+                                           lambda s, v: s._set_relation(relation, v)))
+        setattr(cls, '{0}_id'.format(relation[0]), property(lambda s: s._get_relation_id(relation)))
 
     def _get_relation(self, relation):
         """ Getter for a relation. """
         data = getattr(self, '_{0}'.format(relation[0]))
         if data['object'] is None and data['id'] is not None:
-            data['object'] = relation[1](data['id'])
+            data['object'] = (relation[1] or self.__class__)._get_instance(data['id'])
         return data['object']
 
     def _set_relation(self, relation, value):
@@ -141,33 +308,79 @@ class Base(object):
         """ Getter for a relation identifier. """
         return getattr(self, '_{0}'.format(relation[0]))['id']
 
+    def _get_values(self):
+        """
+        Serializes all properties and relations
+        :return: List of column name - column value pairs, in the order of the table columns (excluding the identifier)
+        :rtype: list[tuple(str, any)]
+        """
+        values = []
+        for prop in self._properties:
+            if prop.name in self._lazy_properties and not getattr(self.__class__, prop.name).is_loaded(self):  # Never accessed, so unchanged
+                values.append((prop.name, self._original[prop.name]))
+                continue
+            value = getattr(self, prop.name)
+            if prop.property_type is None and prop.mandatory is True and value is None:  # None value would otherwise be serialized to 'null', bypassing the mandatory CONSTRAINT
+                values.append((prop.name, None))
+            else:
+                values.append((prop.name, Base._serialize(prop.property_type, value, prop.serializer or self.SERIALIZER)))
+        for relation in self._relations:
+            data = getattr(self, '_{0}'.format(relation[0]))
+            if data['id'] is None and data['object'] is not None:  # Remote object was saved after the relation was set
+                data['id'] = data['object'].id
+            values.append(('_{0}_id'.format(relation[0]), data['id']))
+        return values
+
+    def _get_changes(self):
+        """
+        Serializes the properties and relations which changed since the object was loaded or saved (all for new objects)
+        Changes are detected by comparing the serialized values, so in-place changes to list or dict properties count too.
+        Serialized values which differ are deserialized and compared again, as another serializer (or the JSON text written
+        before serializers were pluggable) may have stored an equal value differently
+        :return: List of column name - column value pairs, in the order of the table columns (excluding the identifier)
+        :rtype: list[tuple(str, any)]
+        """
+        values = self._get_values()
+        if self.id is None:
+            return values
+        if isinstance(self._original, sqlite3.Row):  # Only converted when required, keeping loaded objects compact
+            self._original = dict(zip(self._original.keys(), self._original))
+        serialized = set(prop.name for prop in self._properties if prop.property_type in [list, dict, None])
+        changes = []
+        for column, value in values:
+            if column in self._original:
+                original = self._original[column]
+                # Text is never compared with a BLOB (msgpack), as comparing a unicode string with a buffer warns
+                if isinstance(original, buffer) is isinstance(value, buffer) and original == value:
+                    continue
+                if column in serialized and original is not None and value is not None and deserialize(original) == deserialize(value):
+                    continue
+            changes.append((column, value))
+        return changes
+
     def save(self):
         """
         Saves the current object. If not existing, it is created and the identifier field is filled.
+        Only the changed properties and relations of existing objects are written.
         :return: None
         """
-        prop_values = []
-        for prop in self._properties:
-            if prop.property_type is None and prop.mandatory is True and getattr(self, prop.name) is None:  # None value would otherwise be JSON serialized to 'null', bypassing the mandatory CONSTRAINT
-                prop_values.append(None)
-            else:
-                prop_values.append(Base._serialize(prop.property_type, getattr(self, prop.name)))
-        prop_values.extend([getattr(self, '_{0}'.format(relation[0])).get('id') for relation in self._relations])
+        changes = self._get_changes()
         if self.id is None:
-            field_names = ', '.join([prop.name for prop in self._properties] +
-                                    ['_{0}_id'.format(relation[0]) for relation in self._relations])
-            prop_statement = ', '.join('?' for _ in self._properties + self._relations)
             with self.connector() as connection:
                 cursor = connection.cursor()
-                cursor.execute('INSERT INTO {0}({1}) VALUES ({2})'.format(self._table, field_names, prop_statement),
-                               prop_values)
+                cursor.execute('INSERT INTO {0}({1}) VALUES ({2})'.format(self._table,
+                                                                          ', '.join(column for column, _ in changes),
+                                                                          ', '.join('?' for _ in changes)),
+                               [value for _, value in changes])
                 self.id = cursor.lastrowid
-        else:
-            prop_statement = ', '.join(['{0}=?'.format(prop.name) for prop in self._properties] +
-                                       ['_{0}_id=?'.format(relation[0]) for relation in self._relations])
+        elif changes:
             with self.connector() as connection:
-                connection.execute('UPDATE {0} SET {1} WHERE id=? LIMIT 1'.format(self._table, prop_statement),
-                                   prop_values + [self.id])
+                connection.execute('UPDATE {0} SET {1} WHERE id=? LIMIT 1'.format(self._table, ', '.join('{0}=?'.format(column) for column, _ in changes)),
+                                   [value for _, value in changes] + [self.id])
+        self._original.update(changes)
+        session = Session.get_current()
+        if session is not None:
+            session.changed(self)
 
     def delete(self):
         """
@@ -176,6 +389,121 @@ class Base(object):
         """
         with self.connector() as connection:
             connection.execute('DELETE FROM {0} WHERE id=? LIMIT 1'.format(self._table), [self.id])
+        session = Session.get_current()
+        if session is not None:
+            session.changed(self, deleted=True)
+
+    @classmethod
+    def transaction(cls):
+        # type: () -> Transaction
+        """
+        Groups all saves and deletes of the current thread into a single SQLite transaction. Check Transaction for more info
+        Usage:
+        with Base.transaction():
+            node.save()
+            disk.delete()
+        :return: The transaction, to be used as a context manager
+        :rtype: Transaction
+        """
+        return Transaction()
+
+    @classmethod
+    def bulk_save(cls, objects):
+        # type: (List[Base]) -> None
+        """
+        Saves the given objects in a single transaction, using a single statement per object type and set of changed columns.
+        New objects get their identifier assigned. Object types are saved in the order in which they first appear,
+        so objects relating to new objects should be listed after them.
+        :param objects: Objects to save
+        :type objects: list[Base]
+        :return: None
+        :rtype: NoneType
+        """
+        with cls.transaction():
+            for object_type, entries in Base._group_by_type(objects):
+                object_type._ensure_table()
+                existing_entries = [entry for entry in entries if entry.id is not None]
+                object_type._bulk_insert([entry for entry in entries if entry.id is None])
+                object_type._bulk_update(existing_entries)
+        session = Session.get_current()
+        if session is not None:
+            for entry in objects:
+                session.changed(entry)
+
+    @classmethod
+    def bulk_delete(cls, objects):
+        # type: (List[Base]) -> None
+        """
+        Deletes the given objects in a single transaction, using a single statement per object type
+        :param objects: Objects to delete
+        :type objects: list[Base]
+        :return: None
+        :rtype: NoneType
+        """
+        with cls.transaction():
+            for object_type, entries in Base._group_by_type(objects):
+                with object_type.connector() as connection:
+                    connection.executemany('DELETE FROM {0} WHERE id=?'.format(object_type._table), [[entry.id] for entry in entries])
+        session = Session.get_current()
+        if session is not None:
+            for entry in objects:
+                session.changed(entry, deleted=True)
+
+    @staticmethod
+    def _group_by_type(objects):
+        """ Groups the given objects per type, in the order the types first appear """
+        groups = []
+        group_map = {}
+        for entry in objects:
+            if entry.__class__ not in group_map:
+                group_map[entry.__class__] = []
+                groups.append((entry.__class__, group_map[entry.__class__]))
+            group_map[entry.__class__].append(entry)
+        return groups
+
+    @classmethod
+    def _bulk_insert(cls, objects):
+        """
+        Inserts the given new objects using a single statement. Must be called within a transaction.
+        The identifiers are handed out upfront, which is safe as the transaction holds the write lock.
+        """
+        if not objects:
+            return
+        with cls.connector() as connection:
+            last_id = connection.execute('SELECT MAX(id) FROM {0}'.format(cls._table)).fetchone()[0] or 0
+            sequence = connection.execute('SELECT seq FROM sqlite_sequence WHERE name=?', [cls._table]).fetchone()
+            if sequence is not None:
+                last_id = max(last_id, sequence[0])
+            columns = cls._get_columns()
+            rows = []
+            changes = []
+            for index, entry in enumerate(objects):
+                values = entry._get_values()
+                rows.append([last_id + index + 1] + [value for _, value in values])
+                changes.append(values)
+            connection.executemany('INSERT INTO {0}({1}) VALUES ({2})'.format(cls._table, ', '.join(columns), ', '.join('?' for _ in columns)),
+                                   rows)
+        for entry, row, values in zip(objects, rows, changes):
+            entry.id = row[0]
+            entry._original.update(values)
+
+    @classmethod
+    def _bulk_update(cls, objects):
+        """ Updates the changed columns of the given existing objects, using a single statement per set of changed columns """
+        statements = {}
+        for entry in objects:
+            changes = entry._get_changes()
+            if changes:
+                statements.setdefault(tuple(column for column, _ in changes), []).append((entry, changes))
+        if not statements:
+            return
+        with cls.connector() as connection:
+            for columns, entries in statements.iteritems():
+                connection.executemany('UPDATE {0} SET {1} WHERE id=?'.format(cls._table, ', '.join('{0}=?'.format(column) for column in columns)),
+                                       [[value for _, value in changes] + [entry.id] for entry, changes in entries])
+        for entries in statements.itervalues():
+            for entry, changes in entries:
+                entry._original.update(changes)
 
     @staticmethod
     def _get_prop_type(prop_type):
@@ -192,25 +520,76 @@ class Base(object):
         if prop_type in [int, str, basestring, unicode]:
             return data
         if prop_type in [list, dict, None]:
-            return json.loads(data) if data is not None else None
+            return deserialize(data) if data is not None else None
         if prop_type in [bool]:
             return data == 1
         raise ValueError('The type {0} is not supported. Supported types: int, str, list, dict, bool'.format(prop_type))
 
     @staticmethod
-    def _serialize(prop_type, data):
-        """ Serializes a python type to a SQLite field. """
+    def _serialize(prop_type, data, serializer=JSONSerializer):
+        """ Serializes a python type to a SQLite field. List, dict and None types are serialized by the given serializer """
         if prop_type in [int, str, basestring, unicode]:
             return data
         if prop_type in [list, dict, None]:
-            return json.dumps(data, sort_keys=True)
+            return serializer.serialize(data)
         if prop_type in [bool]:
             return 1 if data else 0
         raise ValueError('The type {0} is not supported. Supported types: int, str, list, dict, bool'.format(prop_type))
 
+    @classmethod
+    def _get_file_state(cls):
+        # type: () -> Optional[tuple]
+        """
+        Retrieves the state of the database files, used to determine whether the schema fingerprint needs to be read again
+        Writes to a database in WAL mode only reach the database file itself when checkpointing, so the WAL file is included
+        :return: The inode, modification time and size of the database file and the modification time and size of its WAL file. None if the database does not exist yet
+        :rtype: tuple
+        """
+        database = cls._get_database()
+        try:
+            stat = os.stat(database)
+        except OSError:
+            return None
+        try:
+            wal_stat = os.stat('{0}-wal'.format(database))
+            wal_state = (wal_stat.st_mtime, wal_stat.st_size)
+        except OSError:
+            wal_state = None
+        return stat.st_ino, stat.st_mtime, stat.st_size, wal_state
+
+    @staticmethod
+    def _get_schema_fingerprint(connection, file_state):
+        # type: (Connection, tuple) -> Tuple[int, int]
+        """
+        Fingerprints the database schema, used to determine whether tables need to be checked again
+        :param connection: An open connection to the database
+        :type connection: sqlite3.Connection
+        :param file_state: State of the database files
+        :type file_state: tuple
+        :return: The inode of the database file and the SQLite schema version
+        :rtype: tuple
+        """
+        return file_state[0], connection.execute('PRAGMA schema_version').fetchone()[0]
+
+    @classmethod
+    def get_schema_stats(cls):
+        # type: () -> Dict[str, int]
+        """
+        Retrieve the statistics of the table checks (`_ensure_table`) for this process
+        :return: The amount of checks performed and skipped and the amount of tables known to be up to date
+        :rtype: dict
+        """
+        return SchemaRegistry.get_stats()
+
     @classmethod
     def _ensure_table(cls):
         # type (None): -> None
+        database = cls._get_database()
+        if SchemaRegistry.is_ensured(database, cls, cls._get_file_state()):
+            return
+        if Transaction.is_active() and Transaction.has_after_commit((database, cls)):  # Already ensured within the running transaction
+            return
+
         relation_list = ['_{0}_id'.format(relation[0]) for relation in cls._relations]
         relations = ['{0} INTEGER'.format(relation) for relation in relation_list]
         properties = ['{0} {1} {2} {3}'.format(prop.name,
@@ -220,6 +599,9 @@ class Base(object):
         primary_key = ['id INTEGER PRIMARY KEY AUTOINCREMENT']
 
         with cls.connector() as connection:
+            file_state = cls._get_file_state()
+            if SchemaRegistry.is_schema_ensured(database, cls, cls._get_schema_fingerprint(connection, file_state), file_state):
+                return
             connection.execute('CREATE TABLE IF NOT EXISTS {0} ({1})'.format(cls._table, ', '.join(primary_key + properties + relations)))
             cursor = connection.cursor()
             cursor.execute('PRAGMA table_info({0})'.format(cls._table))
@@ -242,6 +624,24 @@ class Base(object):
                 if rel_name not in current_relations:
                     connection.execute('ALTER TABLE {0} ADD COLUMN {1} INTEGER'.format(cls._table, rel_name))
 
+            # Relations are always indexed, as they are used to look up foreign relations
+            for column in [prop.name for prop in cls._properties if prop.indexed is True and prop.unique is not True] + relation_list:
+                connection.execute('CREATE INDEX IF NOT EXISTS idx_{0}_{1} ON {0}({1})'.format(cls._table, column))
+        if Transaction.is_active():
+            # The table changes can still be rolled back, so the table is only registered once the transaction was committed
+            Transaction.after_commit((database, cls), lambda: cls._register_table(database))
+        else:
+            cls._register_table(database, connection)
+
+    @classmethod
+    def _register_table(cls, database, connection=None):
+        # type: (str, Optional[Connection]) -> None
+        """ Registers the table as ensured in the SchemaRegistry """
+        if connection is None:
+            connection = cls.connector()
+        file_state = cls._get_file_state()
+        SchemaRegistry.register(database, cls, cls._get_schema_fingerprint(connection, file_state), file_state)
+
     @classmethod
     def _update_table(cls):
         # type: (None) -> None
@@ -301,6 +701,7 @@ class Base(object):
                                   "COMMIT;"
                                   "PRAGMA foreign_keys = on;"
                                   "".format(cls._table, str(set), set.names()))
+            SchemaRegistry.invalidate(database=cls._get_database())
 
     def __repr__(self):
         """ Short representation of the object. """
@@ -0,0 +1,141 @@
+# Copyright (C) 2019 iNuron NV
+#
+# This file is part of Open vStorage Open Source Edition (OSE),
+# as available from
+#
+#      http://www.openvstorage.org and
+#      http://www.openvstorage.com.
+#
+# This file is free software; you can redistribute it and/or modify it
+# under the terms of the GNU Affero General Public License v3 (GNU AGPLv3)
+# as published by the Free Software Foundation, in version 3 as it comes
+# in the LICENSE.txt file of the Open vStorage OSE distribution.
+#
+# Open vStorage is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY of any kind.
+
+
+"""
+SQLite connection pool module
+"""
+
+import os
+import sqlite3
+import threading
+
+# noinspection PyUnreachableCode
+if False:
+    from typing import Dict
+
+
+class ConnectionPool(object):
+    """
+    Keeps a single SQLite connection per thread, per process and per database file.
+    Notes:
+    - SQLite connections can't be shared between threads (check_same_thread) and should never be carried over a fork().
+      Every thread therefore gets its own connections and a child process will discard all connections it inherited.
+    - The inherited connections are kept referenced but never closed: closing them in the child could checkpoint or
+      unlink the write-ahead log the parent process is still working with. Only the MAX_ORPHANS most recently inherited
+      connections are kept, as every generation of forked processes would otherwise add to them. Older ones are closed
+      when garbage collected, by then their parent process most likely moved on or exited.
+    - Connections of threads which ended are closed when their thread-local storage is garbage collected.
+    - Prepared statements are cached by the sqlite3 module itself (cached_statements), which only pays off when the
+      connection lives longer than a single query.
+    """
+    TIMEOUT = 60.0
+    CACHED_STATEMENTS = 256
+    MAX_ORPHANS = 64
+    PRAGMAS = [('journal_mode', 'WAL'),     # Readers no longer block the writer and vice versa
+               ('synchronous', 'NORMAL'),   # Safe in WAL mode, only fsyncs during checkpoints
+               ('temp_store', 'MEMORY'),
+               ('cache_size', -8192)]       # In KiB, per connection
+
+    _local = threading.local()
+    _lock = threading.Lock()
+    _orphans = []
+    _stats = {'created': 0,
+              'reused': 0,
+              'discarded': 0}
+
+    @classmethod
+    def get_connection(cls, database):
+        # type: (str) -> sqlite3.Connection
+        """
+        Retrieve the connection to the given database for the current thread. The connection is created when required
+        :param database: Path to the SQLite database file
+        :type database: str
+        :return: The connection
+        :rtype: sqlite3.Connection
+        """
+        connections = cls._get_connections()
+        connection = connections.get(database)
+        if connection is None:
+            connection = cls._create_connection(database)
+            connections[database] = connection
+            with cls._lock:
+                cls._stats['created'] += 1
+        else:
+            with cls._lock:
+                cls._stats['reused'] += 1
+        return connection
+
+    @classmethod
+    def close(cls):
+        # type: () -> None
+        """
+        Closes all connections of the current thread
+        :return: None
+        :rtype: NoneType
+        """
+        connections = cls._get_connections()
+        while connections:
+            _, connection = connections.popitem()
+            connection.close()
+
+    @classmethod
+    def get_stats(cls):
+        # type: () -> Dict[str, int]
+        """
+        Retrieve the usage statistics of the pool
+        :return: Number of connections created, reused and discarded (after a fork)
+        :rtype: dict
+        """
+        with cls._lock:
+            return cls._stats.copy()
+
+    @classmethod
+    def _get_connections(cls):
+        # type: () -> Dict[str, sqlite3.Connection]
+        """
+        Retrieve the connections of the current thread, discarding the ones inherited from a parent process
+        :return: The connections, keyed by their database path
+        :rtype: dict
+        """
+        local = cls._local
+        pid = os.getpid()
+        if getattr(local, 'pid', None) != pid:
+            inherited = getattr(local, 'connections', {})
+            if inherited:
+                with cls._lock:
+                    cls._orphans.extend(inherited.values())
+                    del cls._orphans[:-cls.MAX_ORPHANS]
+                    cls._stats['discarded'] += len(inherited)
+            local.pid = pid
+            local.connections = {}
+        return local.connections
+
+    @classmethod
+    def _create_connection(cls, database):
+        # type: (str) -> sqlite3.Connection
+        """
+        Creates a new connection and tunes it
+        :param database: Path to the SQLite database file
+        :type database: str
+        :return: The connection
+        :rtype: sqlite3.Connection
+        """
+        connection = sqlite3.connect(database, timeout=cls.TIMEOUT, cached_statements=cls.CACHED_STATEMENTS)
+        connection.row_factory = sqlite3.Row
+        for pragma, value in cls.PRAGMAS:
+            connection.execute('PRAGMA {0}={1}'.format(pragma, value)).fetchall()
+        return connection
@@ -18,6 +18,11 @@
 This package contains the DAL list engine
 """
 
+from ovs_extensions.dal.base import Base, ObjectNotFoundException
+from ovs_extensions.dal.relations import RelationMapper
+from ovs_extensions.dal.serializers import JSONSerializer
+from ovs_extensions.dal.session import Session
+
 
 # noinspection PyProtectedMember
 class DataList(object):
@@ -25,38 +30,449 @@ class DataList(object):
     The DataList class contains method(s) to query the underlying SQLite database.
     """
 
+    # Amount of rows hydrated at once. Must stay below SQLITE_MAX_VARIABLE_NUMBER (999) for the `IN (...)` lookups
+    CHUNK_SIZE = 500
+
     @staticmethod
-    def query(object_type, query, parameters=None):
+    def query(object_type, query, parameters=None, lazy=False, prefetch=None):
         """
         This is a basic query wrapper that exposes a few "user friendly" features:
         * Translates relations to their internal fields:
           `SELECT node_id FROM setting WHERE node_id=?` => `SELECT _node_id FROM setting WHERE node_id=?`
         * Table translation (only for the table of the given object type):
           `SELECT id FROM {table} WHERE name=?` => `SELECT id FROM setting WHERE name=?`
+        * Eager loading of (foreign) relations, see `prefetch`
 
         A few remarks/limitations:
-        * This isn't written (nor meant to be) very efficient. It requires the query to return the primary key(s) of
-          the  objects to return and will execute a separate query to fetch the actual data and yield the object.
-        * While the DAL supports more complex objects like `list` and `dict`, these are serialized into JSON, and should
-          be queried as such. E.g. a list property might contains ['foo', 'bar'], but when executing queries, keep in
-          mind the DB's content will be '["bar","foo"].
+        * The query must return the primary key of the objects as first column.
+          - When the query returns full rows (e.g. `SELECT * FROM {table} WHERE ...`), the objects are built straight
+            from the result, without any additional query. This is the preferred way of querying.
+          - When the query only returns the primary key(s), the objects are fetched in chunks using `WHERE id IN (...)`
+        * While the DAL supports more complex objects like `list` and `dict`, these are serialized (by default into JSON),
+          and should be queried as such. E.g. a list property might contains ['foo', 'bar'], but when executing queries,
+          keep in mind the DB's content will be '["foo","bar"]'.
 
         :param object_type: The object type to return
         :param query: The SQLite compatibly query
         :param parameters: SQLite compatible query parameters
-        :return: Yields instances of the given object type
+        :param lazy: Return a generator which fetches and hydrates the objects per chunk instead of a list
+        :type lazy: bool
+        :param prefetch: (Foreign) relations to load eagerly for all returned objects. When lazy, this happens per chunk
+        :type prefetch: list[str]
+        :return: List (or generator when lazy) of instances of the given object type
         """
-        entries = []
         if parameters is None:
             parameters = []
+        if prefetch is None:
+            prefetch = []
         object_type._ensure_table()
         query = query.format(table=object_type._table)
         for relation in object_type._relations:
             query = query.replace('{0}_id'.format(relation[0]),
                                   '_{0}_id'.format(relation[0]))
+        return DataList._query(object_type, query, parameters, lazy, prefetch)
+
+    @staticmethod
+    def filter(object_type, **conditions):
+        """
+        Starts a parameterized query for the given object type. Check DataQuery for more info
+        Usage: DataList.filter(Disk, node=node, size__gte=1024).order_by('-size').limit(10).all()
+        :param object_type: The object type to query
+        :param conditions: Conditions the objects must match
+        :return: The query
+        :rtype: DataQuery
+        """
+        return DataQuery(object_type).filter(**conditions)
+
+    @staticmethod
+    def _query(object_type, query, parameters, lazy, prefetch):
+        """ Executes an already translated query, check `query` """
+        if lazy is True:
+            return DataList._iterate(object_type, query, parameters, prefetch)
+        with object_type.connector() as connection:
+            entries = []
+            for chunk in DataList._hydrate(object_type, connection, connection.execute(query, parameters)):
+                entries.extend(chunk)
+        DataList.prefetch(entries, *prefetch)
+        return entries
+
+    @staticmethod
+    def prefetch(objects, *relations):
+        """
+        Eagerly loads relations and foreign relations of the given objects, using one query per relation (per chunk of
+        CHUNK_SIZE objects) instead of one query per object when the relation is accessed.
+        Nested relations are separated by a dot: `DataList.prefetch(nodes, 'disks', 'disks.osds', 'disks.osds.disk')`
+        Notes:
+        * The objects must all be of the same type
+        * Prefetched foreign relations are kept on the objects: later changes to the database are not reflected
+        :param objects: The objects to load the relations for
+        :type objects: list[ovs_extensions.dal.base.Base]
+        :param relations: Names of the (foreign) relations to load
+        :type relations: str
+        :return: None
+        :rtype: NoneType
+        """
+        for path in relations:
+            current = objects
+            for name in path.split('.'):
+                current = DataList._prefetch(current, name)
+
+    @staticmethod
+    def _prefetch(objects, name):
+        """
+        Eagerly loads a single (foreign) relation
+        :param objects: The objects to load the relation for
+        :param name: Name of the relation or foreign relation
+        :return: All distinct objects on the remote side of the relation
+        """
+        if not objects:
+            return []
+        object_type = objects[0].__class__
+        remote_objects = []
+        for relation in object_type._relations:
+            if relation[0] != name:
+                continue
+            relation_data = [getattr(obj, '_{0}'.format(name)) for obj in objects]
+            identifiers = set(data['id'] for data in relation_data if data['object'] is None and data['id'] is not None)
+            remotes = dict((remote.id, remote) for remote in DataList._fetch(relation[1] or object_type, 'id', identifiers))
+            for data in relation_data:
+                if data['object'] is None and data['id'] in remotes:
+                    data['object'] = remotes[data['id']]
+                if data['object'] is not None:
+                    remote_objects.append(data['object'])
+            return DataList._unique(remote_objects)
+
+        relation_info = RelationMapper.load_foreign_relations(object_type).get(name)
+        if relation_info is None:
+            raise ValueError('{0} has no relation or foreign relation named {1}'.format(object_type.__name__, name))
+        remote_class = relation_info['class']
+        cache_key = (remote_class, relation_info['key'])
+        missing = [obj for obj in objects if obj.id is not None and (obj._foreign_relations is None or cache_key not in obj._foreign_relations)]
+        remotes = {}
+        for remote in DataList._fetch(remote_class, '_{0}_id'.format(relation_info['key']), set(obj.id for obj in missing)):
+            remotes.setdefault(getattr(remote, '_{0}'.format(relation_info['key']))['id'], []).append(remote)
+        session = Session.get_current()
+        for obj in missing:
+            if obj._foreign_relations is None:
+                obj._foreign_relations = {}
+            obj._foreign_relations[cache_key] = remotes.get(obj.id, [])
+            if session is not None:
+                session.hold_relations(obj)
+        for obj in objects:
+            if obj._foreign_relations is not None:
+                remote_objects.extend(obj._foreign_relations.get(cache_key, []))
+        return DataList._unique(remote_objects)
+
+    @staticmethod
+    def _fetch(object_type, column, values):
+        """ Loads all objects of which the given column matches any of the given values, in chunks """
+        values = list(values)
+        if not values:
+            return []
+        object_type._ensure_table()
+        entries = []
         with object_type.connector() as connection:
-            cursor = connection.cursor()
-            result = cursor.execute(query, parameters)
-            for row in result.fetchall():
-                entries.append(object_type(row[0], ensure_table=False))
+            for index in xrange(0, len(values), DataList.CHUNK_SIZE):
+                chunk = values[index:index + DataList.CHUNK_SIZE]
+                rows = connection.execute('SELECT * FROM {0} WHERE {1} IN ({2}) ORDER BY id'.format(object_type._table, column, ', '.join('?' for _ in chunk)),
+                                          chunk).fetchall()
+                entries.extend(object_type._from_row(row) for row in rows)
         return entries
+
+    @staticmethod
+    def _unique(objects):
+        """ Removes duplicate instances, keeping the order """
+        seen = set()
+        unique = []
+        for obj in objects:
+            if id(obj) not in seen:
+                seen.add(id(obj))
+                unique.append(obj)
+        return unique
+
+    @staticmethod
+    def _iterate(object_type, query, parameters, prefetch):
+        """
+        Yields the objects of the given query, only keeping a single chunk of rows in memory
+        The identifiers are fetched first, then the rows per chunk. No cursor is kept open while yielding, so the objects
+        can be saved while iterating. Objects removed in the meantime are skipped
+        """
+        with object_type.connector() as connection:
+            cursor = connection.execute(query, parameters)
+            try:
+                if cursor.description is None:  # Not a query returning rows
+                    return
+                identifiers = [row[0] for row in cursor]
+            finally:
+                cursor.close()
+        for index in xrange(0, len(identifiers), DataList.CHUNK_SIZE):
+            chunk = identifiers[index:index + DataList.CHUNK_SIZE]
+            row_map = dict((entry.id, entry) for entry in DataList._fetch(object_type, 'id', chunk))
+            chunk = [row_map[identifier] for identifier in chunk if identifier in row_map]
+            DataList.prefetch(chunk, *prefetch)
+            for entry in chunk:
+                yield entry
+
+    @staticmethod
+    def _hydrate(object_type, connection, cursor):
+        """
+        Yields the objects for the rows of the given cursor, per chunk
+        :param object_type: The object type to return
+        :param connection: Connection to use for fetching the full rows, if required
+        :param cursor: Cursor on which the query was executed
+        :return: Generator yielding lists of instances of the given object type
+        """
+        if cursor.description is None:  # Not a query returning rows
+            return
+        columns = [description[0] for description in cursor.description]
+        full_rows = columns[0] == 'id' and len(set(columns)) == len(columns) and set(object_type._get_columns()).issubset(columns)
+        while True:
+            rows = cursor.fetchmany(DataList.CHUNK_SIZE)
+            if not rows:
+                break
+            if full_rows is True:
+                yield [object_type._from_row(row) for row in rows]
+                continue
+            identifiers = [row[0] for row in rows]
+            remote_rows = connection.execute('SELECT * FROM {0} WHERE id IN ({1})'.format(object_type._table, ', '.join('?' for _ in identifiers)),
+                                             identifiers).fetchall()
+            row_map = dict((row['id'], row) for row in remote_rows)
+            chunk = []
+            for identifier in identifiers:
+                if identifier not in row_map:
+                    raise ObjectNotFoundException()
+                chunk.append(object_type._from_row(row_map[identifier]))
+            yield chunk
+
+
+# noinspection PyProtectedMember
+class DataQuery(object):
+    """
+    Builds parameterized queries for a DAL object type, translating property and relation names to their columns and
+    serializing the values like the DAL stores them. Filtering or sorting on indexed properties and relations uses their
+    index (see Property).
+    Supported filter operators (suffixed to the field name with a double underscore): eq (default), ne, lt, lte, gt, gte,
+    like, in and isnull. Relations can be filtered on using the related object, its identifier or `None`.
+    List, dict and None typed properties are compared by their serialized value. The eq, ne and in operators also match
+    the JSON text of rows written before serializers were pluggable, the other operators only compare with the text of
+    the current serializer.
+    The methods modify the query itself and return it, so calls can be chained:
+    DataQuery(Disk).filter(node=node, available=True).filter(size__gte=1024).order_by('-size', 'name').limit(10).all()
+    """
+    OPERATORS = {'eq': '=',
+                 'ne': '!=',
+                 'lt': '<',
+                 'lte': '<=',
+                 'gt': '>',
+                 'gte': '>=',
+                 'like': 'LIKE'}
+
+    def __init__(self, object_type):
+        """
+        Initializes a new query, matching all objects of the given type
+        :param object_type: The object type to query
+        :type object_type: type
+        """
+        self._object_type = object_type
+        self._conditions = []
+        self._parameters = []
+        self._order = []
+        self._limit = None
+        self._offset = None
+        self._prefetch = []
+
+    def filter(self, **conditions):
+        """
+        Adds conditions the objects must match. All conditions are combined with AND
+        :param conditions: Field name, optionally suffixed with an operator (e.g. size__gte), and the value to compare with
+        :return: The query
+        :rtype: DataQuery
+        """
+        for key, value in sorted(conditions.iteritems()):  # Sorted to always generate the same statement for the same conditions
+            field, operator = key, 'eq'
+            if '__' in key:
+                field, operator = key.rsplit('__', 1)
+            column, prop = self._get_column(field)
+            if operator == 'in':
+                values = [variant for entry in value for variant in self._serialize_variants(prop, entry)]
+                self._conditions.append('{0} IN ({1})'.format(column, ', '.join('?' for _ in values)) if values else '0')
+                self._parameters.extend(values)
+            elif operator == 'isnull' or (operator in ['eq', 'ne'] and value is None):
+                is_null = value if operator == 'isnull' else operator == 'eq'
+                self._conditions.append('{0} IS {1}NULL'.format(column, '' if is_null else 'NOT '))
+            elif operator in ['eq', 'ne'] and len(self._serialize_variants(prop, value)) > 1:
+                values = self._serialize_variants(prop, value)
+                self._conditions.append('{0} {1}IN ({2})'.format(column, 'NOT ' if operator == 'ne' else '', ', '.join('?' for _ in values)))
+                self._parameters.extend(values)
+            elif operator in self.OPERATORS:
+                self._conditions.append('{0} {1} ?'.format(column, self.OPERATORS[operator]))
+                self._parameters.append(self._serialize(prop, value))
+            else:
+                raise ValueError('Unsupported operator {0} for {1}'.format(operator, key))
+        return self
+
+    def order_by(self, *fields):
+        """
+        Sorts the objects on the given fields. Prefix a field with '-' to sort descending
+        :param fields: Names of the fields to sort on
+        :return: The query
+        :rtype: DataQuery
+        """
+        for field in fields:
+            direction = 'ASC'
+            if field.startswith('-'):
+                field, direction = field[1:], 'DESC'
+            self._order.append('{0} {1}'.format(self._get_column(field)[0], direction))
+        return self
+
+    def limit(self, amount):
+        """
+        Limits the amount of objects returned
+        :param amount: Maximum amount of objects
+        :type amount: int
+        :return: The query
+        :rtype: DataQuery
+        """
+        self._limit = int(amount)
+        return self
+
+    def offset(self, amount):
+        """
+        Skips the given amount of objects
+        :param amount: Amount of objects to skip
+        :type amount: int
+        :return: The query
+        :rtype: DataQuery
+        """
+        self._offset = int(amount)
+        return self
+
+    def prefetch(self, *relations):
+        """
+        Eagerly loads the given (foreign) relations of the returned objects. Check DataList.prefetch
+        :param relations: Names of the (foreign) relations to load
+        :return: The query
+        :rtype: DataQuery
+        """
+        self._prefetch.extend(relations)
+        return self
+
+    def get_sql(self, select='*', limit=None):
+        """
+        Builds the SQL statement
+        :param select: Columns to select
+        :type select: str
+        :param limit: Overrules the limit of the query
+        :type limit: int
+        :return: The SQL statement and its parameters
+        :rtype: tuple(str, list)
+        """
+        query = 'SELECT {0} FROM {1}'.format(select, self._object_type._table)
+        if self._conditions:
+            query += ' WHERE {0}'.format(' AND '.join(self._conditions))
+        if self._order:
+            query += ' ORDER BY {0}'.format(', '.join(self._order))
+        limit = self._limit if limit is None else limit
+        if limit is not None or self._offset is not None:
+            query += ' LIMIT {0}'.format(-1 if limit is None else limit)
+        if self._offset is not None:
+            query += ' OFFSET {0}'.format(self._offset)
+        return query, list(self._parameters)
+
+    def all(self, lazy=False):
+        """
+        Executes the query
+        :param lazy: Return a generator which fetches and hydrates the objects per chunk instead of a list
+        :type lazy: bool
+        :return: List (or generator when lazy) of the matching objects
+        """
+        self._object_type._ensure_table()
+        if lazy is True and not self._order and self._limit is None and self._offset is None:
+            return self._iterate()
+        query, parameters = self.get_sql()
+        return DataList._query(self._object_type, query, parameters, lazy, self._prefetch)
+
+    def _iterate(self):
+        """
+        Yields the matching objects, fetching them per chunk using keyset pagination on the identifier
+        No cursor is kept open while yielding, so the objects can be saved while iterating
+        """
+        conditions = self._conditions + ['id > ?']
+        query = 'SELECT * FROM {0} WHERE {1} ORDER BY id LIMIT {2}'.format(self._object_type._table, ' AND '.join(conditions), DataList.CHUNK_SIZE)
+        last_id = None
+        while True:
+            with self._object_type.connector() as connection:
+                cursor = connection.execute(query, self._parameters + [-1 if last_id is None else last_id])
+                try:
+                    chunk = [self._object_type._from_row(row) for row in cursor.fetchall()]
+                finally:
+                    cursor.close()
+            if not chunk:
+                return
+            last_id = chunk[-1].id
+            DataList.prefetch(chunk, *self._prefetch)
+            for entry in chunk:
+                yield entry
+            if len(chunk) < DataList.CHUNK_SIZE:
+                return
+
+    def first(self):
+        """
+        Executes the query, returning only the first object
+        :return: The first matching object or None
+        """
+        query, parameters = self.get_sql(limit=1)
+        self._object_type._ensure_table()
+        entries = DataList._query(self._object_type, query, parameters, False, self._prefetch)
+        return entries[0] if entries else None
+
+    def count(self):
+        """
+        Counts the matching objects, without loading them
+        :return: The amount of matching objects
+        :rtype: int
+        """
+        query, parameters = self.get_sql(select='COUNT(*)')
+        if self._limit is not None or self._offset is not None:
+            query, parameters = 'SELECT COUNT(*) FROM ({0})'.format(self.get_sql(select='id')[0]), parameters
+        self._object_type._ensure_table()
+        with self._object_type.connector() as connection:
+            return connection.execute(query, parameters).fetchone()[0]
+
+    def __iter__(self):
+        return iter(self.all(lazy=True))
+
+    def _get_column(self, field):
+        """
+        Translates a field name to its column
+        :param field: Name of the property, relation ('node' or 'node_id') or 'id'
+        :return: The column name and the property. The property is None for relations and the primary key
+        :rtype: tuple(str, ovs_extensions.dal.structures.Property)
+        """
+        if field == 'id':
+            return 'id', None
+        for prop in self._object_type._properties:
+            if prop.name == field:
+                return prop.name, prop
+        for relation in self._object_type._relations:
+            if field in [relation[0], '{0}_id'.format(relation[0])]:
+                return '_{0}_id'.format(relation[0]), None
+        raise ValueError('{0} has no property or relation named {1}'.format(self._object_type.__name__, field))
+
+    def _serialize(self, prop, value):
+        """ Serializes a value to compare with, the same way the DAL stores it """
+        if prop is None:  # Primary key or relation
+            return getattr(value, 'id', value)
+        if value is None:
+            return None
+        return Base._serialize(prop.property_type, value, prop.serializer or self._object_type.SERIALIZER)
+
+    def _serialize_variants(self, prop, value):
+        """
+        Serializes a value to compare with in all the ways the DAL may have stored it. Rows written before serializers
+        were pluggable hold JSON text which differs from the ujson text, so both texts are compared with
+        """
+        serializer = None if prop is None else prop.serializer or self._object_type.SERIALIZER
+        if value is not None and serializer is JSONSerializer and prop.property_type in [list, dict, None]:
+            return JSONSerializer.get_variants(value)
+        return [self._serialize(prop, value)]
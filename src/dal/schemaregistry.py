@@ -0,0 +1,139 @@
+# Copyright (C) 2019 iNuron NV
+#
+# This file is part of Open vStorage Open Source Edition (OSE),
+# as available from
+#
+#      http://www.openvstorage.org and
+#      http://www.openvstorage.com.
+#
+# This file is free software; you can redistribute it and/or modify it
+# under the terms of the GNU Affero General Public License v3 (GNU AGPLv3)
+# as published by the Free Software Foundation, in version 3 as it comes
+# in the LICENSE.txt file of the Open vStorage OSE distribution.
+#
+# Open vStorage is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY of any kind.
+
+
+"""
+Schema registry module
+"""
+
+from threading import Lock
+
+# noinspection PyUnreachableCode
+if False:
+    from typing import Any, Dict, Optional, Tuple
+
+
+class SchemaRegistry(object):
+    """
+    Process wide registry of the DAL tables which were ensured to match their object definition.
+    A table is only checked again when its fingerprint changes: the inode of the database file (the database was
+    removed or replaced) or the SQLite schema_version (the schema was altered by any connection or process).
+    Reading the schema_version requires a connection, so the state of the database files (inode, modification time and
+    size of the database and its write-ahead log) is registered as well. As long as those did not change, the schema
+    could not have changed either and the fingerprint is not read at all
+    """
+    ENABLED = True
+
+    _lock = Lock()
+    _ensured = {}
+    _stats = {'checks': 0,
+              'skipped': 0}
+
+    @classmethod
+    def is_ensured(cls, database, object_type, file_state):
+        # type: (str, type, Optional[tuple]) -> bool
+        """
+        Verifies whether the database files did not change since the table of the given object type was ensured
+        :param database: Path to the database file
+        :type database: str
+        :param object_type: DAL object class
+        :type object_type: type
+        :param file_state: Current state of the database files. None when the database does not exist yet
+        :type file_state: tuple
+        :return: True if the table check can be skipped
+        :rtype: bool
+        """
+        with cls._lock:
+            entry = cls._ensured.get((database, object_type))
+            ensured = cls.ENABLED is True and file_state is not None and entry is not None and entry[1] == file_state
+            if ensured is True:
+                cls._stats['skipped'] += 1
+            return ensured
+
+    @classmethod
+    def is_schema_ensured(cls, database, object_type, fingerprint, file_state):
+        # type: (str, type, Tuple[int, int], tuple) -> bool
+        """
+        Verifies whether the table of the given object type was already ensured with the given fingerprint
+        When it was, the given state of the database files is registered, so the fingerprint is not read again until they change
+        :param database: Path to the database file
+        :type database: str
+        :param object_type: DAL object class
+        :type object_type: type
+        :param fingerprint: Current fingerprint of the database
+        :type fingerprint: tuple
+        :param file_state: State of the database files, taken before the fingerprint was read
+        :type file_state: tuple
+        :return: True if the table check can be skipped
+        :rtype: bool
+        """
+        key = (database, object_type)
+        with cls._lock:
+            entry = cls._ensured.get(key)
+            ensured = cls.ENABLED is True and entry is not None and entry[0] == fingerprint
+            cls._stats['skipped' if ensured else 'checks'] += 1
+            if ensured is True:
+                cls._ensured[key] = (fingerprint, file_state)
+            return ensured
+
+    @classmethod
+    def register(cls, database, object_type, fingerprint, file_state):
+        # type: (str, type, Tuple[int, int], tuple) -> None
+        """
+        Registers the table of the given object type as ensured
+        :param database: Path to the database file
+        :type database: str
+        :param object_type: DAL object class
+        :type object_type: type
+        :param fingerprint: Fingerprint of the database after the table was ensured
+        :type fingerprint: tuple
+        :param file_state: State of the database files, taken before the fingerprint was read
+        :type file_state: tuple
+        :return: None
+        :rtype: NoneType
+        """
+        with cls._lock:
+            cls._ensured[(database, object_type)] = (fingerprint, file_state)
+
+    @classmethod
+    def invalidate(cls, database=None, object_type=None):
+        # type: (Optional[str], Optional[type]) -> None
+        """
+        Forgets the ensured tables, optionally limited to the given database and/or object type
+        :param database: Path to the database file
+        :type database: str
+        :param object_type: DAL object class
+        :type object_type: type
+        :return: None
+        :rtype: NoneType
+        """
+        with cls._lock:
+            for key in cls._ensured.keys():
+                if database in [None, key[0]] and object_type in [None, key[1]]:
+                    cls._ensured.pop(key)
+
+    @classmethod
+    def get_stats(cls):
+        # type: () -> Dict[str, Any]
+        """
+        Retrieve the statistics of the registry
+        :return: The amount of table checks performed and skipped and the amount of tables currently registered
+        :rtype: dict
+        """
+        with cls._lock:
+            stats = cls._stats.copy()
+            stats['tables'] = len(cls._ensured)
+            return stats
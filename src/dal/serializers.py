@@ -0,0 +1,130 @@
+# Copyright (C) 2019 iNuron NV
+#
+# This file is part of Open vStorage Open Source Edition (OSE),
+# as available from
+#
+#      http://www.openvstorage.org and
+#      http://www.openvstorage.com.
+#
+# This file is free software; you can redistribute it and/or modify it
+# under the terms of the GNU Affero General Public License v3 (GNU AGPLv3)
+# as published by the Free Software Foundation, in version 3 as it comes
+# in the LICENSE.txt file of the Open vStorage OSE distribution.
+#
+# Open vStorage is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY of any kind.
+
+
+"""
+Serializers for the list, dict and None typed properties of DAL objects
+"""
+
+import json
+import ujson
+import sqlite3
+
+
+class JSONSerializer(object):
+    """
+    Serializes to JSON text using ujson. Keys are sorted so equal values always serialize equally
+    """
+    NAME = 'json'
+
+    @staticmethod
+    def serialize(data):
+        # type: (any) -> str
+        """
+        Serializes the given data
+        :param data: Data to serialize
+        :type data: any
+        :return: The JSON text
+        :rtype: str
+        """
+        return ujson.dumps(data, sort_keys=True)
+
+    @staticmethod
+    def deserialize(data):
+        # type: (str) -> any
+        """
+        Deserializes the given JSON text
+        :param data: The JSON text
+        :type data: str
+        :return: The deserialized data
+        :rtype: any
+        """
+        return ujson.loads(data)
+
+    @staticmethod
+    def get_variants(data):
+        # type: (any) -> List[str]
+        """
+        Returns all JSON texts which may be stored for the given data: the ujson text and the text written before serializers
+        were pluggable (json.dumps with sorted keys), which differs in whitespace and escaping
+        :param data: Data to serialize
+        :type data: any
+        :return: The distinct JSON texts
+        :rtype: list[str]
+        """
+        variants = [ujson.dumps(data, sort_keys=True)]
+        legacy = json.dumps(data, sort_keys=True)
+        if legacy != variants[0]:
+            variants.append(legacy)
+        return variants
+
+
+class MsgPackSerializer(object):
+    """
+    Serializes to a compact binary encoding using msgpack. The result is stored as a BLOB
+    Requires the msgpack package, which is only imported when this serializer is used
+    Note: dict keys are encoded in iteration order, so filtering on dict properties (see DataQuery) is not reliable
+    """
+    NAME = 'msgpack'
+
+    @staticmethod
+    def _get_msgpack():
+        """ Imports msgpack """
+        try:
+            import msgpack
+        except ImportError as ex:
+            raise RuntimeError('Failed to load python package: {0}'.format(ex))
+        return msgpack
+
+    @classmethod
+    def serialize(cls, data):
+        # type: (any) -> buffer
+        """
+        Serializes the given data
+        :param data: Data to serialize
+        :type data: any
+        :return: The binary encoding, ready to be stored as a BLOB
+        :rtype: buffer
+        """
+        return sqlite3.Binary(cls._get_msgpack().packb(data, use_bin_type=True))
+
+    @classmethod
+    def deserialize(cls, data):
+        # type: (buffer) -> any
+        """
+        Deserializes the given binary encoding
+        :param data: The binary encoding
+        :type data: buffer
+        :return: The deserialized data
+        :rtype: any
+        """
+        return cls._get_msgpack().unpackb(str(data), raw=False)
+
+
+def deserialize(data):
+    # type: (Union[str, buffer]) -> any
+    """
+    Deserializes a stored value, regardless of the serializer that was used to store it:
+    BLOBs are decoded as msgpack while text is decoded as JSON (which includes all rows written before serializers were
+    pluggable). This allows to switch serializers without migrating the existing rows.
+    :param data: The stored value
+    :type data: str or buffer
+    :return: The deserialized data
+    :rtype: any
+    """
+    if isinstance(data, buffer):
+        return MsgPackSerializer.deserialize(data)
+    return JSONSerializer.deserialize(data)
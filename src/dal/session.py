@@ -0,0 +1,148 @@
+# Copyright (C) 2019 iNuron NV
+#
+# This file is part of Open vStorage Open Source Edition (OSE),
+# as available from
+#
+#      http://www.openvstorage.org and
+#      http://www.openvstorage.com.
+#
+# This file is free software; you can redistribute it and/or modify it
+# under the terms of the GNU Affero General Public License v3 (GNU AGPLv3)
+# as published by the Free Software Foundation, in version 3 as it comes
+# in the LICENSE.txt file of the Open vStorage OSE distribution.
+#
+# Open vStorage is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY of any kind.
+
+
+"""
+DAL session module
+"""
+
+import threading
+
+# noinspection PyUnreachableCode
+if False:
+    from typing import List, Optional
+    from ovs_extensions.dal.base import Base
+
+
+class Session(object):
+    """
+    Unit of work for DAL objects. A session keeps a single instance per object type and identifier (identity map):
+    - Objects loaded through DataList queries, relations and foreign relations are only instantiated once
+    - Foreign relations are only queried once per object, until an object of the remote type is saved or deleted
+    Explicitly constructing an object (e.g. `Node(1)`) always loads a new instance.
+    Sessions are bound to the thread that started them and can be nested. Only the innermost session is used.
+    Usage:
+    with Session():
+        for node in DataList.query(Node, 'SELECT * FROM {table}'):
+            for disk in node.disks:
+                ...
+    """
+    _local = threading.local()
+
+    def __init__(self):
+        """
+        Initializes a new, empty session
+        """
+        self._identity_map = {}
+        self._relation_holders = {}
+
+    def __enter__(self):
+        self._get_stack().append(self)
+        return self
+
+    def __exit__(self, *args, **kwargs):
+        _ = args, kwargs
+        self._get_stack().remove(self)
+        self.clear()
+
+    @classmethod
+    def _get_stack(cls):
+        # type: () -> List[Session]
+        """ Returns the sessions opened by the current thread """
+        if not hasattr(cls._local, 'stack'):
+            cls._local.stack = []
+        return cls._local.stack
+
+    @classmethod
+    def get_current(cls):
+        # type: () -> Optional[Session]
+        """
+        Retrieve the innermost session of the current thread
+        :return: The session or None if no session is active
+        :rtype: Session
+        """
+        stack = cls._get_stack()
+        return stack[-1] if stack else None
+
+    def get(self, object_type, identifier):
+        # type: (type, int) -> Optional[Base]
+        """
+        Retrieve the instance for the given object type and identifier
+        :param object_type: DAL object class
+        :type object_type: type
+        :param identifier: Identifier of the object
+        :type identifier: int
+        :return: The instance known to this session or None
+        :rtype: Base
+        """
+        return self._identity_map.get((object_type, identifier))
+
+    def add(self, instance):
+        # type: (Base) -> Base
+        """
+        Registers an instance. An already registered instance for the same object is never replaced
+        :param instance: The instance to register
+        :type instance: Base
+        :return: The instance registered in this session
+        :rtype: Base
+        """
+        if instance.id is None:
+            return instance
+        return self._identity_map.setdefault((instance.__class__, instance.id), instance)
+
+    def hold_relations(self, instance):
+        # type: (Base) -> None
+        """
+        Registers an instance which keeps loaded foreign relations, so these can be invalidated when required
+        :param instance: The instance holding foreign relations
+        :type instance: Base
+        :return: None
+        :rtype: NoneType
+        """
+        self._relation_holders[id(instance)] = instance
+
+    def changed(self, instance, deleted=False):
+        # type: (Base, bool) -> None
+        """
+        Processes a saved or deleted instance: foreign relations towards its type are no longer up to date
+        :param instance: The saved or deleted instance
+        :type instance: Base
+        :param deleted: Indicates whether the instance was deleted
+        :type deleted: bool
+        :return: None
+        :rtype: NoneType
+        """
+        if deleted is True:
+            self._identity_map.pop((instance.__class__, instance.id), None)
+        else:
+            self.add(instance)
+        for holder in self._relation_holders.itervalues():
+            for cache_key in holder._foreign_relations.keys():
+                if cache_key[0] is instance.__class__:
+                    holder._foreign_relations.pop(cache_key)
+
+    def clear(self):
+        # type: () -> None
+        """
+        Forgets all registered instances. The foreign relations loaded within this session are dropped from the instances
+        holding them, so these are loaded again once the session ended
+        :return: None
+        :rtype: NoneType
+        """
+        for holder in self._relation_holders.itervalues():
+            holder._foreign_relations = None
+        self._identity_map.clear()
+        self._relation_holders.clear()
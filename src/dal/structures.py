@@ -24,11 +24,60 @@ class Property(object):
     Property
     """
 
-    def __init__(self, name, property_type, unique=False, mandatory=True):
+    def __init__(self, name, property_type, unique=False, mandatory=True, indexed=False, serializer=None):
         """
         Initializes a property
+        :param indexed: Create an index on the property, for properties used to filter or sort on. Unique properties are always indexed
+        :type indexed: bool
+        :param serializer: Serializer for list, dict and None typed properties. Defaults to the SERIALIZER of the object (see ovs_extensions.dal.serializers)
+        :type serializer: type
         """
         self.name = name
+        self.serializer = serializer
         self.unique = unique
+        self.indexed = indexed
         self.mandatory = mandatory
         self.property_type = property_type
+
+
+class LazyProperty(object):
+    """
+    Descriptor wrapping the slot of a property, which only deserializes the stored value on first access.
+    Until then, the slot stays empty and the stored value is only kept in the row the object was loaded from.
+    """
+    def __init__(self, member, loader):
+        """
+        Initializes a lazy property
+        :param member: The slot descriptor of the property
+        :type member: member_descriptor
+        :param loader: Function returning the deserialized value for an instance
+        :type loader: callable
+        """
+        self.member = member
+        self.loader = loader
+
+    def __get__(self, instance, owner):
+        if instance is None:
+            return self
+        try:
+            return self.member.__get__(instance, owner)
+        except AttributeError:
+            value = self.loader(instance)
+            self.member.__set__(instance, value)
+            return value
+
+    def __set__(self, instance, value):
+        self.member.__set__(instance, value)
+
+    def is_loaded(self, instance):
+        """
+        Returns whether the value was deserialized (or set) for the given instance
+        :param instance: The instance to check
+        :return: True when the value is loaded
+        :rtype: bool
+        """
+        try:
+            self.member.__get__(instance, type(instance))
+            return True
+        except AttributeError:
+            return False
@@ -0,0 +1,245 @@
+# Copyright (C) 2019 iNuron NV
+#
+# This file is part of Open vStorage Open Source Edition (OSE),
+# as available from
+#
+#      http://www.openvstorage.org and
+#      http://www.openvstorage.com.
+#
+# This file is free software; you can redistribute it and/or modify it
+# under the terms of the GNU Affero General Public License v3 (GNU AGPLv3)
+# as published by the Free Software Foundation, in version 3 as it comes
+# in the LICENSE.txt file of the Open vStorage OSE distribution.
+#
+# Open vStorage is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY of any kind.
+
+
+"""
+Benchmarks for the DAL
+Usage: python -m ovs_extensions.dal.tests.benchmark_dal
+"""
+
+import sys
+import json
+import time
+import shutil
+import tempfile
+from ovs_extensions.dal.base import Base
+from ovs_extensions.dal.connectionpool import ConnectionPool
+from ovs_extensions.dal.schemaregistry import SchemaRegistry
+from ovs_extensions.dal.serializers import JSONSerializer, MsgPackSerializer
+from ovs_extensions.dal.datalist import DataList
+from ovs_extensions.dal.tests.objects import Disk, Node, setup_objects
+
+
+def _timed(function, *args, **kwargs):
+    """ Executes the function and returns the duration in seconds """
+    start = time.time()
+    function(*args, **kwargs)
+    return time.time() - start
+
+
+def _report(title, results):
+    """ Prints the results of a benchmark. The first result is used as reference """
+    print title
+    reference = results[0][1]
+    for label, duration in results:
+        print '    {0:<30} {1:>9.4f}s {2:>7.2f}x'.format(label, duration, reference / duration if duration else 0)
+
+
+def benchmark_connection_pool(amount=200, rounds=5):
+    """
+    Compares loading objects with a new connection per call against the connection pool
+    :param amount: Amount of objects to load
+    :param rounds: Amount of times every object is loaded
+    """
+    database_folder = tempfile.mkdtemp()
+    try:
+        setup_objects(database_folder)
+        identifiers = []
+        for index in xrange(amount):
+            node = Node()
+            node.name = 'node_{0}'.format(index)
+            node.save()
+            identifiers.append(node.id)
+
+        def _load():
+            for _ in xrange(rounds):
+                for identifier in identifiers:
+                    Node(identifier)
+
+        results = []
+        for label, enabled in [('connection per call', False), ('connection pool', True)]:
+            Base.enable_connection_pool(enabled)
+            results.append((label, _timed(_load)))
+        _report('Loading {0} objects {1} times'.format(amount, rounds), results)
+    finally:
+        ConnectionPool.close()
+        Base.enable_connection_pool(False)
+        shutil.rmtree(database_folder)
+
+
+def benchmark_ensure_table(amount=1000):
+    """
+    Compares object construction with and without the schema registry
+    :param amount: Amount of objects to construct
+    """
+    database_folder = tempfile.mkdtemp()
+    try:
+        setup_objects(database_folder)
+        node = Node()
+        node.name = 'node'
+        node.save()
+
+        def _construct():
+            for _ in xrange(amount):
+                Node(node.id)
+
+        for pooled in [False, True]:
+            Base.enable_connection_pool(pooled)
+            results = []
+            for label, enabled in [('table checked every time', False), ('schema registry', True)]:
+                SchemaRegistry.ENABLED = enabled
+                results.append((label, _timed(_construct)))
+            _report('Constructing {0} objects ({1})'.format(amount, 'connection pool' if pooled else 'connection per call'), results)
+        print '    {0}'.format(SchemaRegistry.get_stats())
+    finally:
+        SchemaRegistry.ENABLED = True
+        ConnectionPool.close()
+        Base.enable_connection_pool(False)
+        shutil.rmtree(database_folder)
+
+
+def benchmark_inserts(amount=10000):
+    """
+    Compares inserting objects one by one, within a single transaction and in bulk
+    :param amount: Amount of objects to insert
+    """
+    def _create_nodes():
+        nodes = []
+        for index in xrange(amount):
+            node = Node()
+            node.name = 'node_{0}'.format(index)
+            node.tags = ['tag_{0}'.format(index)]
+            nodes.append(node)
+        return nodes
+
+    def _save(nodes):
+        for node in nodes:
+            node.save()
+
+    def _save_transaction(nodes):
+        with Base.transaction():
+            _save(nodes)
+
+    for pooled in [False, True]:
+        results = []
+        for label, function in [('save', _save),
+                                ('save within a transaction', _save_transaction),
+                                ('bulk_save', Base.bulk_save)]:
+            database_folder = tempfile.mkdtemp()
+            try:
+                setup_objects(database_folder)
+                Base.enable_connection_pool(pooled)
+                results.append((label, _timed(function, _create_nodes())))
+            finally:
+                ConnectionPool.close()
+                Base.enable_connection_pool(False)
+                shutil.rmtree(database_folder)
+        _report('Inserting {0} objects ({1})'.format(amount, 'connection pool' if pooled else 'connection per call'), results)
+
+
+class _DictLayout(object):
+    """ Object storing its attributes in an instance dictionary """
+    pass
+
+
+def benchmark_object_layout(amount=20000):
+    """
+    Measures the construction rate and the memory footprint of DAL objects
+    The footprint is compared with the per-instance dictionary layout DAL objects used to have
+    :param amount: Amount of objects to load
+    """
+    database_folder = tempfile.mkdtemp()
+    try:
+        setup_objects(database_folder)
+        node = Node()
+        node.name = 'node'
+        node.save()
+        disks = []
+        for index in xrange(amount):
+            disk = Disk()
+            disk.name = 'disk_{0}'.format(index)
+            disk.size = index
+            disk.usage = {'used': index}
+            disk.node = node
+            disks.append(disk)
+        Base.bulk_save(disks)
+
+        start = time.time()
+        disks = DataList.query(Disk, 'SELECT * FROM {table}')
+        duration = time.time() - start
+        print 'Loading {0} objects through DataList.query'.format(amount)
+        print '    {0:<30} {1:>9.4f}s {2:>9.0f} objects/s'.format('full rows', duration, amount / duration)
+
+        # The same attributes, set on objects with an instance dictionary like DAL objects used to have
+        names = ['id', '_original', '_foreign_relations'] + list(Disk.__slots__)
+        dict_objects = []
+        for disk in disks:
+            dict_object = _DictLayout()
+            for name in names:
+                setattr(dict_object, name, getattr(disk, name))
+            dict_objects.append(dict_object)
+        slots_size = sum(sys.getsizeof(disk) for disk in disks)
+        dict_size = sum(sys.getsizeof(dict_object) + sys.getsizeof(dict_object.__dict__) for dict_object in dict_objects)
+        print 'Footprint of {0} objects (excluding the attribute values)'.format(amount)
+        print '    {0:<30} {1:>9} bytes/object'.format('slots', slots_size / amount)
+        print '    {0:<30} {1:>9} bytes/object'.format('instance dictionary', dict_size / amount)
+    finally:
+        shutil.rmtree(database_folder)
+
+
+def benchmark_serialization(amount=10000):
+    """
+    Compares the serializers for list and dict properties and measures the effect of the lazy deserialization
+    :param amount: Amount of objects to save and load
+    """
+    usage = dict(('disk_{0}'.format(index), {'used': index, 'paths': ['/dev/sd{0}'.format(index)]}) for index in xrange(10))
+    serializers = [('stdlib json', lambda data: json.dumps(data, sort_keys=True)),
+                   ('ujson', JSONSerializer.serialize)]
+    try:
+        MsgPackSerializer.serialize(usage)
+        serializers.append(('msgpack', MsgPackSerializer.serialize))
+    except RuntimeError:
+        pass
+    _report('Serializing a dict property {0} times'.format(amount),
+            [(label, _timed(lambda: [serialize(usage) for _ in xrange(amount)])) for label, serialize in serializers])
+
+    database_folder = tempfile.mkdtemp()
+    try:
+        setup_objects(database_folder)
+        node = Node()
+        node.name = 'node'
+        node.save()
+        disks = []
+        for index in xrange(amount):
+            disk = Disk()
+            disk.name = 'disk_{0}'.format(index)
+            disk.usage = usage
+            disk.node = node
+            disks.append(disk)
+        Base.bulk_save(disks)
+        _report('Loading {0} objects through DataList.query'.format(amount),
+                [('accessing the dict property', _timed(lambda: [disk.usage for disk in DataList.query(Disk, 'SELECT * FROM {table}')])),
+                 ('not accessing it (lazy)', _timed(lambda: [disk.name for disk in DataList.query(Disk, 'SELECT * FROM {table}')]))])
+    finally:
+        shutil.rmtree(database_folder)
+
+
+if __name__ == '__main__':
+    benchmark_connection_pool()
+    benchmark_ensure_table()
+    benchmark_inserts()
+    benchmark_object_layout()
+    benchmark_serialization()
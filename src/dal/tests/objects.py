@@ -0,0 +1,96 @@
+# Copyright (C) 2019 iNuron NV
+#
+# This file is part of Open vStorage Open Source Edition (OSE),
+# as available from
+#
+#      http://www.openvstorage.org and
+#      http://www.openvstorage.com.
+#
+# This file is free software; you can redistribute it and/or modify it
+# under the terms of the GNU Affero General Public License v3 (GNU AGPLv3)
+# as published by the Free Software Foundation, in version 3 as it comes
+# in the LICENSE.txt file of the Open vStorage OSE distribution.
+#
+# Open vStorage is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY of any kind.
+
+
+"""
+DAL objects used by the DAL unittests and benchmarks
+"""
+
+from ovs_extensions.dal.base import Base
+from ovs_extensions.dal.relations import RelationMapper
+from ovs_extensions.dal.structures import Property
+
+
+class DummyBase(Base):
+    """
+    Base for all dummy objects
+    """
+    NAME = 'test'
+
+
+class Node(DummyBase):
+    """
+    Node
+    """
+    _table = 'node'
+    _properties = [Property(name='name', property_type=str, unique=True, mandatory=True),
+                   Property(name='ip', property_type=str, unique=False, mandatory=False),
+                   Property(name='tags', property_type=list, unique=False, mandatory=False)]
+    _relations = []
+    _dynamics = []
+
+
+class Disk(DummyBase):
+    """
+    Disk, linked to a node
+    """
+    _table = 'disk'
+    _properties = [Property(name='name', property_type=str, unique=False, mandatory=True),
+                   Property(name='size', property_type=int, unique=False, mandatory=False),
+                   Property(name='usage', property_type=dict, unique=False, mandatory=False),
+                   Property(name='available', property_type=bool, unique=False, mandatory=False, indexed=True)]
+    _relations = [['node', Node, 'disks']]
+    _dynamics = ['size_gib']
+
+    def _size_gib(self):
+        """ Size in GiB """
+        return (self.size or 0) / 1024.0 ** 3
+
+
+class OSD(DummyBase):
+    """
+    OSD, linked to a disk
+    """
+    _table = 'osd'
+    _properties = [Property(name='osd_id', property_type=str, unique=True, mandatory=True),
+                   Property(name='port', property_type=int, unique=False, mandatory=False)]
+    _relations = [['disk', Disk, 'osds']]
+    _dynamics = []
+
+
+DUMMY_OBJECTS = [Node, Disk, OSD]
+
+
+def setup_objects(database_folder):
+    # type: (str) -> None
+    """
+    Points all test objects to the given folder and registers their relations.
+    The relations are normally discovered through the PluginController which is not available during testing
+    :param database_folder: Folder in which the SQLite database will be created
+    :type database_folder: str
+    :return: None
+    :rtype: NoneType
+    """
+    DummyBase.DATABASE_FOLDER = database_folder
+    for object_type in DUMMY_OBJECTS:
+        relation_info = {}
+        for object_class in DUMMY_OBJECTS:
+            for key, remote, class_relation in object_class._relations:
+                if (remote or object_class) is object_type:
+                    relation_info[class_relation] = {'class': object_class,
+                                                     'key': key}
+        relation_key = '{0}_relations_{1}'.format(object_type.NAME, object_type.__name__.lower())
+        RelationMapper.cache[relation_key] = relation_info
@@ -0,0 +1,450 @@
+# Copyright (C) 2019 iNuron NV
+#
+# This file is part of Open vStorage Open Source Edition (OSE),
+# as available from
+#
+#      http://www.openvstorage.org and
+#      http://www.openvstorage.com.
+#
+# This file is free software; you can redistribute it and/or modify it
+# under the terms of the GNU Affero General Public License v3 (GNU AGPLv3)
+# as published by the Free Software Foundation, in version 3 as it comes
+# in the LICENSE.txt file of the Open vStorage OSE distribution.
+#
+# Open vStorage is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY of any kind.
+
+
+"""
+Test module for the DAL
+"""
+
+import os
+import json
+import shutil
+import sqlite3
+import tempfile
+import threading
+import unittest
+import warnings
+from ovs_extensions.dal.base import Base, ObjectNotFoundException
+from ovs_extensions.dal.connectionpool import ConnectionPool
+from ovs_extensions.dal.datalist import DataList, DataQuery
+from ovs_extensions.dal.schemaregistry import SchemaRegistry
+from ovs_extensions.dal.serializers import JSONSerializer, MsgPackSerializer
+from ovs_extensions.dal.session import Session
+from ovs_extensions.dal.transaction import Transaction
+from ovs_extensions.dal.tests.objects import Disk, Node, OSD, setup_objects
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+
+class DALTest(unittest.TestCase):
+    """
+    Tests the DAL against a temporary SQLite database
+    """
+
+    def setUp(self):
+        """ Creates a new, empty database """
+        self.database_folder = tempfile.mkdtemp()
+        setup_objects(self.database_folder)
+
+    def tearDown(self):
+        """ Removes the database """
+        ConnectionPool.close()
+        Base.enable_connection_pool(False)
+        Base.SERIALIZER = JSONSerializer
+        shutil.rmtree(self.database_folder)
+
+    def _create_objects(self, amount_nodes, amount_disks):
+        """ Creates some nodes with disks """
+        nodes = []
+        for node_index in xrange(amount_nodes):
+            node = Node()
+            node.name = 'node_{0}'.format(node_index)
+            node.ip = '10.100.1.{0}'.format(node_index)
+            node.tags = ['tag_{0}'.format(node_index)]
+            node.save()
+            nodes.append(node)
+            for disk_index in xrange(amount_disks):
+                disk = Disk()
+                disk.name = 'disk_{0}'.format(disk_index)
+                disk.size = disk_index * 1024 ** 3
+                disk.usage = {'used': disk_index}
+                disk.available = disk_index % 2 == 0
+                disk.node = node
+                disk.save()
+        return nodes
+
+    def test_crud(self):
+        """ Validates saving, loading and deleting objects, including relations """
+        for enabled in [False, True]:
+            Base.enable_connection_pool(enabled)
+            node = self._create_objects(amount_nodes=1, amount_disks=2)[0]
+            loaded_node = Node(node.id)
+            self.assertEqual(loaded_node.name, node.name)
+            self.assertEqual(loaded_node.tags, node.tags)
+            disks = sorted(loaded_node.disks, key=lambda d: d.name)
+            self.assertEqual([disk.name for disk in disks], ['disk_0', 'disk_1'])
+            self.assertEqual([disk.available for disk in disks], [True, False])
+            self.assertEqual(disks[1].size_gib, 1.0)
+            self.assertEqual(disks[0].node_id, node.id)
+            for disk in disks:
+                disk.delete()
+            node.delete()
+            with self.assertRaises(ObjectNotFoundException):
+                Node(node.id)
+            self.assertEqual(DataList.query(Node, 'SELECT id FROM {table}'), [])
+
+    def test_connection_pool(self):
+        """ Validates the connection re-use of the pool """
+        Base.enable_connection_pool()
+        connection = Node.connector()
+        self.assertIs(Disk.connector(), connection)
+        self.assertEqual(connection.execute('PRAGMA journal_mode').fetchone()[0], 'wal')
+
+        thread_connections = []
+        thread = threading.Thread(target=lambda: thread_connections.append(Node.connector()))
+        thread.start()
+        thread.join()
+        self.assertIsNot(thread_connections[0], connection)
+
+        # Mimic a fork: connections of another process should never be used
+        stats = ConnectionPool.get_stats()
+        ConnectionPool._local.pid = -1
+        self.assertIsNot(Node.connector(), connection)
+        self.assertEqual(ConnectionPool.get_stats()['discarded'], stats['discarded'] + 1)
+
+        # Inherited connections are kept referenced, up to a limit
+        for _ in xrange(ConnectionPool.MAX_ORPHANS + 5):
+            ConnectionPool._local.pid = -1
+            Node.connector()
+        self.assertEqual(len(ConnectionPool._orphans), ConnectionPool.MAX_ORPHANS)
+
+        # Connections of ended threads are not kept by the pool
+        del ConnectionPool._orphans[:]
+        threads = [threading.Thread(target=Node.connector) for _ in xrange(5)]
+        for thread in threads:
+            thread.start()
+            thread.join()
+        self.assertEqual(ConnectionPool._orphans, [])
+
+        Base.enable_connection_pool(False)
+        self.assertIsNot(Node.connector(), Node.connector())
+
+    def test_query_hydration(self):
+        """ Validates that full row and primary key queries return the same objects, also when lazy or chunked """
+        self._create_objects(amount_nodes=3, amount_disks=4)
+        chunk_size = DataList.CHUNK_SIZE
+        try:
+            DataList.CHUNK_SIZE = 5
+            expected = [(disk.id, disk.name, disk.node_id, disk.usage) for disk in DataList.query(Disk, 'SELECT * FROM {table} ORDER BY id DESC')]
+            self.assertEqual(len(expected), 12)
+            for query in ['SELECT id FROM {table} ORDER BY id DESC',
+                          'SELECT id, name FROM {table} ORDER BY id DESC',
+                          'SELECT * FROM {table} ORDER BY id DESC']:
+                for lazy in [False, True]:
+                    result = DataList.query(Disk, query, lazy=lazy)
+                    self.assertEqual(isinstance(result, list), not lazy)
+                    self.assertEqual([(disk.id, disk.name, disk.node_id, disk.usage) for disk in result], expected)
+            node_id = expected[0][2]
+            disks = DataList.query(Disk, 'SELECT * FROM {table} WHERE node_id=? AND available=?', [node_id, True])
+            self.assertEqual(sorted(disk.name for disk in disks), ['disk_0', 'disk_2'])
+        finally:
+            DataList.CHUNK_SIZE = chunk_size
+
+    def test_lazy_save(self):
+        """ Validates that objects can be saved while lazily iterating over a query """
+        self._create_objects(amount_nodes=2, amount_disks=6)
+        chunk_size = DataList.CHUNK_SIZE
+        try:
+            DataList.CHUNK_SIZE = 5
+            for enabled in [False, True]:
+                Base.enable_connection_pool(enabled)
+                for index, result in enumerate([DataList.query(Disk, 'SELECT id FROM {table} ORDER BY id DESC', lazy=True),
+                                                DataList.filter(Disk, available=True).all(lazy=True),
+                                                iter(DataList.filter(Disk))]):
+                    names = []
+                    for disk in result:
+                        names.append(disk.name)
+                        disk.name = '{0}_{1}'.format(disk.name, index)
+                        disk.save()
+                    self.assertEqual(len(names), 6 if index == 1 else 12)
+                    disks = DataList.query(Disk, 'SELECT * FROM {table} ORDER BY id')
+                    self.assertEqual(len([disk for disk in disks if disk.name.endswith('_{0}'.format(index))]), len(names))
+        finally:
+            DataList.CHUNK_SIZE = chunk_size
+
+    def test_schema_registry(self):
+        """ Validates that tables are only checked when the database file or its schema changed """
+        node = self._create_objects(amount_nodes=1, amount_disks=0)[0]
+        stats = Node.get_schema_stats()
+        Node(node.id)
+        Node(node.id)
+        new_stats = Node.get_schema_stats()
+        self.assertEqual(new_stats['checks'], stats['checks'])
+        self.assertEqual(new_stats['skipped'], stats['skipped'] + 2)
+
+        # Writing data changes the database file, but not the schema
+        node.name = 'renamed'
+        node.save()
+        Node(node.id)
+        self.assertEqual(Node.get_schema_stats()['checks'], stats['checks'])
+
+        # Schema altered by another connection
+        with Node.connector() as connection:
+            connection.execute('ALTER TABLE node ADD COLUMN foo INTEGER')
+        Node(node.id)
+        self.assertEqual(Node.get_schema_stats()['checks'], stats['checks'] + 1)
+
+        # Database file replaced
+        os.remove(Node._get_database())
+        new_node = Node()
+        new_node.name = 'new_node'
+        new_node.save()
+        self.assertEqual(Node.get_schema_stats()['checks'], stats['checks'] + 2)
+        self.assertEqual([n.name for n in DataList.query(Node, 'SELECT * FROM {table}')], ['new_node'])
+
+        SchemaRegistry.invalidate(object_type=Node)
+        Node(new_node.id)
+        self.assertEqual(Node.get_schema_stats()['checks'], stats['checks'] + 3)
+
+    def test_session(self):
+        """ Validates the identity map and the memoization of foreign relations within a session """
+        node = self._create_objects(amount_nodes=1, amount_disks=2)[0]
+        self.assertIsNot(node.disks[0], node.disks[0])
+        with Session():
+            disks = node.disks
+            self.assertEqual([disk.id for disk in node.disks], [disk.id for disk in disks])
+            self.assertIs(node.disks[0], disks[0])
+            self.assertIs(DataList.query(Disk, 'SELECT id FROM {table} ORDER BY id')[0], disks[0])
+            self.assertIs(disks[0].node, disks[1].node)
+
+            # Saving or deleting a remote object invalidates the foreign relation
+            new_disk = Disk()
+            new_disk.name = 'new_disk'
+            new_disk.node = node
+            new_disk.save()
+            self.assertEqual(len(node.disks), 3)
+            self.assertIs(node.disks[2], new_disk)
+            new_disk.delete()
+            self.assertEqual(len(node.disks), 2)
+        self.assertIsNone(Session.get_current())
+        self.assertIsNot(DataList.query(Disk, 'SELECT * FROM {table}')[0], disks[0])
+
+        # Foreign relations loaded within a session are loaded again once it ended
+        other_disk = Disk()
+        other_disk.name = 'other_disk'
+        other_disk.node = node
+        other_disk.save()
+        self.assertEqual(len(node.disks), 3)
+
+    def test_prefetch(self):
+        """ Validates that prefetched (foreign) relations are served without querying the database """
+        nodes = self._create_objects(amount_nodes=3, amount_disks=2)
+        for disk in DataList.query(Disk, 'SELECT * FROM {table}'):
+            osd = OSD()
+            osd.osd_id = 'osd_{0}'.format(disk.id)
+            osd.disk = disk
+            osd.save()
+
+        nodes = DataList.query(Node, 'SELECT * FROM {table} ORDER BY id', prefetch=['disks.osds.disk.node'])
+        with Node.connector() as connection:
+            for table in ['osd', 'disk', 'node']:
+                connection.execute('DELETE FROM {0}'.format(table))
+        for index, node in enumerate(nodes):
+            self.assertEqual(node.name, 'node_{0}'.format(index))
+            self.assertEqual([disk.name for disk in node.disks], ['disk_0', 'disk_1'])
+            for disk in node.disks:
+                self.assertEqual([osd.osd_id for osd in disk.osds], ['osd_{0}'.format(disk.id)])
+                self.assertIs(disk.osds[0].disk.node.id, node.id)
+
+        with self.assertRaises(ValueError):
+            DataList.prefetch(nodes, 'unknown')
+
+    def test_transaction(self):
+        """ Validates that writes within a transaction are committed or rolled back together """
+        for enabled in [False, True]:
+            Base.enable_connection_pool(enabled)
+            with Base.transaction():
+                node = self._create_objects(amount_nodes=1, amount_disks=2)[0]
+                with Base.transaction():  # Nested transactions join the outer one
+                    node.disks[0].delete()
+            self.assertEqual([disk.name for disk in Node(node.id).disks], ['disk_1'])
+            with self.assertRaises(RuntimeError):
+                with Base.transaction():
+                    node.disks[0].delete()
+                    node.delete()
+                    raise RuntimeError('Rollback')
+            self.assertEqual([disk.name for disk in Node(node.id).disks], ['disk_1'])
+            Base.bulk_delete(node.disks + [node])
+        with Node.connector() as connection:
+            self.assertEqual(connection.isolation_level, '')  # The isolation level of the pooled connection is restored
+
+        # When committing fails on one database, the transactions on the other databases are rolled back
+        class _FailingConnection(sqlite3.Connection):
+            def execute(self, *args, **kwargs):
+                if args[0] == 'COMMIT':
+                    raise sqlite3.OperationalError('Commit failed')
+                return super(_FailingConnection, self).execute(*args, **kwargs)
+
+        paths = [os.path.join(self.database_folder, 'database_{0}.db'.format(index)) for index in xrange(3)]
+        with self.assertRaises(sqlite3.OperationalError):
+            with Transaction():
+                for index, path in enumerate(paths):
+                    Transaction.get_connection(path, lambda: sqlite3.connect(path, factory=_FailingConnection if index == 1 else sqlite3.Connection))
+        for path in paths:
+            connection = sqlite3.connect(path, timeout=0)
+            connection.isolation_level = None
+            connection.execute('BEGIN IMMEDIATE')  # Fails when the database is still locked
+            connection.execute('ROLLBACK')
+            connection.close()
+
+    def test_transaction_fresh_database(self):
+        """ Validates that tables created within a transaction which is rolled back are created again afterwards """
+        for enabled in [False, True]:
+            Base.enable_connection_pool(enabled)
+            if os.path.exists(Node._get_database()):
+                os.remove(Node._get_database())
+            with self.assertRaises(RuntimeError):
+                with Base.transaction():
+                    node = Node()
+                    node.name = 'rolled_back'
+                    node.save()
+                    Node(node.id)  # The table is not checked again within the transaction
+                    raise RuntimeError('Rollback')
+            node = Node()
+            node.name = 'node_{0}'.format(enabled)
+            node.save()
+            self.assertEqual([n.name for n in DataList.query(Node, 'SELECT * FROM {table}')], [node.name])
+            ConnectionPool.close()
+            os.remove(Node._get_database())
+            with Base.transaction():
+                other_node = Node()
+                other_node.name = 'other_node'
+                other_node.save()
+            stats = Node.get_schema_stats()
+            Node(other_node.id)
+            self.assertEqual(Node.get_schema_stats()['checks'], stats['checks'])  # Registered once committed
+            self.assertEqual([n.name for n in DataList.query(Node, 'SELECT * FROM {table}')], ['other_node'])
+            ConnectionPool.close()
+
+    def test_bulk_save(self):
+        """ Validates bulk saving and deleting and that only changed columns are written """
+        nodes = []
+        disks = []
+        for node_index in xrange(3):
+            node = Node()
+            node.name = 'node_{0}'.format(node_index)
+            nodes.append(node)
+            for disk_index in xrange(2):
+                disk = Disk()
+                disk.name = 'disk_{0}'.format(disk_index)
+                disk.usage = {}
+                disk.node = node
+                disks.append(disk)
+        Base.bulk_save(nodes + disks)
+        self.assertEqual(len(set(disk.id for disk in disks)), 6)
+        for node in nodes:
+            self.assertEqual([disk.name for disk in Node(node.id).disks], ['disk_0', 'disk_1'])
+
+        # In-place changes are detected, unchanged columns are not written
+        disks[0].usage['used'] = 1
+        disks[1].name = 'renamed'
+        with Disk.connector() as connection:
+            connection.execute('UPDATE disk SET size=5')
+        Base.bulk_save(disks)
+        disks[2].save()
+        for disk in DataList.query(Disk, 'SELECT * FROM {table} WHERE id IN (?, ?, ?)', [disk.id for disk in disks[:3]]):
+            self.assertEqual(disk.size, 5)
+        self.assertEqual(Disk(disks[0].id).usage, {'used': 1})
+        self.assertEqual(Disk(disks[1].id).name, 'renamed')
+
+        Base.bulk_delete(disks)
+        self.assertEqual(DataList.query(Disk, 'SELECT id FROM {table}'), [])
+        self.assertEqual(len(DataList.query(Node, 'SELECT id FROM {table}')), 3)
+
+    def test_slots(self):
+        """ Validates the slot based layout and that properties are only installed once per class """
+        node = self._create_objects(amount_nodes=1, amount_disks=1)[0]
+        self.assertEqual(Node.__slots__, ('ip', 'name', 'tags'))
+        self.assertEqual(Disk.__slots__, ('_node', 'available', 'name', 'size', 'usage'))
+        disk = DataList.query(Disk, 'SELECT * FROM {table}')[0]
+        self.assertEqual(vars(disk), {})
+        self.assertEqual(vars(Node(node.id)), {})
+        node_property = Disk.__dict__['node']
+        Disk(disk.id)
+        self.assertIs(Disk.__dict__['node'], node_property)
+        disk.custom_attribute = 'value'  # Attributes outside the properties and relations remain supported
+        self.assertEqual(vars(disk), {'custom_attribute': 'value'})
+
+    def test_query_builder(self):
+        """ Validates the generated queries and their results """
+        nodes = self._create_objects(amount_nodes=2, amount_disks=4)
+        query, parameters = DataQuery(Disk).filter(node=nodes[0], available=True, size__gte=0, name__in=['disk_0', 'disk_2']).order_by('-size', 'id').limit(5).offset(1).get_sql()
+        self.assertEqual(query, 'SELECT * FROM disk WHERE available = ? AND name IN (?, ?) AND _node_id = ? AND size >= ? ORDER BY size DESC, id ASC LIMIT 5 OFFSET 1')
+        self.assertEqual(parameters, [1, 'disk_0', 'disk_2', nodes[0].id, 0])
+
+        disks = DataList.filter(Disk, node=nodes[0], available=True).order_by('-size').all()
+        self.assertEqual([disk.name for disk in disks], ['disk_2', 'disk_0'])
+        self.assertEqual(DataList.filter(Disk, node_id=nodes[1].id).count(), 4)
+        self.assertEqual(DataList.filter(Disk, node__isnull=True).count(), 0)
+        self.assertEqual(DataList.filter(Disk, node__ne=None, size__lt=2 * 1024 ** 3).order_by('id').limit(3).count(), 3)
+        self.assertEqual(DataList.filter(Disk, usage={'used': 3}, name__like='disk_%').first().name, 'disk_3')
+        self.assertEqual([node.name for node in DataQuery(Node).filter(tags__in=[['tag_1']])], ['node_1'])
+        self.assertEqual(DataQuery(Node).filter(id__in=[]).all(), [])
+        self.assertIsNone(DataQuery(Node).filter(name='unknown').first())
+        with self.assertRaises(ValueError):
+            DataQuery(Node).filter(unknown=1)
+        with self.assertRaises(ValueError):
+            DataQuery(Node).filter(name__unknown=1)
+
+        # Relations and indexed properties are indexed
+        with Disk.connector() as connection:
+            indexes = [row['name'] for row in connection.execute('PRAGMA index_list(disk)').fetchall()]
+            plan = ' '.join(str(row[-1]) for row in connection.execute('EXPLAIN QUERY PLAN SELECT * FROM disk WHERE _node_id=?', [nodes[0].id]).fetchall())
+        self.assertIn('idx_disk__node_id', indexes)
+        self.assertIn('idx_disk_available', indexes)
+        self.assertIn('idx_disk__node_id', plan)
+
+    def test_lazy_deserialization(self):
+        """ Validates that serialized properties are only deserialized on access and that existing JSON rows are read """
+        node = self._create_objects(amount_nodes=1, amount_disks=0)[0]
+        with Node.connector() as connection:  # Row as written by the former, stdlib json based, serialization
+            connection.execute('UPDATE node SET tags=? WHERE id=?', [json.dumps(['b', 'a']), node.id])
+        loaded = Node(node.id)
+        self.assertEqual(vars(loaded), {})
+        self.assertFalse(Node.__dict__['tags'].is_loaded(loaded))
+        self.assertEqual(loaded._get_changes(), [])  # Never accessed, so never written
+        self.assertEqual(loaded.tags, ['b', 'a'])
+        self.assertTrue(Node.__dict__['tags'].is_loaded(loaded))
+        self.assertEqual(loaded._get_changes(), [])  # Accessed, but equal to the stored value
+        self.assertEqual(DataList.filter(Node, tags=['b', 'a']).count(), 1)
+        self.assertEqual(DataList.filter(Node, tags__in=[['a'], ['b', 'a']]).count(), 1)
+        self.assertEqual(DataList.filter(Node, tags__ne=['b', 'a']).count(), 0)
+        loaded.tags.append('c')
+        self.assertEqual(loaded._get_changes(), [('tags', '["b","a","c"]')])
+        loaded.save()
+        self.assertEqual(Node(node.id).tags, ['b', 'a', 'c'])
+        self.assertEqual(DataList.filter(Node, tags=['b', 'a', 'c']).count(), 1)
+
+    @unittest.skipIf(msgpack is None, 'msgpack is not installed')
+    def test_binary_serializer(self):
+        """ Validates the msgpack serializer, mixed with rows stored as JSON """
+        node = self._create_objects(amount_nodes=1, amount_disks=1)[0]
+        Base.SERIALIZER = MsgPackSerializer
+        loaded = Node(node.id)
+        self.assertEqual(loaded.tags, ['tag_0'])
+        with warnings.catch_warnings():  # Values stored as JSON are compared with their msgpack encoding without warnings
+            warnings.simplefilter('error')
+            self.assertEqual(loaded._get_changes(), [])
+            disk = node.disks[0]
+            disk.usage = {'used': 5, 'paths': [u'/dev/sda']}
+            disk.save()
+        with Disk.connector() as connection:
+            self.assertEqual(connection.execute('SELECT typeof(usage) FROM disk WHERE id=?', [disk.id]).fetchone()[0], 'blob')
+        self.assertEqual(Disk(disk.id).usage, {'used': 5, 'paths': [u'/dev/sda']})
+        self.assertEqual(Node(node.id).tags, ['tag_0'])  # Still stored as JSON
+        self.assertEqual(DataList.filter(Disk, usage={'used': 5, 'paths': [u'/dev/sda']}).count(), 1)
@@ -0,0 +1,180 @@
+# Copyright (C) 2019 iNuron NV
+#
+# This file is part of Open vStorage Open Source Edition (OSE),
+# as available from
+#
+#      http://www.openvstorage.org and
+#      http://www.openvstorage.com.
+#
+# This file is free software; you can redistribute it and/or modify it
+# under the terms of the GNU Affero General Public License v3 (GNU AGPLv3)
+# as published by the Free Software Foundation, in version 3 as it comes
+# in the LICENSE.txt file of the Open vStorage OSE distribution.
+#
+# Open vStorage is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY of any kind.
+
+
+"""
+DAL transaction module
+"""
+
+import threading
+
+# noinspection PyUnreachableCode
+if False:
+    from typing import Callable, Hashable, Optional
+    from sqlite3 import Connection
+
+
+class TransactionConnection(object):
+    """
+    Wraps the connection of a running transaction. Using it as a context manager no longer commits or rolls back,
+    so all DAL code using `with cls.connector() as connection:` transparently becomes part of the transaction
+    """
+
+    def __init__(self, connection):
+        # type: (Connection) -> None
+        """
+        Initializes the wrapper
+        :param connection: Connection on which the transaction was started
+        :type connection: sqlite3.Connection
+        """
+        self._connection = connection
+
+    def __getattr__(self, item):
+        return getattr(self._connection, item)
+
+    def __enter__(self):
+        return self._connection
+
+    def __exit__(self, *args, **kwargs):
+        _ = args, kwargs
+
+
+class Transaction(object):
+    """
+    Groups all DAL writes of the current thread into a single SQLite transaction per database.
+    - The SQLite transaction is started when a database is first used within the context
+    - All transactions are committed when the context is left and rolled back when an exception is raised
+    - Nested transactions join the outermost transaction
+    - Objects in memory are not reverted when the transaction is rolled back
+    Notes: the write lock is taken at the start of the SQLite transaction (BEGIN IMMEDIATE) and held until the end,
+    so keep transactions short. The connection runs in autocommit mode (isolation_level None) while the transaction
+    is active, as the sqlite3 module would otherwise implicitly commit before any non-DML statement (e.g. a PRAGMA)
+    """
+    _local = threading.local()
+
+    @classmethod
+    def _get_state(cls):
+        # type: () -> threading.local
+        """ Returns the transaction state of the current thread """
+        local = cls._local
+        if not hasattr(local, 'depth'):
+            local.depth = 0
+            local.connections = {}
+            local.callbacks = {}
+        return local
+
+    @classmethod
+    def is_active(cls):
+        # type: () -> bool
+        """
+        Verifies whether the current thread is running a transaction
+        :return: True if a transaction is running
+        :rtype: bool
+        """
+        return cls._get_state().depth > 0
+
+    @classmethod
+    def get_connection(cls, database, connector):
+        # type: (str, Callable[[], Connection]) -> Optional[TransactionConnection]
+        """
+        Retrieve the connection of the running transaction for the given database. The SQLite transaction is started when required
+        :param database: Path to the database file
+        :type database: str
+        :param connector: Function returning the connection to start the transaction on
+        :type connector: callable
+        :return: The connection of the running transaction or None if the current thread is not running a transaction
+        :rtype: TransactionConnection
+        """
+        state = cls._get_state()
+        if state.depth == 0:
+            return None
+        if database not in state.connections:
+            connection = connector()
+            isolation_level = connection.isolation_level
+            connection.isolation_level = None
+            connection.execute('BEGIN IMMEDIATE')
+            state.connections[database] = (TransactionConnection(connection), isolation_level)
+        return state.connections[database][0]
+
+    @classmethod
+    def after_commit(cls, key, callback):
+        # type: (Hashable, Callable[[], None]) -> None
+        """
+        Registers a function to call once the outermost transaction was committed. The function is dropped when the
+        transaction is rolled back and called immediately when the current thread is not running a transaction
+        :param key: Identifies the function. A function is only registered once per key and transaction
+        :type key: hashable
+        :param callback: Function to call
+        :type callback: callable
+        :return: None
+        :rtype: NoneType
+        """
+        state = cls._get_state()
+        if state.depth == 0:
+            callback()
+        elif key not in state.callbacks:
+            state.callbacks[key] = callback
+
+    @classmethod
+    def has_after_commit(cls, key):
+        # type: (Hashable) -> bool
+        """
+        Verifies whether a function was registered for the given key in the running transaction
+        :param key: Identifies the function
+        :type key: hashable
+        :return: True if a function was registered
+        :rtype: bool
+        """
+        return key in cls._get_state().callbacks
+
+    def __enter__(self):
+        self._get_state().depth += 1
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        _ = exc_val, exc_tb
+        state = self._get_state()
+        state.depth -= 1
+        if state.depth > 0:
+            return
+        connections = state.connections
+        callbacks = state.callbacks
+        state.connections = {}
+        state.callbacks = {}
+        failed = exc_type is not None
+        error = None
+        for database, (connection, isolation_level) in connections.iteritems():
+            # Every connection is ended, even when committing one of them failed, so no database is left locked
+            raw_connection = connection._connection
+            try:
+                if failed is False:
+                    try:
+                        raw_connection.execute('COMMIT')
+                        continue
+                    except Exception as ex:
+                        failed = True
+                        error = ex
+                raw_connection.execute('ROLLBACK')
+            except Exception as ex:
+                if error is None:
+                    error = ex
+            finally:
+                raw_connection.isolation_level = isolation_level
+        if error is not None and exc_type is None:
+            raise error
+        if failed is False:
+            for callback in callbacks.itervalues():
+                callback()
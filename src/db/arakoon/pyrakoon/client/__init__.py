@@ -16,13 +16,16 @@
 
 # Expose the Pyrakoon exceptions here too as the client uses them internally.
 # noinspection PyUnresolvedReferences
-from .exceptions import NoLockAvailableException, ArakoonAssertionFailed, ArakoonGoingDown, ArakoonNotFound,\
+from .exceptions import NoLockAvailableException, TransactionTooLargeException, ArakoonAssertionFailed, ArakoonGoingDown, ArakoonNotFound,\
     ArakoonNodeNotMaster, ArakoonNoMaster, ArakoonNotConnected, ArakoonSocketException, ArakoonSockNotReadable,\
     ArakoonSockReadNoBytes, ArakoonSockSendError
-from .client import locked, handle_arakoon_errors, PyrakoonClient, PyrakoonLock
+from .client import locked, handle_arakoon_errors, PyrakoonClient, PyrakoonLock, ReadPolicy
 from .client_pooled import PyrakoonClientPooled
+from .cache import ReadCache
+from .transaction import TransactionBuilder
 from .mock import MockPyrakoonClient
 # Backwards compatibility imports
 from ovs_extensions.db.arakoon.pyrakoon.pyrakoon.compat import Sequence, ArakoonAssertionFailed, ArakoonClient, ArakoonClientConfig, \
     ArakoonGoingDown, ArakoonNotFound, ArakoonNodeNotMaster, ArakoonNoMaster, ArakoonNotConnected, \
-    ArakoonSocketException, ArakoonSockNotReadable, ArakoonSockReadNoBytes, ArakoonSockSendError, Consistency
\ No newline at end of file
+    ArakoonSocketException, ArakoonSockNotReadable, ArakoonSockReadNoBytes, ArakoonSockSendError, Consistency, \
+    READ_FROM_MASTER, READ_FROM_NEAREST, READ_FROM_LEAST_LOADED
\ No newline at end of file
@@ -14,6 +14,7 @@
 # Open vStorage is distributed in the hope that it will be useful,
 # but WITHOUT ANY WARRANTY of any kind.
 
+import os
 from functools import wraps
 
 
@@ -106,6 +107,39 @@ class PyrakoonBase(object):
         """
         raise NotImplementedError()
 
+    def list_page(self, prefix, start_after=None, limit=100, reverse=False, entries=False):
+        # type: (str, Optional[str], int, bool, bool) -> List[any]
+        """
+        Lists a page of the keys (or key, value pairs) starting with the given prefix, in order
+        The last key of a page is the cursor to pass as start_after to get the next page. A page with less than limit items
+        is the last one
+        :param prefix: Prefix of the keys
+        :type prefix: str
+        :param start_after: List the keys after this key (before this key when listing in reverse). Defaults to the first
+        (or last) key under the prefix
+        :type start_after: str
+        :param limit: Maximum number of items of the page
+        :type limit: int
+        :param reverse: List the keys in reverse order
+        :type reverse: bool
+        :param entries: List the key, value pairs instead of the keys
+        :type entries: bool
+        :return: The keys or key, value pairs
+        :rtype: list
+        """
+        raise NotImplementedError()
+
+    def count_prefix(self, prefix):
+        # type: (str) -> int
+        """
+        Counts the keys starting with the given prefix. Arakoon can't count a prefix, so the keys are listed (without values)
+        :param prefix: Prefix of the keys
+        :type prefix: str
+        :return: The number of keys
+        :rtype: int
+        """
+        raise NotImplementedError()
+
     def delete(self, key, must_exist=True, transaction=None):
         # type: (str, bool, str) -> any
         """
@@ -182,6 +216,21 @@ class PyrakoonBase(object):
         """
         raise NotImplementedError()
 
+    def test_and_set(self, key, old_value, new_value):
+        # type: (str, Optional[str], Optional[str]) -> Optional[str]
+        """
+        Sets the value of a key only if it holds the given value
+        :param key: The key to set
+        :type key: str
+        :param old_value: Value the key must hold. None when the key must not exist
+        :type old_value: str
+        :param new_value: Value to store. None to delete the key
+        :type new_value: str
+        :return: The value of the key before the call. The key was set when it equals old_value
+        :rtype: str
+        """
+        raise NotImplementedError()
+
     def begin_transaction(self):
         # type: () -> str
         """
@@ -216,6 +265,22 @@ class PyrakoonBase(object):
         """
         raise NotImplementedError()
 
+    def transaction_builder(self, atomic=True, max_payload=None, max_steps=None):
+        # type: (bool, Optional[int], Optional[int]) -> TransactionBuilder
+        """
+        Returns a builder for transactions which keeps track of their size
+        :param atomic: Apply all steps in a single sequence, failing when the limits are exceeded. When False, the steps are
+        applied in consecutive sequences within the limits. Check TransactionBuilder
+        :type atomic: bool
+        :param max_payload: Maximum size of a sequence, in bytes
+        :type max_payload: int
+        :param max_steps: Maximum number of steps of a sequence
+        :type max_steps: int
+        :return: The transaction builder
+        :rtype: TransactionBuilder
+        """
+        raise NotImplementedError()
+
     @staticmethod
     def _next_prefix(prefix):
         # type: (str) -> str
@@ -245,6 +310,39 @@ class PyrakoonBase(object):
         # Can occur when all the prefix is composed of \xff
         raise ValueError('Prefix {0} has no next'.format(prefix))
 
+    @staticmethod
+    def _split_prefix(prefix, parts, first_key=None, last_key=None):
+        # type: (str, int, Optional[str], Optional[str]) -> List[Tuple[str, str]]
+        """
+        Splits the range of keys starting with the given prefix into consecutive sub-ranges
+        The boundaries are spread over the characters at the first position where the first and last key under the prefix
+        differ. Without these keys, they are spread over the printable characters following the prefix.
+        The first and last sub-range always extend to the bounds of the prefix
+        :param prefix: Prefix to split
+        :type prefix: str
+        :param parts: Maximum number of sub-ranges
+        :type parts: int
+        :param first_key: First key starting with the prefix
+        :type first_key: str
+        :param last_key: Last key starting with the prefix
+        :type last_key: str
+        :return: List of sub-ranges: the begin key (included) and end key (excluded) of each range
+        :rtype: List[Tuple[str, str]]
+        """
+        end_key = PyrakoonBase._next_prefix(prefix)
+        if first_key is None or last_key is None:
+            common, low, high = prefix, 0x20, 0x7f
+        elif first_key == last_key:
+            return [(prefix, end_key)]
+        else:
+            common = os.path.commonprefix([first_key, last_key])
+            low = ord(first_key[len(common)]) if len(first_key) > len(common) else 0
+            high = ord(last_key[len(common)]) + 1
+        parts = max(1, min(parts, high - low))
+        boundaries = [common + chr(low + (high - low) * index // parts) for index in xrange(1, parts)]
+        keys = [prefix] + boundaries + [end_key]
+        return zip(keys[:-1], keys[1:])
+
     def lock(self, name, wait=None, expiration=60):
         # type: (str, float, float) -> PyrakoonLock
         """
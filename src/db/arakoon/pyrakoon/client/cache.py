@@ -0,0 +1,228 @@
+# Copyright (C) 2019 iNuron NV
+#
+# This file is part of Open vStorage Open Source Edition (OSE),
+# as available from
+#
+#      http://www.openvstorage.org and
+#      http://www.openvstorage.com.
+#
+# This file is free software; you can redistribute it and/or modify it
+# under the terms of the GNU Affero General Public License v3 (GNU AGPLv3)
+# as published by the Free Software Foundation, in version 3 as it comes
+# in the LICENSE.txt file of the Open vStorage OSE distribution.
+#
+# Open vStorage is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY of any kind.
+
+"""
+Client side read cache module
+"""
+
+import time
+from collections import OrderedDict
+from threading import Lock
+
+# noinspection PyUnreachableCode
+if False:
+    from typing import Any, Callable, Dict, Iterable, List, Optional
+
+
+class _CacheEntry(object):
+    """
+    Cached value and the state of the cluster when it was read
+    """
+    __slots__ = ('value', 'txid', 'cached_at')
+
+    def __init__(self, value, txid):
+        # type: (str, Optional[int]) -> None
+        self.value = value
+        self.txid = txid
+        self.cached_at = time.time()
+
+
+class ReadCache(object):
+    """
+    Bounded LRU read-through cache for the values of an Arakoon cluster
+    A cached value is served as long as it is valid:
+    - for keys matching a prefix with a TTL, until the TTL expires
+    - for all keys, as long as the transaction id of the cluster did not change since the value was read. The transaction
+      id is fetched at most once every txid_interval seconds, which bounds the staleness of values updated by other clients
+    Updates through the client owning the cache invalidate the updated keys immediately
+    The cache is thread safe and can be shared by multiple clients of the same cluster
+    """
+    def __init__(self, size=1000, ttls=None, txid_interval=1.0):
+        # type: (int, Optional[Dict[str, float]], Optional[float]) -> None
+        """
+        Initializes the cache
+        :param size: Maximum number of cached values
+        :type size: int
+        :param ttls: Seconds a value stays valid, per key prefix. The longest matching prefix applies. Use '' for all keys
+        :type ttls: dict
+        :param txid_interval: Seconds between fetching the transaction id of the cluster. None to only use the TTLs
+        :type txid_interval: float
+        """
+        self.size = size
+        self.txid_interval = txid_interval
+        self._ttls = sorted((ttls or {}).iteritems(), key=lambda item: len(item[0]), reverse=True)
+        self._entries = OrderedDict()  # Least recently used entry first
+        self._lock = Lock()
+        self._txid = None
+        self._txid_fetched_at = None
+        self._invalidations = 0  # Values read while the cache was invalidated are not cached
+        self._statistics = {'hits': 0,
+                            'misses': 0,
+                            'evictions': 0,
+                            'invalidations': 0,
+                            'txid_fetches': 0}
+
+    def get(self, key, fetch, get_txid):
+        # type: (str, Callable[[str], str], Callable[[], Optional[int]]) -> str
+        """
+        Returns the value of a key from the cache or reads it (and caches it) when no valid value is cached
+        :param key: Key to get
+        :type key: str
+        :param fetch: Function reading the value of a key from the cluster
+        :type fetch: callable
+        :param get_txid: Function fetching the transaction id of the cluster
+        :type get_txid: callable
+        :return: The value
+        :rtype: str
+        """
+        return self.get_multi([key], lambda keys: [fetch(keys[0])], get_txid)[0]
+
+    def get_multi(self, keys, fetch_multi, get_txid):
+        # type: (List[str], Callable[[List[str]], Iterable[Optional[str]]], Callable[[], Optional[int]]) -> List[Optional[str]]
+        """
+        Returns the values of the given keys from the cache, reading the keys without a valid cached value at once
+        :param keys: Keys to get
+        :type keys: list
+        :param fetch_multi: Function reading the values of keys from the cluster. None values are not cached
+        :type fetch_multi: callable
+        :param get_txid: Function fetching the transaction id of the cluster
+        :type get_txid: callable
+        :return: The values, in the order of the keys
+        :rtype: list
+        """
+        txid = self._get_txid(get_txid)
+        now = time.time()
+        values = []
+        missing = []
+        with self._lock:
+            for index, key in enumerate(keys):
+                entry = self._entries.get(key)
+                if entry is not None and self._is_valid(key, entry, txid, now):
+                    del self._entries[key]
+                    self._entries[key] = entry  # Most recently used
+                    values.append(entry.value)
+                else:
+                    values.append(None)
+                    missing.append(index)
+            self._statistics['hits'] += len(keys) - len(missing)
+            self._statistics['misses'] += len(missing)
+            invalidations = self._invalidations
+        if not missing:
+            return values
+        fetched = list(fetch_multi([keys[index] for index in missing]))
+        with self._lock:
+            store = invalidations == self._invalidations
+            for index, value in zip(missing, fetched):
+                values[index] = value
+                if store is True and value is not None:
+                    self._store(keys[index], _CacheEntry(value, txid))
+        return values
+
+    def _get_txid(self, get_txid):
+        # type: (Callable[[], Optional[int]]) -> Optional[int]
+        """
+        Returns the transaction id of the cluster, fetching it when it is older than the interval
+        """
+        if self.txid_interval is None:
+            return None
+        now = time.time()
+        with self._lock:
+            if self._txid_fetched_at is not None and now - self._txid_fetched_at < self.txid_interval:
+                return self._txid
+        txid = get_txid()
+        with self._lock:
+            self._statistics['txid_fetches'] += 1
+            self._txid = txid
+            self._txid_fetched_at = now
+        return txid
+
+    def _is_valid(self, key, entry, txid, now):
+        # type: (str, _CacheEntry, Optional[int], float) -> bool
+        """
+        Checks whether a cached entry can be served. The lock must be held
+        """
+        for prefix, ttl in self._ttls:
+            if key.startswith(prefix):
+                if now - entry.cached_at < ttl:
+                    return True
+                break
+        return txid is not None and entry.txid == txid
+
+    def _store(self, key, entry):
+        # type: (str, _CacheEntry) -> None
+        """
+        Caches an entry, evicting the least recently used entries. The lock must be held
+        """
+        self._entries.pop(key, None)
+        self._entries[key] = entry
+        while len(self._entries) > self.size:
+            self._entries.popitem(last=False)
+            self._statistics['evictions'] += 1
+
+    def invalidate(self, keys):
+        # type: (Iterable[str]) -> None
+        """
+        Removes the given keys from the cache
+        :param keys: Keys to remove
+        :type keys: iterable
+        :return: None
+        :rtype: NoneType
+        """
+        with self._lock:
+            self._invalidations += 1
+            for key in keys:
+                if self._entries.pop(key, None) is not None:
+                    self._statistics['invalidations'] += 1
+
+    def invalidate_prefix(self, prefix):
+        # type: (str) -> None
+        """
+        Removes all keys starting with the given prefix from the cache
+        :param prefix: Prefix of the keys to remove
+        :type prefix: str
+        :return: None
+        :rtype: NoneType
+        """
+        with self._lock:
+            self._invalidations += 1
+            for key in [key for key in self._entries if key.startswith(prefix)]:
+                del self._entries[key]
+                self._statistics['invalidations'] += 1
+
+    def clear(self):
+        # type: () -> None
+        """
+        Removes all values from the cache
+        :return: None
+        :rtype: NoneType
+        """
+        with self._lock:
+            self._invalidations += 1
+            self._statistics['invalidations'] += len(self._entries)
+            self._entries.clear()
+
+    def get_statistics(self):
+        # type: () -> Dict[str, int]
+        """
+        Returns the statistics of the cache: the number of hits, misses, evictions (to respect the size), invalidations
+        (after updates), transaction id fetches and the number of cached values
+        :return: The statistics
+        :rtype: dict
+        """
+        with self._lock:
+            statistics = dict(self._statistics)
+            statistics['size'] = len(self._entries)
+        return statistics
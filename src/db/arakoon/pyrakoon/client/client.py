@@ -22,25 +22,30 @@ import os
 import uuid
 import time
 import ujson
+import sys
 import random
 import logging
 from functools import wraps
-from threading import RLock, current_thread
+from Queue import Queue
+from threading import Condition, Event, Lock, RLock, Thread, current_thread
 from .base_client import PyrakoonBase
 from .exceptions import NoLockAvailableException
+from .transaction import TransactionBuilder
 from ovs_extensions.db.arakoon.pyrakoon.pyrakoon.compat import Sequence, ArakoonAssertionFailed, ArakoonClient, ArakoonClientConfig, \
     ArakoonGoingDown, ArakoonNotFound, ArakoonNodeNotMaster, ArakoonNoMaster, ArakoonNotConnected, \
-    ArakoonSocketException, ArakoonSockNotReadable, ArakoonSockReadNoBytes, ArakoonSockSendError, Consistency
-from ovs_extensions.generic.repeatingtimer import RepeatingTimer
+    ArakoonSocketException, ArakoonSockNotReadable, ArakoonSockReadNoBytes, ArakoonSockSendError, Consistency, \
+    AtLeast, NoGuarantee, READ_FROM_LEAST_LOADED, Delete, DeletePrefix, Replace, Set
 
 # noinspection PyUnreachableCode
 if False:
     from typing import Generator, Tuple, Optional, Any, Dict, List
+    from .cache import ReadCache
 
 
 def locked():
     """
     Locking decorator.
+    Pipelined clients are not locked: their connection handles concurrent requests itself
     """
     def wrap(f):
         """
@@ -51,6 +56,8 @@ def locked():
             """
             Executes the decorated function in a locked context
             """
+            if self._pipelined is True:
+                return f(self, *args, **kw)
             with self._lock:
                 return f(self, *args, **kw)
         return new_function
@@ -131,6 +138,161 @@ def handle_arakoon_errors(is_read_only=False, max_duration=0.5, override_retry=F
     return wrap
 
 
+class _ReadAhead(object):
+    """
+    Executes a call in a separate thread, so the caller can do other work while waiting for the result
+    """
+    def __init__(self, function, *args, **kwargs):
+        # type: (callable, *any, **any) -> None
+        """
+        Starts executing the function
+        :param function: Function to execute
+        :type function: callable
+        :param worker: Worker to execute the function in. Defaults to a new thread
+        :type worker: _ReadAheadWorker
+        """
+        self._result = None
+        self._exc_info = None
+        self._done = Event()
+        worker = kwargs.get('worker')
+        if worker is not None:
+            worker.submit(self, function, args)
+        else:
+            thread = Thread(target=self.run, name='pyrakoon_read_ahead', args=(function, args))
+            thread.daemon = True
+            thread.start()
+
+    def run(self, function, args):
+        # type: (callable, tuple) -> None
+        """
+        Executes the function, keeping its result
+        """
+        try:
+            self._result = function(*args)
+        except Exception:
+            self._exc_info = sys.exc_info()
+        finally:
+            self._done.set()
+
+    def get(self):
+        # type: () -> any
+        """
+        Waits for the function to finish
+        :return: The result of the function. Exceptions raised by the function are re-raised
+        :rtype: any
+        """
+        self._done.wait()
+        if self._exc_info is not None:
+            raise self._exc_info[0], self._exc_info[1], self._exc_info[2]
+        return self._result
+
+
+class _ReadAheadWorker(object):
+    """
+    Executes read-aheads one after the other in a single thread, which lives as long as the worker is not stopped
+    """
+    def __init__(self):
+        # type: () -> None
+        self._requests = Queue()
+        self._thread = Thread(target=self._run, name='pyrakoon_read_ahead')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def submit(self, read_ahead, function, args):
+        # type: (_ReadAhead, callable, tuple) -> None
+        """
+        Queues the execution of a read-ahead
+        """
+        self._requests.put((read_ahead, function, args))
+
+    def stop(self):
+        # type: () -> None
+        """
+        Stops the thread once the queued read-aheads are executed
+        """
+        self._requests.put(None)
+
+    def _run(self):
+        while True:
+            request = self._requests.get()
+            if request is None:
+                return
+            read_ahead, function, args = request
+            read_ahead.run(function, args)
+
+
+class ReadPolicy(object):
+    """
+    Routing of the reads to the nodes of the cluster, instead of sending them all to the master
+    Reads are routed with an AtLeast(txid) consistency once the transaction id of the session is known (so reads never go
+    back in time) or the default consistency otherwise. With read_your_writes, the transaction id is fetched from the
+    master after every write, so the next read is served by a node which applied the write
+    A policy is a session: share the instance between the clients which must read each other's writes
+    """
+    def __init__(self, read_from=READ_FROM_LEAST_LOADED, consistency=None, read_your_writes=True):
+        # type: (str, Optional[Consistency], bool) -> None
+        """
+        Initializes the policy
+        :param read_from: Node to route the reads to: READ_FROM_NEAREST (lowest latency) or READ_FROM_LEAST_LOADED (fewest reads in flight)
+        :type read_from: str
+        :param consistency: Consistency of the reads while the transaction id of the session is unknown. Defaults to NoGuarantee
+        :type consistency: Consistency
+        :param read_your_writes: Read the writes of the session
+        :type read_your_writes: bool
+        """
+        self.read_from = read_from
+        self.consistency = NoGuarantee() if consistency is None else consistency
+        self.read_your_writes = read_your_writes
+        self._lock = Lock()
+        self._txid = None
+        self._txid_outdated = False
+
+    @property
+    def txid(self):
+        # type: () -> Optional[int]
+        """
+        Last known transaction id of the session
+        :rtype: int
+        """
+        return self._txid
+
+    def register_write(self):
+        # type: () -> None
+        """
+        Registers a write of the session, which the next reads must observe
+        :return: None
+        :rtype: NoneType
+        """
+        if self.read_your_writes is True:
+            self._txid_outdated = True
+
+    def get_consistency(self, get_txid):
+        # type: (callable) -> Consistency
+        """
+        Returns the consistency for the next read
+        :param get_txid: Function fetching the current transaction id from the master
+        :type get_txid: callable
+        :return: The consistency to read with
+        :rtype: Consistency
+        """
+        with self._lock:
+            outdated = self._txid_outdated
+            self._txid_outdated = False
+        if outdated is True:
+            try:
+                txid = get_txid()
+            except Exception:
+                self._txid_outdated = True
+                raise
+            if isinstance(txid, AtLeast):
+                with self._lock:
+                    self._txid = max(self._txid, txid.i)  # Concurrent reads can fetch the ids out of order
+        txid = self._txid
+        if txid is None:
+            return self.consistency
+        return AtLeast(txid)
+
+
 class PyrakoonClient(PyrakoonBase):
     """
     Arakoon client wrapper:
@@ -138,8 +300,14 @@ class PyrakoonClient(PyrakoonBase):
     """
     _logger = logging.getLogger(__name__)
 
-    def __init__(self, cluster, nodes, retries=10, retry_back_off_multiplier=2, retry_interval_sec=2):
-        # type: (str, Dict[str, Tuple[str, int]], int, int, int) -> None
+    # Prefix scans size their batches to get responses of about BATCH_PAYLOAD bytes, within these bounds
+    BATCH_SIZE_MIN = 100
+    BATCH_SIZE_MAX = 10000
+    BATCH_PAYLOAD = 1024 * 1024
+
+    def __init__(self, cluster, nodes, retries=10, retry_back_off_multiplier=2, retry_interval_sec=2, pipelined=False, read_ahead=False,
+                 read_policy=None, cache=None):
+        # type: (str, Dict[str, Tuple[str, int]], int, int, int, bool, bool, Optional[ReadPolicy], Optional[ReadCache]) -> None
         """
         Initializes the client
         :param cluster: Identifier of the cluster
@@ -152,38 +320,124 @@ class PyrakoonClient(PyrakoonBase):
         :type retry_back_off_multiplier: int
         :param retry_interval_sec: Seconds to wait before retrying. Exponentially increases with every retry.
         :type retry_interval_sec: int
+        :param pipelined: Share the client between threads without serializing the calls: requests of different threads
+        are in flight on the same connection at the same time. Check the pyrakoon compat ArakoonClient
+        :type pipelined: bool
+        :param read_ahead: Request the next batch of a prefix scan while the current one is consumed. Only used by pipelined
+        clients: other clients are locked, so the read-ahead could wait forever on a caller scanning while holding the lock
+        :type read_ahead: bool
+        :param read_policy: Route the reads to the other nodes of the cluster. Defaults to reading from the master
+        :type read_policy: ReadPolicy
+        :param cache: Cache the values read by get and get_multi. Updates through this client invalidate the cache
+        :type cache: ReadCache
         """
         cleaned_nodes = {}
         for node, info in nodes.iteritems():
             cleaned_nodes[str(node)] = ([str(entry) for entry in info[0]], int(info[1]))
         # Synchronization
         self._lock = RLock()
+        self._pipelined = pipelined
         # Wrapping
         self._config = ArakoonClientConfig(str(cluster), cleaned_nodes)
-        self._client = ArakoonClient(self._config, timeout=5, noMasterTimeout=5)
+        self._client = ArakoonClient(self._config, timeout=5, noMasterTimeout=5, pipelined=pipelined)
+        self._read_policy = read_policy
+        self._cache = cache
+        if read_policy is not None:
+            self._client.setReadRouting(read_policy.read_from)
 
         self._identifier = int(round(random.random() * 10000000))
-        self._batch_size = 500
+        self._batch_size = 500  # Size of the first batch of a prefix scan
+        self._read_ahead = read_ahead
         self._sequences = {}
         # Retrying
         self._retries = retries
         self._retry_back_off_multiplier = retry_back_off_multiplier
         self._retry_interval_sec = retry_interval_sec
 
-    @locked()
-    @handle_arakoon_errors(is_read_only=True)
     def get(self, key, consistency=None):
         # type: (str, Consistency) -> Any
         """
         Retrieves a certain value for a given key
         :param key: The key whose value you are interested in
         :type key: str
+        :param consistency: Consistency of the get. Gets with an explicit consistency bypass the cache
+        :type consistency: Consistency
+        :return: The value associated with the given key
+        :rtype: any
+        """
+        if self._cache is None or consistency is not None:
+            return self._get(key, consistency)
+        return self._cache.get(key, self._get, self.get_txid)
+
+    @locked()
+    @handle_arakoon_errors(is_read_only=True)
+    def _get(self, key, consistency=None):
+        # type: (str, Optional[Consistency]) -> Any
+        """
+        Retrieves a certain value for a given key from Arakoon
+        :param key: The key whose value you are interested in
+        :type key: str
         :param consistency: Consistency of the get
         :type consistency: Consistency
         :return: The value associated with the given key
         :rtype: any
         """
-        return self._client.get(key, consistency)
+        return self._client.get(key, self._get_consistency(consistency))
+
+    @locked()
+    @handle_arakoon_errors(is_read_only=True)
+    def get_txid(self):
+        # type: () -> Optional[int]
+        """
+        Retrieves the transaction id of the cluster: the number of the last update applied by the master
+        :return: The transaction id. None if unknown
+        :rtype: int
+        """
+        txid = self._client.get_txid()
+        return txid.i if isinstance(txid, AtLeast) else None
+
+    def _get_consistency(self, consistency=None):
+        # type: (Optional[Consistency]) -> Optional[Consistency]
+        """
+        Determines the consistency of a read
+        :param consistency: Consistency requested by the caller
+        :type consistency: Consistency
+        :return: The requested consistency or the consistency of the read policy. None to use the consistency of the client
+        :rtype: Consistency
+        """
+        if consistency is not None or self._read_policy is None:
+            return consistency
+        return self._read_policy.get_consistency(self._client.get_txid)
+
+    def _register_write(self, keys=None, prefix=None, sequence=None):
+        # type: (Optional[List[str]], Optional[str], Optional[Sequence]) -> None
+        """
+        Registers a write with the read policy and invalidates the updated keys in the cache
+        :param keys: Updated keys
+        :type keys: list
+        :param prefix: Prefix of the deleted keys
+        :type prefix: str
+        :param sequence: Applied sequence
+        :type sequence: Sequence
+        """
+        if self._read_policy is not None:
+            self._read_policy.register_write()
+        if self._cache is None:
+            return
+        keys = list(keys or [])
+        prefixes = [] if prefix is None else [prefix]
+        sequences = [] if sequence is None else [sequence]
+        while sequences:
+            for update in sequences.pop()._updates:
+                if isinstance(update, (Set, Delete, Replace)):
+                    keys.append(update._key)
+                elif isinstance(update, DeletePrefix):
+                    prefixes.append(update._prefix)
+                elif isinstance(update, Sequence):
+                    sequences.append(update)
+        self._cache.invalidate(keys)
+        for prefix in prefixes:
+            self._cache.invalidate_prefix(prefix)
 
     @locked()
     @handle_arakoon_errors(is_read_only=True)
@@ -200,7 +454,7 @@ class PyrakoonClient(PyrakoonBase):
         :rtype: List[Tuple[str, any]
         """
         func = self._client.multiGet if must_exist is True else self._client.multiGetOption
-        return func(keys)
+        return func(keys, consistency=self._get_consistency())
 
     def get_multi(self, keys, must_exist=True):
         # type: (List[str], bool) -> Generator[Tuple[str, any]]
@@ -213,7 +467,11 @@ class PyrakoonClient(PyrakoonBase):
         :return: Generator that yields key value pairs
         :rtype: iterable[Tuple[str, any]
         """
-        for item in self._get_multi(keys, must_exist):
+        if self._cache is None:
+            items = self._get_multi(keys, must_exist)
+        else:
+            items = self._cache.get_multi(keys, lambda missing_keys: self._get_multi(missing_keys, must_exist), self.get_txid)
+        for item in items:
             yield item
 
     @locked()
@@ -235,7 +493,30 @@ class PyrakoonClient(PyrakoonBase):
         """
         if transaction is not None:
             return self._sequences[transaction].addSet(key, value)
-        return self._client.set(key, value)
+        try:
+            return self._client.set(key, value)
+        finally:
+            self._register_write(keys=[key])
+
+    @locked()
+    @handle_arakoon_errors(is_read_only=False)
+    def test_and_set(self, key, old_value, new_value):
+        # type: (str, Optional[str], Optional[str]) -> Optional[str]
+        """
+        Sets the value of a key only if it holds the given value
+        :param key: The key to set
+        :type key: str
+        :param old_value: Value the key must hold. None when the key must not exist
+        :type old_value: str
+        :param new_value: Value to store. None to delete the key
+        :type new_value: str
+        :return: The value of the key before the call. The key was set when it equals old_value
+        :rtype: str
+        """
+        try:
+            return self._client.testAndSet(key, old_value, new_value)
+        finally:
+            self._register_write(keys=[key])
 
     @locked()
     @handle_arakoon_errors(is_read_only=True)
@@ -261,7 +542,8 @@ class PyrakoonClient(PyrakoonBase):
                                   beginKeyIncluded=begin_key_included,
                                   endKey=end_key,
                                   endKeyIncluded=end_key_included,
-                                  maxElements=max_elements)
+                                  maxElements=max_elements,
+                                  consistency=self._get_consistency())
 
     def prefix(self, prefix):
         # type: (str) -> Generator[str]
@@ -272,15 +554,7 @@ class PyrakoonClient(PyrakoonBase):
         :return: Generator that yields keys
         :rtype: Generator[str]
         """
-        next_prefix = self._next_prefix(prefix)
-        batch = None
-        while batch is None or len(batch) > 0:
-            batch = self._range(begin_key=prefix if batch is None else batch[-1],
-                                begin_key_included=batch is None,
-                                end_key=next_prefix,
-                                end_key_included=False)
-            for item in batch:
-                yield item
+        return self._scan(prefix, self._next_prefix(prefix), entries=False)
 
     @locked()
     @handle_arakoon_errors(is_read_only=True)
@@ -306,7 +580,35 @@ class PyrakoonClient(PyrakoonBase):
                                           beginKeyIncluded=begin_key_included,
                                           endKey=end_key,
                                           endKeyIncluded=end_key_included,
-                                          maxElements=max_elements)
+                                          maxElements=max_elements,
+                                          consistency=self._get_consistency())
+
+    @locked()
+    @handle_arakoon_errors(is_read_only=True)
+    def _rev_range_entries(self, begin_key, begin_key_included, end_key, end_key_included, max_elements=None):
+        # type: (str, bool, str, bool, Optional[int]) -> List[Tuple[str, Any]]
+        """
+        Get a range of keys value pairs from Arakoon, in reverse order
+        :param begin_key: Key to start the range with, the upper bound of the range
+        :type begin_key: str
+        :param begin_key_included: Should the key be included
+        :type begin_key_included: bool
+        :param end_key: Key to end the range with, the lower bound of the range
+        :type end_key: str
+        :param end_key_included: Is the end key included
+        :type end_key_included: bool
+        :param max_elements: Maximum amount of elements to return. Defaults to the batch size of the class
+        :type max_elements: Optional[int]
+        :return: List of keys
+        :rtype: List[Tuple[str, Any]]
+        """
+        max_elements = self._batch_size if max_elements is None else max_elements
+        return self._client.rev_range_entries(beginKey=begin_key,
+                                              beginKeyIncluded=begin_key_included,
+                                              endKey=end_key,
+                                              endKeyIncluded=end_key_included,
+                                              maxElements=max_elements,
+                                              consistency=self._get_consistency())
 
     def prefix_entries(self, prefix):
         # type: (str) -> Generator[Tuple[str, any]]
@@ -317,15 +619,119 @@ class PyrakoonClient(PyrakoonBase):
         :return: Generator that yields key, value pairs
         :rtype: Generator[Tuple[str, any]
         """
-        next_prefix = self._next_prefix(prefix)
-        batch = None
-        while batch is None or len(batch) > 0:
-            batch = self._range_entries(begin_key=prefix if batch is None else batch[-1][0],
-                                        begin_key_included=batch is None,
-                                        end_key=next_prefix,
-                                        end_key_included=False)
-            for item in batch:
-                yield item
+        return self._scan(prefix, self._next_prefix(prefix), entries=True)
+
+    def list_page(self, prefix, start_after=None, limit=100, reverse=False, entries=False):
+        # type: (str, Optional[str], int, bool, bool) -> List[any]
+        """
+        Lists a page of the keys (or key, value pairs) starting with the given prefix, in order
+        The last key of a page is the cursor to pass as start_after to get the next page. A page with less than limit items
+        is the last one
+        :param prefix: Prefix of the keys
+        :type prefix: str
+        :param start_after: List the keys after this key (before this key when listing in reverse). Defaults to the first
+        (or last) key under the prefix
+        :type start_after: str
+        :param limit: Maximum number of items of the page
+        :type limit: int
+        :param reverse: List the keys in reverse order
+        :type reverse: bool
+        :param entries: List the key, value pairs instead of the keys
+        :type entries: bool
+        :return: The keys or key, value pairs
+        :rtype: list
+        """
+        try:
+            end_key = self._next_prefix(prefix)
+        except ValueError:
+            end_key = None  # The keys under the prefix have no upper bound, like for an empty prefix
+        if reverse is False:
+            begin_key, begin_key_included = prefix, True
+            if start_after is not None and start_after >= prefix:
+                begin_key, begin_key_included = start_after, False
+            if end_key is not None and begin_key >= end_key:
+                return []
+            range_function = self._range_entries if entries is True else self._range
+            return range_function(begin_key, begin_key_included, end_key, False, limit)
+        # There is no reverse range of keys only
+        begin_key = end_key
+        if start_after is not None and (end_key is None or start_after < end_key):
+            if start_after < prefix:
+                return []
+            begin_key = start_after
+        page = self._rev_range_entries(begin_key, False, prefix, True, limit)
+        return page if entries is True else [item[0] for item in page]
+
+    def count_prefix(self, prefix):
+        # type: (str) -> int
+        """
+        Counts the keys starting with the given prefix. Arakoon can't count a prefix, so the keys are listed (without values)
+        :param prefix: Prefix of the keys
+        :type prefix: str
+        :return: The number of keys
+        :rtype: int
+        """
+        try:
+            end_key = self._next_prefix(prefix)
+        except ValueError:
+            end_key = None
+        return sum(1 for _ in self._scan(prefix, end_key, entries=False))
+
+    def _scan(self, begin_key, end_key, entries):
+        # type: (str, str, bool) -> Generator[any]
+        """
+        Lists all keys (or key, value pairs) of a range in batches
+        The size of the batches is adapted to the observed payload size. With read-ahead (pipelined clients only), the next
+        batch is requested by a worker thread while the caller consumes the current one
+        :param begin_key: Key to start the range with (included)
+        :type begin_key: str
+        :param end_key: Key to end the range with (excluded)
+        :type end_key: str
+        :param entries: List the key, value pairs instead of the keys
+        :type entries: bool
+        :return: Generator that yields keys or key, value pairs
+        :rtype: Generator[any]
+        """
+        range_function = self._range_entries if entries is True else self._range
+        batch = range_function(begin_key, True, end_key, False, self._batch_size)
+        worker = None
+        try:
+            while len(batch) > 0:
+                last_key = batch[-1][0] if entries is True else batch[-1]
+                batch_size = self._get_batch_size(batch, entries)
+                read_ahead = None
+                if self._read_ahead is True and self._pipelined is True:
+                    if worker is None:
+                        worker = _ReadAheadWorker()
+                    read_ahead = _ReadAhead(range_function, last_key, False, end_key, False, batch_size, worker=worker)
+                for item in batch:
+                    yield item
+                if read_ahead is not None:
+                    batch = read_ahead.get()
+                else:
+                    batch = range_function(last_key, False, end_key, False, batch_size)
+        finally:
+            if worker is not None:
+                worker.stop()
+
+    def _get_batch_size(self, batch, entries):
+        # type: (list, bool) -> int
+        """
+        Calculates the size of the next batch of a scan, based on the size of the items of the previous batch
+        :param batch: Previous batch
+        :type batch: list
+        :param entries: The batch contains key, value pairs
+        :type entries: bool
+        :return: Number of items to request
+        :rtype: int
+        """
+        sample = batch[::max(1, len(batch) // 100)]
+        if entries is True:
+            payload = sum(len(key) + len(value) for key, value in sample)
+        else:
+            payload = sum(len(key) for key in sample)
+        item_size = float(payload) / len(sample) + 8  # Every string is preceded by its length
+        return int(max(self.BATCH_SIZE_MIN, min(self.BATCH_SIZE_MAX, self.BATCH_PAYLOAD / item_size)))
 
     @locked()
     @handle_arakoon_errors(is_read_only=False)
@@ -347,10 +753,13 @@ class PyrakoonClient(PyrakoonBase):
                 return self._sequences[transaction].addDelete(key)
             else:
                 return self._sequences[transaction].addReplace(key, None)
-        if must_exist is True:
-            return self._client.delete(key)
-        else:
-            return self._client.replace(key, None)
+        try:
+            if must_exist is True:
+                return self._client.delete(key)
+            else:
+                return self._client.replace(key, None)
+        finally:
+            self._register_write(keys=[key])
 
     @locked()
     @handle_arakoon_errors(is_read_only=False)
@@ -367,7 +776,10 @@ class PyrakoonClient(PyrakoonBase):
         """
         if transaction is not None:
             return self._sequences[transaction].addDeletePrefix(prefix)
-        return self._client.deletePrefix(prefix)
+        try:
+            return self._client.deletePrefix(prefix)
+        finally:
+            self._register_write(prefix=prefix)
 
     @locked()
     @handle_arakoon_errors(is_read_only=True)
@@ -389,7 +801,7 @@ class PyrakoonClient(PyrakoonBase):
         :return True if key exists else False
         :rtype: bool
         """
-        return self._client.exists(key)
+        return self._client.exists(key, consistency=self._get_consistency())
 
     @locked()
     @handle_arakoon_errors(is_read_only=True)
@@ -450,7 +862,10 @@ class PyrakoonClient(PyrakoonBase):
         :return: None
         :rtype: NoneType
         """
-        self._client.sequence(sequence)
+        try:
+            self._client.sequence(sequence)
+        finally:
+            self._register_write(sequence=sequence)
 
     @locked()
     def apply_transaction(self, transaction, delete=True):
@@ -482,6 +897,34 @@ class PyrakoonClient(PyrakoonBase):
         """
         self._sequences.pop(transaction, None)
 
+    @locked()
+    def _apply_sequence(self, sequence):
+        # type: (Sequence) -> None
+        """
+        Applies a sequence built outside of the transactions of this client
+        :param sequence: Sequence to execute
+        :type sequence: Sequence
+        :return: None
+        :rtype: NoneType
+        """
+        return self._apply_transaction(sequence)
+
+    def transaction_builder(self, atomic=True, max_payload=None, max_steps=None):
+        # type: (bool, Optional[int], Optional[int]) -> TransactionBuilder
+        """
+        Returns a builder for transactions which keeps track of their size
+        :param atomic: Apply all steps in a single sequence, failing when the limits are exceeded. When False, the steps are
+        applied in consecutive sequences within the limits. Check TransactionBuilder
+        :type atomic: bool
+        :param max_payload: Maximum size of a sequence, in bytes
+        :type max_payload: int
+        :param max_steps: Maximum number of steps of a sequence
+        :type max_steps: int
+        :return: The transaction builder
+        :rtype: TransactionBuilder
+        """
+        return TransactionBuilder(self._apply_sequence, atomic=atomic, max_payload=max_payload, max_steps=max_steps)
+
     def lock(self, name, wait=None, expiration=60):
         # type: (str, float, float) -> PyrakoonLock
         """
@@ -533,22 +976,106 @@ class PyrakoonClient(PyrakoonBase):
                 retry_wait_func(tries)
 
 
+class _LockRefresher(object):
+    """
+    Refreshes the leases of all locks held by the process, from a single thread
+    The thread only runs while locks are held
+    """
+    def __init__(self):
+        # type: () -> None
+        self._locks = set()
+        self._condition = Condition()
+        self._thread = None
+
+    def register(self, lock):
+        # type: (PyrakoonLock) -> None
+        """
+        Starts refreshing the lease of a lock
+        :param lock: Lock to refresh
+        :type lock: PyrakoonLock
+        :return: None
+        :rtype: NoneType
+        """
+        with self._condition:
+            self._locks.add(lock)
+            if self._thread is None:
+                self._thread = Thread(target=self._run, name='pyrakoon_lock_refresher')
+                self._thread.daemon = True
+                self._thread.start()
+            self._condition.notify()
+
+    def unregister(self, lock):
+        # type: (PyrakoonLock) -> None
+        """
+        Stops refreshing the lease of a lock
+        :param lock: Lock to stop refreshing
+        :type lock: PyrakoonLock
+        :return: None
+        :rtype: NoneType
+        """
+        with self._condition:
+            self._locks.discard(lock)
+            self._condition.notify()
+
+    def _run(self):
+        # type: () -> None
+        """
+        Refreshes the leases which are due, until no locks are held anymore
+        """
+        while True:
+            with self._condition:
+                if not self._locks:
+                    self._thread = None
+                    return
+                now = time.time()
+                due = [lock for lock in self._locks if lock.refresh_at <= now]
+                if not due:
+                    self._condition.wait(min(lock.refresh_at for lock in self._locks) - now)
+                    continue
+            for lock in due:
+                lock.refresh_lock()
+
+
 class PyrakoonLock(object):
     """
-    Lock implementation around Arakoon
+    Lease lock implementation around Arakoon
     To be used as a context manager
+    - The lock is a key holding the identifier of the owner and the expiration of its lease. The key is created, taken over
+      when expired and refreshed atomically, using sequences with asserts and test-and-set
+    - Waiting for the lock backs off exponentially, with jitter
+    - The leases of all locks held by the process are refreshed by a single thread, every third of the expiration time
+    - Every acquisition of a lock gets a fencing token: a number which increases with every acquisition of the same lock.
+      Pass it along to the protected resource, which should reject requests with a lower token than it has already seen:
+      a holder which lost its lease (e.g. while paused for longer than the expiration) can then do no harm
     """
     LOCK_LOCATION = '/ovs/locks/{0}'
+    TOKEN_LOCATION = '/ovs/lock_tokens/{0}'
     EXPIRATION_KEY = 'expires'
 
+    # Waiting for the lock sleeps a random time up to BACKOFF_BASE * 2 ** attempt, capped at BACKOFF_MAX (in seconds)
+    BACKOFF_BASE = 0.01
+    BACKOFF_MAX = 1.0
+
     _logger = logging.getLogger(__name__)
+    _refresher = _LockRefresher()
+    _metrics = {'acquired': 0,
+                'timeouts': 0,
+                'contentions': 0,
+                'acquire_time': 0.0,
+                'max_acquire_time': 0.0,
+                'released': 0,
+                'hold_time': 0.0,
+                'max_hold_time': 0.0,
+                'refreshes': 0,
+                'lost': 0}
+    _metrics_lock = Lock()
 
     def __init__(self, client, name, wait=None, expiration=60):
-        # type: (PyrakoonClient, str, float, float) -> None
+        # type: (PyrakoonBase, str, float, float) -> None
         """
-        Initialize a ConfigurationLock
-        :param client: PyrakoonClient to work with
-        :type client: PyrakoonClient
+        Initialize a PyrakoonLock
+        :param client: Client to work with: a PyrakoonClient or PyrakoonClientPooled
+        :type client: PyrakoonBase
         :param name: Name of the lock to acquire.
         :type name: str
         :param expiration: Expiration time of the lock (in seconds)
@@ -556,17 +1083,21 @@ class PyrakoonLock(object):
         :param wait: Amount of time to wait to acquire the lock (in seconds)
         :type wait: float
         """
-        raise NotImplementedError('The Pyrakoon lease mechanism has not been properly implemented')
         self.id = str(uuid.uuid4())
         self.name = name
+        self.refresh_at = None
         self._client = client
         self._expiration = expiration
         self._data_set = None
         self._key = self.LOCK_LOCATION.format(self.name)
+        self._token_key = self.TOKEN_LOCATION.format(self.name)
         self._wait = wait
         self._start = 0
+        self._token = None
+        self._expires = 0
         self._has_lock = False
-        self._refresher = None
+        self._lost = False
+        self._mutex = Lock()  # Serializes refreshing and releasing
 
     def __enter__(self):
         # type: () -> PyrakoonLock
@@ -578,84 +1109,117 @@ class PyrakoonLock(object):
         _ = args, kwargs
         self.release()
 
+    @property
+    def token(self):
+        # type: () -> Optional[int]
+        """
+        Fencing token of the current acquisition of the lock. None when the lock is not held
+        :rtype: int
+        """
+        return self._token if self._has_lock is True else None
+
+    def is_held(self):
+        # type: () -> bool
+        """
+        Returns whether the lock is held: acquired, not lost and the lease did not expire
+        :rtype: bool
+        """
+        return self._has_lock is True and self._lost is False and time.time() < self._expires
+
     def acquire(self, wait=None):
         # type: (float) -> bool
         """
         Acquire a lock on the mutex, optionally given a maximum wait timeout
-        :param wait: Time to wait for lock
+        :param wait: Time to wait for lock. Defaults to the wait time of the lock. Waits forever when both are None
         :type wait: float
+        :raises: NoLockAvailableException if the lock could not be acquired in time
         """
         if self._has_lock:
             return True
-        self._start = time.time()
+        start = time.time()
         if wait is None:
             wait = self._wait
-        while self._client.exists(self._key):
-            time.sleep(0.005)
-            # Check if it has expired
-            try:
-                original_lock_data = self._client.get(self._key)
-                lock_data = ujson.loads(original_lock_data)
-            except ArakoonNotFound:
-                self._logger.debug('Unable to retrieve data: Key {0} was removed in meanwhile'.format(self._key))
-                continue  # Key was removed in meanwhile
-            except Exception:
-                self._logger.exception('Unable to retrieve the data of key {0}'.format(self._key))
-                continue
-            expiration = lock_data.get(self.EXPIRATION_KEY, None)
-            if expiration is None or time.time() > expiration:
-                self._logger.info('Expiration for key {0} (lock id: {1}) was reached. Looking to remove it.'.format(self._key, lock_data['id']))
-                # Remove the expired lock
+        attempt = 0
+        while True:
+            original_lock_data, original_token = self._client.get_multi([self._key, self._token_key], must_exist=False)
+            if original_lock_data is None or self._is_expired(original_lock_data):
+                if original_lock_data is not None:
+                    self._logger.info('Expiration for key {0} was reached. Taking it over'.format(self._key))
+                token = int(original_token or 0) + 1
+                data_to_set = self._get_lock_data(token)
+                # Fails when another instance got (or refreshed) the lock in the meantime
                 transaction = self._client.begin_transaction()
                 self._client.assert_value(self._key, original_lock_data, transaction=transaction)
-                self._client.delete(self._key, transaction=transaction)
+                self._client.assert_value(self._token_key, original_token, transaction=transaction)
+                self._client.set(self._token_key, str(token), transaction=transaction)
+                self._client.set(self._key, data_to_set, transaction=transaction)
                 try:
                     self._client.apply_transaction(transaction)
+                    break
                 except ArakoonAssertionFailed:
-                    self._logger.warning('Lost the race to cleanup the expired key {0}.'.format(self._key))
-                except:
-                    self._logger.exception('Unable to remove the expired entry')
-                continue  # Always check the key again even when errors occurred
-            passed = time.time() - self._start
-            if wait is not None and passed > wait:
+                    self._logger.debug('Lost the race for lock {0}'.format(self._key))
+            self._update_metrics(contentions=1)
+            passed = time.time() - start
+            if wait is not None and passed >= wait:
                 self._logger.error('Lock for {0} could not be acquired. {1} sec > {2} sec'.format(self._key, passed, wait))
+                self._update_metrics(timeouts=1)
                 raise NoLockAvailableException('Could not acquire lock {0}'.format(self._key))
-        # Create the lock entry
-        transaction = self._client.begin_transaction()
-        self._client.assert_value(self._key, None, transaction=transaction)  # Key shouldn't exist
-        data_to_set = self._get_lock_data()
-        self._client.set(self._key, data_to_set, transaction=transaction)
-        try:
-            self._client.apply_transaction(transaction)
-            self._data_set = data_to_set
-            self._logger.debug('Acquired lock {0}'.format(self._key))
-        except ArakoonAssertionFailed:
-            self._logger.info('Lost the race with another lock, back to acquiring')
-            return self.acquire(wait)
-        except:
-            self._logger.exception('Exception occurred while setting the lock')
-            raise
-        passed = time.time() - self._start
+            backoff = random.uniform(0, min(self.BACKOFF_MAX, self.BACKOFF_BASE * 2 ** attempt))
+            if wait is not None:
+                backoff = min(backoff, wait - passed)
+            time.sleep(backoff)
+            attempt += 1
+        now = time.time()
+        passed = now - start
         if passed > 0.2:  # More than 200 ms is a long time to wait
-            if self._logger is not None:
-                self._logger.warning('Waited {0} sec for lock {1}'.format(passed, self._key))
-        self._start = time.time()
+            self._logger.warning('Waited {0} sec for lock {1}'.format(passed, self._key))
+        self._update_metrics(acquired=1, acquire_time=passed)
+        self._data_set = data_to_set
+        self._token = token
+        self._expires = now + self._expiration
+        self._start = now
+        self._lost = False
         self._has_lock = True
-        self._refresher = RepeatingTimer(5, self.refresh_lock)
+        self.refresh_at = now + self._expiration / 3.0
+        self._refresher.register(self)
+        self._logger.debug('Acquired lock {0} with token {1}'.format(self._key, token))
         return True
 
-    def _get_lock_data(self):
+    def _is_expired(self, lock_data):
+        # type: (str) -> bool
+        """
+        Checks whether the lease of a lock expired
+        :param lock_data: Value of the lock key
+        :type lock_data: str
+        :rtype: bool
+        """
+        try:
+            expiration = ujson.loads(lock_data).get(self.EXPIRATION_KEY)
+        except (ValueError, AttributeError):
+            self._logger.exception('Invalid data for lock {0}'.format(self._key))
+            return True
+        return expiration is None or time.time() > expiration
+
+    def _get_lock_data(self, token):
+        # type: (int) -> str
         now = time.time()
-        return ujson.dumps({'time_set': now, self.EXPIRATION_KEY: now + self._expiration, 'id': self.id})
+        return ujson.dumps({'time_set': now, self.EXPIRATION_KEY: now + self._expiration, 'id': self.id, 'token': token})
 
     def release(self):
         # type: () -> None
         """
         Releases the lock
         """
-        if self._has_lock and self._data_set and self._refresher:
-            self._refresher.cancel()
-            self._refresher.join()
+        self._refresher.unregister(self)
+        with self._mutex:
+            if not self._has_lock or self._data_set is None:
+                return
+            self._has_lock = False
+            hold_time = time.time() - self._start
+            self._update_metrics(released=1, hold_time=hold_time)
+            if self._lost is True:
+                self._logger.warning('The lock {0} was lost while being held'.format(self._key))
+                return
             transaction = self._client.begin_transaction()
             self._client.assert_value(self._key, self._data_set, transaction=transaction)
             self._client.delete(self._key, transaction=transaction)
@@ -667,28 +1231,62 @@ class PyrakoonLock(object):
             except:
                 self._logger.exception('Unable to remove the lock')
                 raise
-            passed = time.time() - self._start
-            if passed > 0.5:  # More than 500 ms is a long time to hold a lock
-                if self._logger is not None:
-                    self._logger.warning('A lock on {0} was kept for {1} sec'.format(self._key, passed))
-            self._has_lock = False
+            if hold_time > 0.5:  # More than 500 ms is a long time to hold a lock
+                self._logger.warning('A lock on {0} was kept for {1} sec'.format(self._key, hold_time))
 
     def refresh_lock(self):
+        # type: () -> None
         """
-        Refreshes the lock by setting now expiration dates
+        Refreshes the lock by setting a new expiration date
+        Called by the refresher thread
         """
-        if self._has_lock and self._data_set is not None:
-            transaction = self._client.begin_transaction()
-            self._client.assert_value(self._key, self._data_set, transaction=transaction)
-            data_to_set = self._get_lock_data()
-            self._client.set(self._key, data_to_set, transaction=transaction)
+        with self._mutex:
+            if not self._has_lock or self._lost is True or self._data_set is None:
+                return
+            data_to_set = self._get_lock_data(self._token)
             try:
-                self._client.apply_transaction(transaction)
-                self._data_set = data_to_set
-                self._logger.debug('Refreshed lock {0}'.format(self._key))
-            except ArakoonAssertionFailed:
-                self._logger.exception('The lock was taken over by another instance')
-                raise
-            except:
-                self._logger.exception('Unable to remove the lock')
-                raise
\ No newline at end of file
+                original_data = self._client.test_and_set(self._key, self._data_set, data_to_set)
+            except Exception:
+                self._logger.exception('Unable to refresh lock {0}'.format(self._key))
+                self.refresh_at = time.time() + min(self._expiration / 10.0, 1)  # Try again soon
+                return
+            if original_data != self._data_set:
+                self._logger.error('The lock {0} was taken over by another instance'.format(self._key))
+                self._lost = True
+                self._update_metrics(lost=1)
+                self._refresher.unregister(self)
+                return
+            now = time.time()
+            self._data_set = data_to_set
+            self._expires = now + self._expiration
+            self.refresh_at = now + self._expiration / 3.0
+            self._update_metrics(refreshes=1)
+            self._logger.debug('Refreshed lock {0}'.format(self._key))
+
+    @classmethod
+    def _update_metrics(cls, acquire_time=None, hold_time=None, **counters):
+        # type: (Optional[float], Optional[float], **int) -> None
+        with cls._metrics_lock:
+            for name, value in counters.iteritems():
+                cls._metrics[name] += value
+            if acquire_time is not None:
+                cls._metrics['acquire_time'] += acquire_time
+                cls._metrics['max_acquire_time'] = max(cls._metrics['max_acquire_time'], acquire_time)
+            if hold_time is not None:
+                cls._metrics['hold_time'] += hold_time
+                cls._metrics['max_hold_time'] = max(cls._metrics['max_hold_time'], hold_time)
+
+    @classmethod
+    def get_metrics(cls):
+        # type: () -> Dict[str, Any]
+        """
+        Returns the metrics of all locks of the process:
+        - acquired, timeouts, contentions: number of acquisitions, acquisitions which timed out and attempts which found the lock taken
+        - acquire_time, max_acquire_time: total and maximum time waited for the locks (in seconds)
+        - released, hold_time, max_hold_time: number of releases, total and maximum time the locks were held (in seconds)
+        - refreshes, lost: number of lease refreshes and the number of locks which were taken over while being held
+        :return: The metrics
+        :rtype: dict
+        """
+        with cls._metrics_lock:
+            return dict(cls._metrics)
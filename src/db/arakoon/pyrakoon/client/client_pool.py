@@ -13,35 +13,113 @@
 #
 # Open vStorage is distributed in the hope that it will be useful,
 # but WITHOUT ANY WARRANTY of any kind.
-import gevent
+
+import time
+import socket
+import threading
 from collections import deque
 from contextlib import contextmanager
-from gevent.coros import BoundedSemaphore
-from .client import PyrakoonClient
+from .client import PyrakoonClient, _ReadAhead
+from .exceptions import ArakoonNotConnected, ArakoonSocketException, ArakoonSockNotReadable, ArakoonSockReadNoBytes, \
+    ArakoonSockSendError
 from ovs_extensions.log.logger import Logger
 
+# noinspection PyUnreachableCode
+if False:
+    from typing import Any, Dict, Iterable, List, Optional, Tuple
+    from .cache import ReadCache
+    from .client import ReadPolicy
+
+BACKEND_THREADING = 'threading'
+BACKEND_GEVENT = 'gevent'
+
+
+class _ThreadingBackend(object):
+    """
+    Waits and spawns using plain threads
+    """
+    name = BACKEND_THREADING
+
+    @staticmethod
+    def semaphore(value):
+        return threading.BoundedSemaphore(value)
+
+    @staticmethod
+    def spawn(function, *args):
+        return _ReadAhead(function, *args)
+
+
+class _GeventBackend(object):
+    """
+    Waits and spawns using greenlets
+    """
+    name = BACKEND_GEVENT
+
+    @staticmethod
+    def semaphore(value):
+        from gevent.lock import BoundedSemaphore
+        return BoundedSemaphore(value)
+
+    @staticmethod
+    def spawn(function, *args):
+        import gevent
+        return gevent.spawn(function, *args)
+
+
+def _get_default_backend():
+    # type: () -> str
+    """
+    Greenlets are only used when gevent patched the threading module: the pool can then be shared by greenlets and
+    (patched) threads alike. Otherwise plain threads are used
+    """
+    try:
+        from gevent import monkey
+    except ImportError:
+        return BACKEND_THREADING
+    return BACKEND_GEVENT if monkey.is_module_patched('threading') else BACKEND_THREADING
+
+
+class _PooledClient(object):
+    """
+    Client of the pool and its usage
+    """
+    __slots__ = ('client', 'last_used', 'last_checked')
+
+    def __init__(self, client):
+        # type: (PyrakoonClient) -> None
+        self.client = client
+        self.last_used = time.time()
+        self.last_checked = self.last_used
+
 
 class PyrakoonPool(object):
     """
     Pyrakoon pool.
-    Keeps a number of Pyrakoon clients queued up to avoid waiting too long on a socket lock of a single instance
+    Hands out Pyrakoon clients to avoid waiting too long on a socket lock of a single instance
     Uses PyrakoonClient as it has retries on master loss
+    The pool is elastic: clients are created when all clients are in use (up to the pool size) and evicted after being
+    idle for a while (down to the minimum size). Clients which were idle for a while are health checked with a nop
+    before being handed out and clients which failed with a socket error are replaced
     """
 
     _logger = Logger('extensions')
 
-    # Frequency with which the pool is populated at startup
-    SPAWN_FREQUENCY = 0.1
+    # Exceptions after which a client is considered broken
+    BROKEN_CLIENT_EXCEPTIONS = (ArakoonNotConnected, ArakoonSocketException, ArakoonSockNotReadable, ArakoonSockReadNoBytes,
+                                ArakoonSockSendError, socket.error)
+    BACKENDS = {BACKEND_THREADING: _ThreadingBackend,
+                BACKEND_GEVENT: _GeventBackend}
 
-    def __init__(self, cluster, nodes, pool_size=10, retries=10, retry_back_off_multiplier=2, retry_interval_sec=2):
-        # type: (str, Dict[str, Tuple[str, int]], int, int, int, int) -> None
+    def __init__(self, cluster, nodes, pool_size=10, retries=10, retry_back_off_multiplier=2, retry_interval_sec=2, read_policy=None,
+                 min_size=1, idle_timeout=300, health_check_interval=30, backend=None, cache=None):
+        # type: (str, Dict[str, Tuple[str, int]], int, int, int, int, Optional[ReadPolicy], int, float, float, Optional[str], Optional[ReadCache]) -> None
         """
         Initializes the client
         :param cluster: Identifier of the cluster
         :type cluster: str
         :param nodes: Dict with all node sockets. {name of the node: (ip of node, port of node)}
         :type nodes: dict
-        :param pool_size: Number of clients to keep in the pool
+        :param pool_size: Maximum number of clients in the pool
         :type pool_size: int
         :param retries: Number of retries to do
         :type retries: int
@@ -49,19 +127,60 @@ class PyrakoonPool(object):
         :type retry_back_off_multiplier: int
         :param retry_interval_sec: Seconds to wait before retrying. Exponentially increases with every retry.
         :type retry_interval_sec: int
+        :param read_policy: Route the reads to the other nodes of the cluster. The policy is shared by all clients of the pool
+        :type read_policy: ReadPolicy
+        :param min_size: Number of clients kept in the pool, even when idle
+        :type min_size: int
+        :param idle_timeout: Seconds after which an idle client is evicted from the pool
+        :type idle_timeout: float
+        :param health_check_interval: Seconds after which an idle client is health checked before handing it out
+        :type health_check_interval: float
+        :param backend: Wait for clients and spawn concurrent work using 'threading' or 'gevent'.
+        Defaults to gevent when gevent patched the threading module, to threading otherwise
+        :type backend: str
+        :param cache: Cache the values read by get and get_multi. The cache is shared by all clients of the pool
+        :type cache: ReadCache
         """
+        if backend is None:
+            backend = _get_default_backend()
+        if backend not in self.BACKENDS:
+            raise ValueError('Unknown backend {0}'.format(backend))
         self.pool_size = pool_size
+        self.min_size = min(min_size, pool_size)
+        self.idle_timeout = idle_timeout
+        self.health_check_interval = health_check_interval
+        self._backend = self.BACKENDS[backend]
         self._pyrakoon_args = (cluster, nodes, retries, retry_back_off_multiplier, retry_interval_sec)
-        self._sequences = {}
+        self._read_policy = read_policy
+        self._cache = cache
 
-        self._lock = BoundedSemaphore(pool_size)
+        self._slots = self._backend.semaphore(pool_size)  # Bounds the number of clients in use
+        self._lock = threading.Lock()  # Only guards the bookkeeping, never held while waiting or doing I/O
+        self._idle = deque()  # Most recently used client on the right
+        self._size = 0
+        self._metrics = {'checkouts': 0,
+                         'waits': 0,
+                         'wait_time': 0.0,
+                         'max_wait_time': 0.0,
+                         'in_use': 0,
+                         'max_in_use': 0,
+                         'created': 0,
+                         'evicted': 0,
+                         'replaced': 0,
+                         'health_checks': 0,
+                         'failed_health_checks': 0}
+        for _ in xrange(self.min_size):
+            self._idle.append(_PooledClient(self._create_new_client()))
+            self._size += 1
 
-        self._clients = deque()
-        for i in xrange(pool_size):
-            # No clients as of yet. Decrease the count
-            self._lock.acquire()
-        for i in xrange(pool_size):
-            gevent.spawn_later(self.SPAWN_FREQUENCY * i, self._add_client)
+    @property
+    def backend(self):
+        # type: () -> str
+        """
+        Backend of the pool: 'threading' or 'gevent'
+        :rtype: str
+        """
+        return self._backend.name
 
     def _create_new_client(self):
         # type: () -> PyrakoonClient
@@ -71,41 +190,198 @@ class PyrakoonPool(object):
         :return: The created PyrakoonClient client
         :rtype: PyrakoonClient
         """
-        return PyrakoonClient(*self._pyrakoon_args)
+        client = PyrakoonClient(*self._pyrakoon_args, read_policy=self._read_policy, cache=self._cache)
+        with self._lock:
+            self._metrics['created'] += 1
+        return client
 
-    def _add_client(self):
-        # type: () -> None
+    @staticmethod
+    def _close_client(client):
+        # type: (PyrakoonClient) -> None
         """
-        Add a new client to the pool
-        :return: None
+        Closes the connections of a client which left the pool
         """
-        sleep_time = 0.1
-        while True:
-            client = self._create_new_client()
-            if client:
-                break
-            gevent.sleep(sleep_time)
-
-        self._clients.append(client)
-        self._lock.release()
+        try:
+            client._client.dropConnections()
+        except Exception:
+            pass
 
     @contextmanager
     def get_client(self):
         # type: () -> Iterable[PyrakoonClient]
         """
         Get a client from the pool. Used as context manager
+        Waits when the maximum number of clients is in use
+        A client raising one of the BROKEN_CLIENT_EXCEPTIONS is replaced by a new client
         """
-        self._lock.acquire()
-        # Client should always be present as we acquire the semaphore which would block until the are clients the in the
-        # queue but checking if it's None makes the IDE not complain
-        client = None
+        start = time.time()
+        waited = False
+        if not self._slots.acquire(blocking=False):
+            waited = True
+            self._slots.acquire()
         try:
-            client = self._clients.popleft()
-            yield client
-        # Possible catch exception that require a new client to be spawned.
-        # When creating a new client, the semaphore will have to be released when spawning a new one
-        # You won't be able to use the finally statement then but will have to rely on try except else
+            pooled_client = self._checkout(time.time() - start, waited)
+        except Exception:
+            self._slots.release()
+            raise
+        broken = False
+        try:
+            yield pooled_client.client
+        except self.BROKEN_CLIENT_EXCEPTIONS:
+            broken = True
+            raise
         finally:
-            if client:
-                self._clients.append(client)
-                self._lock.release()
+            self._checkin(pooled_client, broken)
+            self._slots.release()
+
+    def _checkout(self, wait_time, waited):
+        # type: (float, bool) -> _PooledClient
+        """
+        Takes an idle client or creates a new one. A free slot must be acquired
+        :param wait_time: Time waited on a free slot
+        :type wait_time: float
+        :param waited: The checkout had to wait on a free slot
+        :type waited: bool
+        :return: The client to hand out
+        :rtype: _PooledClient
+        """
+        with self._lock:
+            evicted = self._evict()
+            pooled_client = self._idle.pop() if self._idle else None
+            if pooled_client is None:
+                self._size += 1
+            metrics = self._metrics
+            metrics['checkouts'] += 1
+            metrics['waits'] += 1 if waited is True else 0
+            metrics['wait_time'] += wait_time
+            metrics['max_wait_time'] = max(metrics['max_wait_time'], wait_time)
+            metrics['in_use'] += 1
+            metrics['max_in_use'] = max(metrics['max_in_use'], metrics['in_use'])
+        for client in evicted:
+            self._close_client(client)
+        try:
+            if pooled_client is None:
+                pooled_client = _PooledClient(self._create_new_client())
+            elif time.time() - pooled_client.last_checked > self.health_check_interval and not self._check_health(pooled_client):
+                self._close_client(pooled_client.client)
+                pooled_client = _PooledClient(self._create_new_client())
+                with self._lock:
+                    self._metrics['replaced'] += 1
+        except Exception:
+            with self._lock:
+                self._size -= 1
+                self._metrics['in_use'] -= 1
+            raise
+        return pooled_client
+
+    def _checkin(self, pooled_client, broken):
+        # type: (_PooledClient, bool) -> None
+        """
+        Returns a client to the pool. A broken client is replaced by a new one
+        :param pooled_client: Client to return
+        :type pooled_client: _PooledClient
+        :param broken: The client hit a socket error
+        :type broken: bool
+        """
+        if broken is True:
+            self._logger.warning('Replacing Pyrakoon client after a socket error')
+            self._close_client(pooled_client.client)
+            pooled_client = _PooledClient(self._create_new_client())
+        pooled_client.last_used = time.time()
+        with self._lock:
+            self._metrics['in_use'] -= 1
+            self._metrics['replaced'] += 1 if broken is True else 0
+            self._idle.append(pooled_client)
+
+    def _evict(self):
+        # type: () -> List[PyrakoonClient]
+        """
+        Removes the clients which were idle for too long. The lock must be held
+        :return: The evicted clients, to be closed once the lock is released
+        :rtype: List[PyrakoonClient]
+        """
+        evicted = []
+        deadline = time.time() - self.idle_timeout
+        while self._idle and self._size > self.min_size and self._idle[0].last_used < deadline:
+            evicted.append(self._idle.popleft().client)
+            self._size -= 1
+            self._metrics['evicted'] += 1
+        return evicted
+
+    def _check_health(self, pooled_client):
+        # type: (_PooledClient) -> bool
+        """
+        Checks whether a client can still reach the cluster by executing a nop, without retrying
+        :param pooled_client: Client to check
+        :type pooled_client: _PooledClient
+        :return: True when healthy
+        :rtype: bool
+        """
+        healthy = True
+        try:
+            pooled_client.client._client.nop()
+            pooled_client.last_checked = time.time()
+        except Exception as ex:
+            self._logger.warning('Pyrakoon client failed its health check: {0}'.format(ex))
+            healthy = False
+        with self._lock:
+            self._metrics['health_checks'] += 1
+            self._metrics['failed_health_checks'] += 0 if healthy is True else 1
+        return healthy
+
+    def maintain(self):
+        # type: () -> None
+        """
+        Evicts the clients which were idle for too long and health checks the other idle clients
+        Clients are also evicted and health checked when handed out: this only has to be called (periodically) to get
+        rid of idle clients and connections sooner
+        :return: None
+        :rtype: NoneType
+        """
+        now = time.time()
+        with self._lock:
+            evicted = self._evict()
+            to_check = [pooled_client for pooled_client in self._idle if now - pooled_client.last_checked > self.health_check_interval]
+            for pooled_client in to_check:
+                self._idle.remove(pooled_client)
+        for client in evicted:
+            self._close_client(client)
+        for pooled_client in to_check:
+            if not self._check_health(pooled_client):
+                self._close_client(pooled_client.client)
+                replacement = _PooledClient(self._create_new_client())
+                replacement.last_used = pooled_client.last_used  # Still evicted when idle for too long
+                pooled_client = replacement
+                with self._lock:
+                    self._metrics['replaced'] += 1
+            with self._lock:
+                self._idle.appendleft(pooled_client)  # The checked clients were idle the longest
+
+    def spawn(self, function, *args):
+        # type: (callable, *Any) -> Any
+        """
+        Executes a function concurrently, using the backend of the pool
+        :param function: Function to execute
+        :type function: callable
+        :return: Object of which get() waits for the function and returns its result (or raises its exception)
+        :rtype: any
+        """
+        return self._backend.spawn(function, *args)
+
+    def get_metrics(self):
+        # type: () -> Dict[str, Any]
+        """
+        Returns the metrics of the pool:
+        - size, idle, in_use, max_in_use: current number of clients, idle clients, clients in use and the peak of clients in use
+        - checkouts, waits, wait_time, max_wait_time: number of clients handed out, how many of them had to wait for a free
+        client, the total and maximum time waited (in seconds)
+        - created, evicted, replaced: number of clients created, evicted for being idle and replaced for being broken
+        - health_checks, failed_health_checks: number of health checks done and failed
+        :return: The metrics
+        :rtype: dict
+        """
+        with self._lock:
+            metrics = dict(self._metrics)
+            metrics['size'] = self._size
+            metrics['idle'] = len(self._idle)
+        return metrics
@@ -17,7 +17,9 @@ import uuid
 import time
 import random
 from .base_client import PyrakoonBase
+from .client import PyrakoonLock
 from .client_pool import PyrakoonPool
+from .transaction import TransactionBuilder
 from ovs_extensions.db.arakoon.pyrakoon.pyrakoon.compat import Sequence, ArakoonAssertionFailed, Consistency
 from ovs_extensions.log.logger import Logger
 
@@ -26,26 +28,21 @@ class PyrakoonClientPooled(PyrakoonBase):
     """
     Pooled arakoon client wrapper
     Exposes the same API as the base PyrakoonClient while using a pool underneath
-
-    NOTE: this client won't work in a thread except the main thread when not monkey patching gevent
-    Monkey patching can be done using
-    from gevent import monkey
-    monkey.patch_all()
-
-    This has to be called at the start of the application.
+    The pool works with plain threads or with gevent. Check PyrakoonPool
     """
 
     _logger = Logger('extensions')
 
-    def __init__(self, cluster, nodes, pool_size=10, retries=10, retry_back_off_multiplier=2, retry_interval_sec=2):
-        # type: (str, Dict[str, Tuple[str, int]], int, int, int, int) -> None
+    def __init__(self, cluster, nodes, pool_size=10, retries=10, retry_back_off_multiplier=2, retry_interval_sec=2, read_policy=None,
+                 min_pool_size=1, idle_timeout=300, health_check_interval=30, backend=None, cache=None):
+        # type: (str, Dict[str, Tuple[str, int]], int, int, int, int, Optional[ReadPolicy], int, float, float, Optional[str], Optional[ReadCache]) -> None
         """
         Initializes the client
         :param cluster: Identifier of the cluster
         :type cluster: str
         :param nodes: Dict with all node sockets. {name of the node: (ip of node, port of node)}
         :type nodes: dict
-        :param pool_size: Number of clients to keep in the pool
+        :param pool_size: Maximum number of clients in the pool
         :type pool_size: int
         :param retries: Number of retries to do
         :type retries: int
@@ -53,8 +50,22 @@ class PyrakoonClientPooled(PyrakoonBase):
         :type retry_back_off_multiplier: int
         :param retry_interval_sec: Seconds to wait before retrying. Exponentially increases with every retry.
         :type retry_interval_sec: int
-        """
-        self._pool = PyrakoonPool(cluster, nodes, pool_size, retries, retry_back_off_multiplier, retry_interval_sec)
+        :param read_policy: Route the reads to the other nodes of the cluster. Defaults to reading from the master
+        :type read_policy: ReadPolicy
+        :param min_pool_size: Number of clients kept in the pool, even when idle
+        :type min_pool_size: int
+        :param idle_timeout: Seconds after which an idle client is evicted from the pool
+        :type idle_timeout: float
+        :param health_check_interval: Seconds after which an idle client is health checked before using it
+        :type health_check_interval: float
+        :param backend: 'threading' or 'gevent'. Check PyrakoonPool
+        :type backend: str
+        :param cache: Cache the values read by get and get_multi. Updates through this client invalidate the cache
+        :type cache: ReadCache
+        """
+        self._pool = PyrakoonPool(cluster, nodes, pool_size, retries, retry_back_off_multiplier, retry_interval_sec, read_policy,
+                                  min_size=min_pool_size, idle_timeout=idle_timeout, health_check_interval=health_check_interval,
+                                  backend=backend, cache=cache)
         self._sequences = {}
 
     def get(self, key, consistency=None):
@@ -105,30 +116,130 @@ class PyrakoonClientPooled(PyrakoonBase):
         with self._pool.get_client() as client:
             return client.set(key, value)
 
-    def prefix(self, prefix):
-        # type: (str) -> Generator[str]
+    def test_and_set(self, key, old_value, new_value):
+        # type: (str, Optional[str], Optional[str]) -> Optional[str]
+        """
+        Sets the value of a key only if it holds the given value
+        :param key: The key to set
+        :type key: str
+        :param old_value: Value the key must hold. None when the key must not exist
+        :type old_value: str
+        :param new_value: Value to store. None to delete the key
+        :type new_value: str
+        :return: The value of the key before the call. The key was set when it equals old_value
+        :rtype: str
+        """
+        with self._pool.get_client() as client:
+            return client.test_and_set(key, old_value, new_value)
+
+    def prefix(self, prefix, parts=1):
+        # type: (str, int) -> Generator[str]
         """
         Lists all keys starting with the given prefix
         :param prefix: Prefix of the key
         :type prefix: str
+        :param parts: Split the range of keys in the given number of sub-ranges, listed concurrently by different
+        clients of the pool
+        :type parts: int
         :return: Generator that yields keys
         :rtype: iterable[str]
         """
+        if parts > 1:
+            return self._split_scan(prefix, parts, entries=False)
         with self._pool.get_client() as client:
             return client.prefix(prefix)
 
-    def prefix_entries(self, prefix):
-        # type: (str) -> Generator[Tuple[str, any]]
+    def prefix_entries(self, prefix, parts=1):
+        # type: (str, int) -> Generator[Tuple[str, any]]
         """
         Lists all key, value pairs starting with the given prefix
         :param prefix: Prefix of the key
         :type prefix: str
+        :param parts: Split the range of keys in the given number of sub-ranges, listed concurrently by different
+        clients of the pool
+        :type parts: int
         :return: Generator that yields key, value pairs
         :rtype: iterable[Tuple[str, any]
         """
+        if parts > 1:
+            return self._split_scan(prefix, parts, entries=True)
         with self._pool.get_client() as client:
             return client.prefix_entries(prefix)
 
+    def list_page(self, prefix, start_after=None, limit=100, reverse=False, entries=False):
+        # type: (str, Optional[str], int, bool, bool) -> List[any]
+        """
+        Lists a page of the keys (or key, value pairs) starting with the given prefix, in order
+        The last key of a page is the cursor to pass as start_after to get the next page. A page with less than limit items
+        is the last one
+        :param prefix: Prefix of the keys
+        :type prefix: str
+        :param start_after: List the keys after this key (before this key when listing in reverse). Defaults to the first
+        (or last) key under the prefix
+        :type start_after: str
+        :param limit: Maximum number of items of the page
+        :type limit: int
+        :param reverse: List the keys in reverse order
+        :type reverse: bool
+        :param entries: List the key, value pairs instead of the keys
+        :type entries: bool
+        :return: The keys or key, value pairs
+        :rtype: list
+        """
+        with self._pool.get_client() as client:
+            return client.list_page(prefix, start_after, limit, reverse, entries)
+
+    def count_prefix(self, prefix):
+        # type: (str) -> int
+        """
+        Counts the keys starting with the given prefix. Arakoon can't count a prefix, so the keys are listed (without values)
+        :param prefix: Prefix of the keys
+        :type prefix: str
+        :return: The number of keys
+        :rtype: int
+        """
+        with self._pool.get_client() as client:
+            return client.count_prefix(prefix)
+
+    def _split_scan(self, prefix, parts, entries):
+        # type: (str, int, bool) -> Generator[any]
+        """
+        Lists all keys (or key, value pairs) starting with the given prefix by scanning sub-ranges concurrently
+        The items are yielded in order: the items of a sub-range as soon as all previous sub-ranges were yielded
+        :param prefix: Prefix of the key
+        :type prefix: str
+        :param parts: Number of sub-ranges
+        :type parts: int
+        :param entries: List the key, value pairs instead of the keys
+        :type entries: bool
+        :return: Generator that yields keys or key, value pairs
+        :rtype: Generator[any]
+        """
+        def _scan(begin_key, end_key):
+            with self._pool.get_client() as client:
+                return list(client._scan(begin_key, end_key, entries))
+
+        next_prefix = self._next_prefix(prefix)
+        with self._pool.get_client() as client:
+            first_keys = client._range(prefix, True, next_prefix, False, 1)
+            last_entries = client._rev_range_entries(next_prefix, False, prefix, True, 1)
+        if len(first_keys) == 0:
+            return
+        ranges = self._split_prefix(prefix, parts, first_keys[0], last_entries[0][0])
+        scans = [self._pool.spawn(_scan, begin_key, end_key) for begin_key, end_key in ranges]
+        for scan in scans:
+            for item in scan.get():
+                yield item
+
+    def get_pool_metrics(self):
+        # type: () -> Dict[str, Any]
+        """
+        Returns the metrics of the underlying pool. Check PyrakoonPool.get_metrics
+        :return: The metrics
+        :rtype: dict
+        """
+        return self._pool.get_metrics()
+
     def delete(self, key, must_exist=True, transaction=None):
         # type: (str, bool, str) -> any
         """
@@ -263,6 +374,34 @@ class PyrakoonClientPooled(PyrakoonBase):
         """
         self._sequences.pop(transaction, None)
 
+    def _apply_sequence(self, sequence):
+        # type: (Sequence) -> None
+        """
+        Applies a sequence built outside of the transactions of this client
+        :param sequence: Sequence to execute
+        :type sequence: Sequence
+        :return: None
+        :rtype: NoneType
+        """
+        with self._pool.get_client() as client:
+            return client._apply_transaction(sequence)
+
+    def transaction_builder(self, atomic=True, max_payload=None, max_steps=None):
+        # type: (bool, Optional[int], Optional[int]) -> TransactionBuilder
+        """
+        Returns a builder for transactions which keeps track of their size
+        :param atomic: Apply all steps in a single sequence, failing when the limits are exceeded. When False, the steps are
+        applied in consecutive sequences within the limits. Check TransactionBuilder
+        :type atomic: bool
+        :param max_payload: Maximum size of a sequence, in bytes
+        :type max_payload: int
+        :param max_steps: Maximum number of steps of a sequence
+        :type max_steps: int
+        :return: The transaction builder
+        :rtype: TransactionBuilder
+        """
+        return TransactionBuilder(self._apply_sequence, atomic=atomic, max_payload=max_payload, max_steps=max_steps)
+
     def lock(self, name, wait=None, expiration=60):
         # type: (str, float, float) -> PyrakoonLock
         """
@@ -276,7 +415,7 @@ class PyrakoonClientPooled(PyrakoonBase):
         :return: The lock implementation
         :rtype: PyrakoonLock
         """
-        raise NotImplementedError('')
+        return PyrakoonLock(self, name, wait, expiration)
 
     def apply_callback_transaction(self, transaction_callback, max_retries=0, retry_wait_function=None):
         # type: (callable, int, callable) -> None
@@ -26,3 +26,10 @@ class NoLockAvailableException(Exception):
     Raised when the lock could not be acquired
     """
     pass
+
+
+class TransactionTooLargeException(Exception):
+    """
+    Raised when an atomic transaction exceeds the size limits
+    """
+    pass
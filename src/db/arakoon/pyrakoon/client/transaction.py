@@ -0,0 +1,228 @@
+# Copyright (C) 2019 iNuron NV
+#
+# This file is part of Open vStorage Open Source Edition (OSE),
+# as available from
+#
+#      http://www.openvstorage.org and
+#      http://www.openvstorage.com.
+#
+# This file is free software; you can redistribute it and/or modify it
+# under the terms of the GNU Affero General Public License v3 (GNU AGPLv3)
+# as published by the Free Software Foundation, in version 3 as it comes
+# in the LICENSE.txt file of the Open vStorage OSE distribution.
+#
+# Open vStorage is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY of any kind.
+
+"""
+Transaction builder module
+"""
+
+import logging
+from .exceptions import TransactionTooLargeException
+from ovs_extensions.db.arakoon.pyrakoon.pyrakoon.compat import Sequence
+
+# noinspection PyUnreachableCode
+if False:
+    from typing import Any, Callable, Dict, Optional
+
+
+class TransactionBuilder(object):
+    """
+    Builds transactions (Arakoon sequences) while keeping track of their size
+    - Atomic (default): all steps are applied in a single sequence when calling apply. Adding a step which makes the
+      sequence exceed the limits fails immediately, before anything is sent
+    - Non-atomic: the steps are streamed to Arakoon in consecutive sequences (chunks) within the limits, in order. A chunk is
+      applied as soon as the next step does not fit anymore. Asserts only guard the steps of their own chunk and a failing
+      chunk does not roll back the chunks applied before it
+    Can be used as a context manager: the pending steps are applied when the block exits without exception
+    """
+    # Limits of a single sequence: the size of the serialized steps (in bytes) and the number of steps
+    MAX_PAYLOAD = 4 * 1024 * 1024
+    MAX_STEPS = 5000
+
+    _logger = logging.getLogger(__name__)
+
+    def __init__(self, apply_function, atomic=True, max_payload=None, max_steps=None, encode=None):
+        # type: (Callable[[Sequence], None], bool, Optional[int], Optional[int], Optional[Callable[[Any], str]]) -> None
+        """
+        Initializes the builder
+        :param apply_function: Function applying a sequence
+        :type apply_function: callable
+        :param atomic: Apply all steps in a single sequence
+        :type atomic: bool
+        :param max_payload: Maximum size of a sequence, in bytes. Defaults to MAX_PAYLOAD
+        :type max_payload: int
+        :param max_steps: Maximum number of steps of a sequence. Defaults to MAX_STEPS
+        :type max_steps: int
+        :param encode: Function serializing the values to set and assert. Defaults to storing the values as given
+        :type encode: callable
+        """
+        self.atomic = atomic
+        self.max_payload = self.MAX_PAYLOAD if max_payload is None else max_payload
+        self.max_steps = self.MAX_STEPS if max_steps is None else max_steps
+        self._apply_function = apply_function
+        self._encode = encode
+        self._sequence = Sequence()
+        self._payload = 8  # Tag and number of steps of the sequence
+        self._statistics = {'steps': 0,
+                            'payload': 0,
+                            'chunks': 0,
+                            'max_chunk_steps': 0,
+                            'max_chunk_payload': 0}
+
+    def __enter__(self):
+        # type: () -> TransactionBuilder
+        return self
+
+    def __exit__(self, exc_type, *args):
+        # type: (type, *Any) -> None
+        _ = args
+        if exc_type is None:
+            self.apply()
+
+    @property
+    def pending_steps(self):
+        # type: () -> int
+        """
+        Number of steps which were not applied yet
+        :rtype: int
+        """
+        return len(self._sequence._updates)
+
+    @property
+    def pending_payload(self):
+        # type: () -> int
+        """
+        Size of the sequence holding the steps which were not applied yet, in bytes
+        :rtype: int
+        """
+        return self._payload
+
+    def set(self, key, value):
+        # type: (str, Any) -> None
+        """
+        Adds setting a key
+        :param key: Key to set
+        :type key: str
+        :param value: Value to set
+        :type value: any
+        :return: None
+        :rtype: NoneType
+        """
+        if self._encode is not None:
+            value = self._encode(value)
+        self._add(12 + len(key) + len(value), 'addSet', key, value)
+
+    def delete(self, key, must_exist=True):
+        # type: (str, bool) -> None
+        """
+        Adds deleting a key
+        :param key: Key to delete
+        :type key: str
+        :param must_exist: Fail (the chunk of) the transaction when the key does not exist
+        :type must_exist: bool
+        :return: None
+        :rtype: NoneType
+        """
+        if must_exist is True:
+            self._add(8 + len(key), 'addDelete', key)
+        else:
+            self._add(9 + len(key), 'addReplace', key, None)
+
+    def delete_prefix(self, prefix):
+        # type: (str) -> None
+        """
+        Adds deleting all keys starting with a prefix
+        :param prefix: Prefix of the keys to delete
+        :type prefix: str
+        :return: None
+        :rtype: NoneType
+        """
+        self._add(8 + len(prefix), 'addDeletePrefix', prefix)
+
+    def assert_value(self, key, value):
+        # type: (str, Any) -> None
+        """
+        Adds asserting the value of a key
+        :param key: Key to assert
+        :type key: str
+        :param value: Expected value. None asserts the key does not exist
+        :type value: any
+        :return: None
+        :rtype: NoneType
+        """
+        if value is not None and self._encode is not None:
+            value = self._encode(value)
+        self._add(9 + len(key) + (0 if value is None else 4 + len(value)), 'addAssert', key, value)
+
+    def assert_exists(self, key):
+        # type: (str) -> None
+        """
+        Adds asserting that a key exists
+        :param key: Key to assert
+        :type key: str
+        :return: None
+        :rtype: NoneType
+        """
+        self._add(8 + len(key), 'addAssertExists', key)
+
+    def _add(self, size, add_function, *args):
+        # type: (int, str, *Any) -> None
+        """
+        Adds a step, applying the pending steps first when the step does not fit in the same sequence
+        :param size: Serialized size of the step
+        :type size: int
+        :param add_function: Name of the Sequence function adding the step. Resolved after applying the pending steps
+        :type add_function: str
+        """
+        if size + 8 > self.max_payload:
+            raise TransactionTooLargeException('A single step of {0} bytes exceeds the limit of {1} bytes'.format(size, self.max_payload))
+        if self._payload + size > self.max_payload or self.pending_steps + 1 > self.max_steps:
+            if self.atomic is True:
+                raise TransactionTooLargeException('Transaction exceeds the limits of {0} bytes and {1} steps: {2} bytes in {3} steps pending'
+                                                   .format(self.max_payload, self.max_steps, self._payload + size, self.pending_steps + 1))
+            self._apply_chunk()
+        getattr(self._sequence, add_function)(*args)
+        self._payload += size
+        self._statistics['steps'] += 1
+
+    def _apply_chunk(self):
+        # type: () -> None
+        """
+        Applies the pending steps
+        """
+        if self.pending_steps == 0:
+            return
+        sequence, steps, payload = self._sequence, self.pending_steps, self._payload
+        self._sequence = Sequence()
+        self._payload = 8
+        self._logger.debug('Applying a sequence of {0} steps, {1} bytes'.format(steps, payload))
+        self._apply_function(sequence)
+        statistics = self._statistics
+        statistics['chunks'] += 1
+        statistics['payload'] += payload
+        statistics['max_chunk_steps'] = max(statistics['max_chunk_steps'], steps)
+        statistics['max_chunk_payload'] = max(statistics['max_chunk_payload'], payload)
+
+    def apply(self):
+        # type: () -> None
+        """
+        Applies the pending steps
+        :return: None
+        :rtype: NoneType
+        """
+        self._apply_chunk()
+
+    def get_statistics(self):
+        # type: () -> Dict[str, int]
+        """
+        Returns the statistics of the builder: the number of steps added, the number of sequences (chunks) applied, the total
+        payload applied and the maximum number of steps and payload of a chunk, and the steps and payload still pending
+        :return: The statistics
+        :rtype: dict
+        """
+        statistics = dict(self._statistics)
+        statistics['pending_steps'] = self.pending_steps
+        statistics['pending_payload'] = self.pending_payload
+        return statistics
@@ -24,7 +24,6 @@ import logging
 import operator
 import os
 import random
-import select
 import socket
 import ssl
 import threading
@@ -97,6 +96,13 @@ class AtLeast(Consistency):
         return 'AtLeast(%i)' % self.i
 
 
+# Read routing: the node serving reads which do not have to be served by the master (NoGuarantee or AtLeast consistency)
+READ_FROM_MASTER = 'master'
+READ_FROM_NEAREST = 'nearest'  # The node with the lowest observed latency
+READ_FROM_LEAST_LOADED = 'least_loaded'  # The node with the least requests in flight, spreading the reads evenly
+READ_FROM_POLICIES = (READ_FROM_MASTER, READ_FROM_NEAREST, READ_FROM_LEAST_LOADED)
+
+
 def _validate_signature_helper(fun, *args):
     param_native_type_mapping = {
         'int': int,
@@ -178,7 +184,7 @@ def _convert_exceptions(fun):
 
 
 class ArakoonClient(object):
-    def __init__(self, config, timeout=0, noMasterTimeout=0):
+    def __init__(self, config, timeout=0, noMasterTimeout=0, pipelined=False):
         """
         Constructor of an Arakoon client object.
 
@@ -193,9 +199,12 @@ class ArakoonClient(object):
         @type timeout: int or float
         @param noMasterTimeout: period (in seconds) messages to the master should be retried when a master re-election occurs
         @type noMasterTimeout: int or float
+        @param pipelined: allow many requests (of different threads or greenlets) to be in flight on a single connection
+        instead of serializing every request/response round-trip. Responses are matched with their requests in FIFO order
+        @type pipelined: bool
         """
 
-        self._client = _ArakoonClient(config, timeout, noMasterTimeout)
+        self._client = _ArakoonClient(config, timeout, noMasterTimeout, pipelined)
 
         # Keep a reference, for compatibility reasons
         self._config = config
@@ -248,7 +257,8 @@ class ArakoonClient(object):
         @return : True if there is a value for that key, False otherwise
         """
 
-        return self._client.exists(key, consistency=consistency)
+        consistency_ = self._determine_consistency(consistency)
+        return self._client.exists(key, consistency=consistency_)
 
     @utils.update_argspec('self', 'key', ('consistency', None))
     @_convert_exceptions
@@ -365,10 +375,10 @@ class ArakoonClient(object):
     __delitem__ = delete
     __contains__ = exists
 
-    @utils.update_argspec('self', 'beginKey', 'beginKeyIncluded', 'endKey', 'endKeyIncluded', ('maxElements', -1))
+    @utils.update_argspec('self', 'beginKey', 'beginKeyIncluded', 'endKey', 'endKeyIncluded', ('maxElements', -1), ('consistency', None))
     @_convert_exceptions
-    @_validate_signature('string_option', 'bool', 'string_option', 'bool', 'int')
-    def range(self, beginKey, beginKeyIncluded, endKey, endKeyIncluded, maxElements=-1):
+    @_validate_signature('string_option', 'bool', 'string_option', 'bool', 'int', 'consistency_option')
+    def range(self, beginKey, beginKeyIncluded, endKey, endKeyIncluded, maxElements=-1, consistency=None):
         """
         Perform a range query on the store, retrieving the set of matching keys
 
@@ -386,11 +396,12 @@ class ArakoonClient(object):
         @param endKey: Upper boundary of the requested range
         @param endKeyIncluded: Indicates if the upper boundary should be part of the result set
         @param maxElements: The maximum number of keys to return. Negative means no maximum, all matches will be returned. Defaults to -1.
+        @param consistency: Consistency of the read. Defaults to the consistency of the client, see L{setConsistency}
 
         @rtype: list of strings
         @return: Returns a list containing all matching keys
         """
-        consistency_ = self._determine_consistency(self._consistency)
+        consistency_ = self._determine_consistency(consistency)
         result = self._client.range(beginKey, beginKeyIncluded,
                                     endKey, endKeyIncluded,
                                     maxElements,
@@ -398,10 +409,10 @@ class ArakoonClient(object):
 
         return result
 
-    @utils.update_argspec('self', 'beginKey', 'beginKeyIncluded', 'endKey', 'endKeyIncluded', ('maxElements', -1))
+    @utils.update_argspec('self', 'beginKey', 'beginKeyIncluded', 'endKey', 'endKeyIncluded', ('maxElements', -1), ('consistency', None))
     @_convert_exceptions
-    @_validate_signature('string_option', 'bool', 'string_option', 'bool', 'int')
-    def range_entries(self, beginKey, beginKeyIncluded, endKey, endKeyIncluded, maxElements=-1):
+    @_validate_signature('string_option', 'bool', 'string_option', 'bool', 'int', 'consistency_option')
+    def range_entries(self, beginKey, beginKeyIncluded, endKey, endKeyIncluded, maxElements=-1, consistency=None):
         """
         Perform a range query on the store, retrieving the set of matching key-value pairs
 
@@ -423,7 +434,7 @@ class ArakoonClient(object):
         @rtype: list of strings
         @return: Returns a list containing all matching key-value pairs
         """
-        consistency_ = self._determine_consistency(self._consistency)
+        consistency_ = self._determine_consistency(consistency)
         result = self._client.range_entries(beginKey, beginKeyIncluded,
                                             endKey, endKeyIncluded,
                                             maxElements,
@@ -431,10 +442,10 @@ class ArakoonClient(object):
 
         return result
 
-    @utils.update_argspec('self', 'keyPrefix', ('maxElements', -1))
+    @utils.update_argspec('self', 'keyPrefix', ('maxElements', -1), ('consistency', None))
     @_convert_exceptions
-    @_validate_signature('string', 'int')
-    def prefix(self, keyPrefix, maxElements=-1):
+    @_validate_signature('string', 'int', 'consistency_option')
+    def prefix(self, keyPrefix, maxElements=-1, consistency=None):
         """
         Retrieve a set of keys that match with the provided prefix.
 
@@ -449,7 +460,7 @@ class ArakoonClient(object):
         @rtype: list of strings
         @return: Returns a list of keys matching the provided prefix
         """
-        consistency_ = self._determine_consistency(self._consistency)
+        consistency_ = self._determine_consistency(consistency)
         result = self._client.prefix(keyPrefix, maxElements, consistency=consistency_)
 
         return result
@@ -484,10 +495,10 @@ class ArakoonClient(object):
 
         return self._client.test_and_set(key, oldValue, newValue)
 
-    @utils.update_argspec('self', 'keys')
+    @utils.update_argspec('self', 'keys', ('consistency', None))
     @_convert_exceptions
-    @_validate_signature('string_list')
-    def multiGet(self, keys):
+    @_validate_signature('string_list', 'consistency_option')
+    def multiGet(self, keys, consistency=None):
         """
         Retrieve the values for the keys in the given list.
 
@@ -495,13 +506,13 @@ class ArakoonClient(object):
         @rtype: string list
         @return: the values associated with the respective keys
         """
-        consistency_ = self._determine_consistency(self._consistency)
+        consistency_ = self._determine_consistency(consistency)
         return self._client.multi_get(keys, consistency=consistency_)
 
-    @utils.update_argspec('self', 'keys')
+    @utils.update_argspec('self', 'keys', ('consistency', None))
     @_convert_exceptions
-    @_validate_signature('string_list')
-    def multiGetOption(self, keys):
+    @_validate_signature('string_list', 'consistency_option')
+    def multiGetOption(self, keys, consistency=None):
         """
         Retrieve the values for the keys in the given list.
 
@@ -509,7 +520,7 @@ class ArakoonClient(object):
         @rtype: string option list
         @return: the values associated with the respective keys (None if no value corresponds)
         """
-        consistency_ = self._determine_consistency(self._consistency)
+        consistency_ = self._determine_consistency(consistency)
         return self._client.multi_get_option(keys, consistency=consistency_)
 
     @utils.update_argspec('self')
@@ -577,9 +588,9 @@ class ArakoonClient(object):
     def aSSert_exists(self, key):
         return self._client.assert_exists(key)
 
-    @utils.update_argspec('self', 'beginKey', 'beginKeyIncluded', 'endKey', 'endKeyIncluded', ('maxElements', -1))
+    @utils.update_argspec('self', 'beginKey', 'beginKeyIncluded', 'endKey', 'endKeyIncluded', ('maxElements', -1), ('consistency', None))
     @_convert_exceptions
-    def rev_range_entries(self, beginKey, beginKeyIncluded, endKey, endKeyIncluded, maxElements=-1):
+    def rev_range_entries(self, beginKey, beginKeyIncluded, endKey, endKeyIncluded, maxElements=-1, consistency=None):
         """
         Performs a reverse range query on the store, returning a sorted (in reverse order) list of key value pairs.
         @type beginKey: string option
@@ -592,7 +603,7 @@ class ArakoonClient(object):
         @param maxElements: maximum number of key-value pairs to return. Negative means 'all'. Defaults to -1
         @rtype : list of (string,string)
         """
-        consistency_ = self._determine_consistency(self._consistency)
+        consistency_ = self._determine_consistency(consistency)
         result = self._client.rev_range_entries(beginKey, beginKeyIncluded,
                                                 endKey, endKeyIncluded,
                                                 maxElements, consistency=consistency_)
@@ -699,6 +710,29 @@ class ArakoonClient(object):
         """
         self._consistency = Consistent()
 
+    @utils.update_argspec('self', 'readFrom')
+    @_convert_exceptions
+    @_validate_signature('string')
+    def setReadRouting(self, readFrom):
+        """
+        Sets the node serving the reads which do not have to be served by the master: reads with a L{NoGuarantee} or
+        L{AtLeast} consistency. Reads a node can not serve (e.g. a node lagging behind for an L{AtLeast} read) are
+        retried on the master
+        @type readFrom: string
+        @param readFrom: one of READ_FROM_MASTER (default), READ_FROM_NEAREST or READ_FROM_LEAST_LOADED
+        """
+        if readFrom not in READ_FROM_POLICIES:
+            raise ValueError('Unknown read routing policy %s' % readFrom)
+        self._client.read_from = readFrom
+
+    def getReadStatistics(self):
+        """
+        @return: per node, the number of reads routed to the node, the reads in flight, the average latency of the node
+        (in seconds, None when unknown) and the number of failed reads
+        @rtype: dict
+        """
+        return self._client.get_read_statistics()
+
     def makeSequence(self):
         return Sequence()
 
@@ -1106,10 +1140,49 @@ class ArakoonClientConfig:
 
 
 # Actual client implementation
+class _NodeStatistics(object):
+    """
+    Statistics of the reads routed to a node
+    """
+    LATENCY_WEIGHT = 0.2
+    """Weight of a new latency sample in the moving average"""
+    FAILURE_BACKOFF = 10
+    """Period (in seconds) no reads are routed to a node after a read failed"""
+
+    def __init__(self):
+        self.reads = 0
+        self.in_flight = 0
+        self.latency = None
+        self.failures = 0
+        self.failed_at = None
+
+    def is_available(self, now):
+        return self.failed_at is None or now - self.failed_at > self.FAILURE_BACKOFF
+
+    def read_done(self, duration, failed):
+        self.in_flight -= 1
+        if failed:
+            self.failures += 1
+            self.failed_at = time.time()
+            return
+        self.failed_at = None
+        if self.latency is None:
+            self.latency = duration
+        else:
+            self.latency += self.LATENCY_WEIGHT * (duration - self.latency)
+
+
 class _ArakoonClient(object, client.AbstractClient, client.ClientMixin):
-    def __init__(self, config, timeout=0, noMasterTimeout=0):
+    # Server errors after which a read routed to another node is retried on the master
+    ROUTED_READ_ERRORS = (errors.InconsistentRead, errors.NotMaster, errors.GoingDown, errors.MaxConnections)
+
+    def __init__(self, config, timeout=0, noMasterTimeout=0, pipelined=False):
         self._config = config
         self.master_id = None
+        self.read_from = READ_FROM_MASTER
+        self._pipelined = pipelined
+        self._node_statistics = dict()
+        self._statistics_lock = threading.Lock()
 
         self._lock = threading.RLock()
         self._connections = dict()
@@ -1125,7 +1198,22 @@ class _ArakoonClient(object, client.AbstractClient, client.ClientMixin):
 
     def _process(self, message, node_id=None, retry=True):
 
-        bytes_ = ''.join(message.serialize())
+        bytes_ = message.encode()
+
+        if node_id is None and self.read_from != READ_FROM_MASTER and self._is_routable(message):
+            read_node_id = self._select_read_node()
+            if read_node_id is not None:
+                try:
+                    return self._process_routed(message, bytes_, read_node_id)
+                except self.ROUTED_READ_ERRORS as e:
+                    LOGGER.info('%s: Node %s could not serve the read, retrying on the master', e, read_node_id)
+                except (errors.ArakoonError, ArakoonInvalidArguments):
+                    raise
+                except Exception as e:
+                    LOGGER.warning('%s: Read on node %s failed, retrying on the master', e, read_node_id)
+
+        if self._pipelined:
+            return self._process_pipelined(message, bytes_, node_id, retry)
 
         self._lock.acquire()
 
@@ -1138,11 +1226,10 @@ class _ArakoonClient(object, client.AbstractClient, client.ClientMixin):
                 try:
                     # Send on wire
                     if node_id is None:
-                        connection = self._send_to_master(bytes_)
+                        connection, _ = self._send_to_master(bytes_)
                     else:
-                        connection = self._send_message(node_id, bytes_)
-                    return utils.read_blocking(message.receive(),
-                                               connection.read)
+                        connection, _ = self._send_message(node_id, bytes_)
+                    return protocol.decode_result(message, connection)
                 except (errors.NotMaster,
                         ArakoonNoMaster,
                         ArakoonNotConnected,
@@ -1161,8 +1248,128 @@ class _ArakoonClient(object, client.AbstractClient, client.ClientMixin):
         finally:
             self._lock.release()
 
+    def _process_pipelined(self, message, bytes_, node_id, retry):
+        # Only sending happens while holding the lock. The response is read once the responses to all requests sent
+        # earlier on the same connection were read (by their own threads)
+        start = time.time()
+        tryCount = 0.0
+        backoffPeriod = 0.2
+        deadline = start + self._master_timeout
+        while True:
+            connection = None
+            try:
+                if node_id is None:
+                    connection, ticket = self._send_to_master(bytes_)
+                else:
+                    connection, ticket = self._send_message(node_id, bytes_)
+                return connection.receive(ticket, message)
+            except (errors.NotMaster,
+                    ArakoonNoMaster,
+                    ArakoonNotConnected,
+                    ArakoonSockReadNoBytes):
+                # Only drop the failing connection: other requests in flight on newer connections remain valid
+                self._drop_connection(connection)
+
+                sleepPeriod = backoffPeriod * tryCount
+                if retry and time.time() + sleepPeriod <= deadline:
+                    tryCount += 1.0
+                    LOGGER.warning('Master not found, retrying in %0.2f seconds' % sleepPeriod)
+                    time.sleep(sleepPeriod)
+                else:
+                    raise
+
+    @staticmethod
+    def _is_routable(message):
+        consistency_ = getattr(message, 'consistency', None)
+        return consistency_ is consistency.INCONSISTENT or isinstance(consistency_, consistency.AtLeast)
+
+    def _select_read_node(self):
+        now = time.time()
+        self._statistics_lock.acquire()
+        try:
+            candidates = []
+            for node_id in self._config.getNodes():
+                statistics = self._node_statistics.get(node_id)
+                if statistics is None:
+                    statistics = self._node_statistics[node_id] = _NodeStatistics()
+                if statistics.is_available(now):
+                    candidates.append((node_id, statistics))
+            if not candidates:
+                return None
+            if self.read_from == READ_FROM_NEAREST:
+                # Nodes without a latency yet are tried first, to measure their latency
+                key = lambda candidate: (candidate[1].latency or 0, candidate[1].in_flight)
+            else:
+                key = lambda candidate: (candidate[1].in_flight, candidate[1].reads)
+            node_id, statistics = min(candidates, key=key)
+            statistics.reads += 1
+            statistics.in_flight += 1
+            return node_id
+        finally:
+            self._statistics_lock.release()
+
+    def _process_routed(self, message, bytes_, node_id):
+        # A single attempt: on failure, the read is retried on the master by the caller
+        start = time.time()
+        failed = True
+        connection = None
+        try:
+            if self._pipelined:
+                connection, ticket = self._send_message(node_id, bytes_, count=1)
+                result = connection.receive(ticket, message)
+            else:
+                self._lock.acquire()
+                try:
+                    connection, _ = self._send_message(node_id, bytes_, count=1)
+                    result = protocol.decode_result(message, connection)
+                finally:
+                    self._lock.release()
+            failed = False
+            return result
+        except errors.ArakoonError as e:
+            # The node responded: only errors indicating the node can not serve reads count as failures
+            failed = isinstance(e, self.ROUTED_READ_ERRORS)
+            raise
+        except Exception:
+            if connection is not None:
+                self._drop_connection(connection)
+            raise
+        finally:
+            self._statistics_lock.acquire()
+            try:
+                self._node_statistics[node_id].read_done(time.time() - start, failed)
+            finally:
+                self._statistics_lock.release()
+
+    def get_read_statistics(self):
+        self._statistics_lock.acquire()
+        try:
+            return dict((node_id, {'reads': statistics.reads,
+                                   'in_flight': statistics.in_flight,
+                                   'latency': statistics.latency,
+                                   'failures': statistics.failures})
+                        for node_id, statistics in self._node_statistics.iteritems())
+        finally:
+            self._statistics_lock.release()
+
+    def _drop_connection(self, connection):
+        self._lock.acquire()
+        try:
+            if connection is None:
+                self.master_id = None
+                self.drop_connections()
+                return
+            for node_id, node_connection in self._connections.items():
+                if node_connection is connection:
+                    self._connections.pop(node_id).close()
+                    if node_id == self.master_id:
+                        self.master_id = None
+        finally:
+            self._lock.release()
+
     def _send_message(self, node_id, data, count=-1):
         result = None
+        ticket = None
 
         if count < 0:
             count = self._config.getTryCount()
@@ -1176,6 +1383,8 @@ class _ArakoonClient(object, client.AbstractClient, client.ClientMixin):
             try:
                 connection = self._get_connection(node_id)
                 connection.send(data)
+                if self._pipelined:
+                    ticket = connection.enqueue()
 
                 result = connection
                 break
@@ -1192,18 +1401,24 @@ class _ArakoonClient(object, client.AbstractClient, client.ClientMixin):
         if not result:
             raise
 
-        return result
+        return result, ticket
 
     def _send_to_master(self, data):
-        self.determine_master()
-
-        connection = self._send_message(self.master_id, data)
+        self._lock.acquire()
+        try:
+            self.determine_master()
 
-        return connection
+            return self._send_message(self.master_id, data)
+        finally:
+            self._lock.release()
 
     def drop_connections(self):
-        for key in tuple(self._connections.iterkeys()):
-            self._connections.pop(key).close()
+        self._lock.acquire()
+        try:
+            for key in tuple(self._connections.iterkeys()):
+                self._connections.pop(key).close()
+        finally:
+            self._lock.release()
 
     def determine_master(self):
         if self.master_id is None:
@@ -1236,12 +1451,13 @@ class _ArakoonClient(object, client.AbstractClient, client.ClientMixin):
 
     def _get_master_id_from_node(self, node_id):
         command = protocol.WhoMaster()
-        data = ''.join(command.serialize())
+        data = command.encode()
 
-        connection = self._send_message(node_id, data)
+        connection, ticket = self._send_message(node_id, data)
 
-        receiver = command.receive()
-        return utils.read_blocking(receiver, connection.read)
+        if ticket is not None:
+            return connection.receive(ticket, command)
+        return protocol.decode_result(command, connection)
 
     def _validate_master_id(self, master_id):
         if not master_id:
@@ -1272,6 +1488,9 @@ class _ArakoonClient(object, client.AbstractClient, client.ClientMixin):
 
 
 class _ClientConnection(object):
+    BUFFER_SIZE = 65536
+    """Initial size of the receive buffer. Grown when a single read requires more"""
+
     def __init__(self, address, cluster_id,
                  tls, tls_ca_cert, tls_cert,
                  timeout=0):
@@ -1286,8 +1505,20 @@ class _ClientConnection(object):
             self._timeout = timeout
         else:
             self._timeout = ArakoonClientConfig.getConnectionTimeout()
+        # Pipelining: requests sent and responses read on the current socket (generation)
+        self._pipeline = threading.Condition(threading.Lock())
+        self._generation = 0
+        self._sent = 0
+        self._received = 0
+        # Receive buffer: bytes between start and end are received but not read yet
+        self._buffer = bytearray(self.BUFFER_SIZE)
+        self._view = memoryview(self._buffer)
+        self._start = 0
+        self._end = 0
 
     def connect(self):
+        self._reset_pipeline()
+        self._start = self._end = 0
         if self._socket:
             self._socket.close()
             self._socket = None
@@ -1342,7 +1573,72 @@ class _ClientConnection(object):
             self.close()
             raise ArakoonSockSendError
 
+    def enqueue(self):
+        """
+        Registers a request which was sent on this connection. Must be called in the order the requests were sent
+        @return: ticket to read the response with, see L{receive}
+        """
+        self._pipeline.acquire()
+        try:
+            ticket = (self._generation, self._sent)
+            self._sent += 1
+            return ticket
+        finally:
+            self._pipeline.release()
+
+    def receive(self, ticket, message):
+        """
+        Reads the response to a request, once the responses to all requests sent earlier were read
+        @param ticket: ticket of the request, see L{enqueue}
+        @param message: the message sent
+        @return: message result
+        """
+        generation, number = ticket
+        self._pipeline.acquire()
+        try:
+            while self._generation == generation and self._received != number:
+                self._pipeline.wait()
+            if self._generation != generation:
+                # The connection was closed or re-opened: this response will never arrive
+                raise ArakoonSockReadNoBytes
+        finally:
+            self._pipeline.release()
+        try:
+            result = protocol.decode_result(message, self)
+        except errors.ArakoonError:
+            # Error returned by the server: the response was read completely
+            self._response_read(generation)
+            raise
+        except:
+            # The position in the stream is unknown, so none of the other responses can be read
+            self.close()
+            raise
+        self._response_read(generation)
+        return result
+
+    def _response_read(self, generation):
+        self._pipeline.acquire()
+        try:
+            if self._generation == generation:
+                self._received += 1
+                self._pipeline.notify_all()
+        finally:
+            self._pipeline.release()
+
+    def _reset_pipeline(self):
+        # Wakes up all readers waiting for responses on the previous socket
+        self._pipeline.acquire()
+        try:
+            self._generation += 1
+            self._sent = 0
+            self._received = 0
+            self._pipeline.notify_all()
+        finally:
+            self._pipeline.release()
+
     def close(self):
+        self._reset_pipeline()
+        self._start = self._end = 0
         if self._connected and self._socket:
             try:
                 self._socket.close()
@@ -1354,55 +1650,115 @@ class _ClientConnection(object):
                 self._connected = False
 
     def read(self, count):
+        """
+        Reads the given amount of bytes. A single receive call fills the buffer with as much data as is available,
+        serving many (small) reads
+        @param count: amount of bytes to read
+        @return: the bytes read
+        @rtype: str
+        """
         if not self._connected:
             raise ArakoonSockRecvClosed
 
-        bytes_remaining = count
-        result = []
+        if self._end - self._start < count:
+            self._fill(count)
 
-        if isinstance(self._socket, ssl.SSLSocket):
-            pending = self._socket.pending()
-            if pending > 0:
-                tmp = self._socket.recv(min(bytes_remaining, pending))
-                result.append(tmp)
-                bytes_remaining = bytes_remaining - len(tmp)
+        start = self._start
+        self._start += count
+        return self._view[start:self._start].tobytes()
 
-        while bytes_remaining > 0:
-            reads, _, _ = select.select([self._socket], [], [], self._timeout)
+    def read_view(self, count):
+        """
+        Reads the given amount of bytes, like L{read}, without copying them
+        @param count: amount of bytes to read
+        @return: view on the bytes read. Only valid until the next read
+        @rtype: memoryview
+        """
+        if not self._connected:
+            raise ArakoonSockRecvClosed
 
-            if self._socket in reads:
-                try:
-                    data = self._socket.recv(bytes_remaining)
-                except Exception as e:
-                    LOGGER.exception('%s: Error while reading socket', e)
-                    self._connected = False
+        if self._end - self._start < count:
+            self._fill(count)
 
-                    raise ArakoonSockRecvError
+        start = self._start
+        self._start += count
+        return self._view[start:self._start]
 
-                if len(data) == 0:
-                    try:
-                        self.close()
-                    except Exception as e:
-                        LOGGER.exception('%s: Error while closing socket', e)
+    def peek(self):
+        """
+        Returns the receive buffer and the bounds of the received bytes which were not read yet, for the decoders
+        of L{protocol.decode_result}. Use L{seek} to mark bytes as read and L{fill} to receive more
+        @return: tuple of the buffer view, the offset of the first unread byte and the end of the received bytes
+        @rtype: tuple
+        """
+        if not self._connected:
+            raise ArakoonSockRecvClosed
 
-                    self._connected = False
+        return self._view, self._start, self._end
 
-                    raise ArakoonSockReadNoBytes
+    def seek(self, offset):
+        """
+        Marks all bytes in the receive buffer before the given offset as read
+        @param offset: offset in the view returned by L{peek}
+        """
+        self._start = offset
 
-                result.append(data)
-                bytes_remaining -= len(data)
+    def fill(self, count):
+        """
+        Receives data until at least the given amount of unread bytes is available. Invalidates the view returned by L{peek}
+        @param count: amount of bytes required
+        """
+        if not self._connected:
+            raise ArakoonSockRecvClosed
 
-            else:
+        if self._end - self._start < count:
+            self._fill(count)
+
+    def _fill(self, count):
+        available = self._end - self._start
+
+        if self._start + count > len(self._buffer) or (available == 0 and len(self._buffer) > self.BUFFER_SIZE >= count):
+            # Move the unread bytes to the start of the buffer. The buffer is grown when too small and shrunk once
+            # the data requiring a larger buffer was read
+            size = self.BUFFER_SIZE if count <= self.BUFFER_SIZE else max(count, 2 * len(self._buffer))
+            buffer_ = bytearray(size) if size != len(self._buffer) else self._buffer
+            buffer_[0:available] = self._view[self._start:self._end]
+            self._buffer = buffer_
+            self._view = memoryview(buffer_)
+            self._start = 0
+            self._end = available
+
+        while self._end - self._start < count:
+            try:
+                received = self._socket.recv_into(self._view[self._end:])
+            except socket.timeout:
+                # The socket timeout equals the connection timeout
                 try:
                     self.close()
                 except Exception as e:
                     LOGGER.exception('%s: Error while closing socket', e)
                 finally:
-                    self._connnected = False
+                    self._connected = False
 
                 raise ArakoonSockNotReadable
+            except Exception as e:
+                LOGGER.exception('%s: Error while reading socket', e)
+                self._connected = False
+                self._reset_pipeline()
+
+                raise ArakoonSockRecvError
+
+            if received == 0:
+                try:
+                    self.close()
+                except Exception as e:
+                    LOGGER.exception('%s: Error while closing socket', e)
+
+                self._connected = False
+
+                raise ArakoonSockReadNoBytes
 
-        return ''.join(result)
+            self._end += received
 
 
 class ArakoonAdmin(ArakoonClient):
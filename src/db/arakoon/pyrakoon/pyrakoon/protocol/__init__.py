@@ -107,6 +107,40 @@ class Type(object):
 
         yield self.PACKER.pack(value)
 
+    def size(self, value):
+        '''Calculate the size of the serialized value
+
+        The default implementation serializes the value, types used in large
+        messages provide a cheaper implementation.
+
+        :param value: Value to serialize
+        :type value: :obj:`object`
+
+        :return: Number of bytes of the serialized value
+        :rtype: :class:`int`
+        '''
+
+        return len(''.join(self.serialize(value)))
+
+    def pack_into(self, buffer_, offset, value):
+        '''Serialize value into a pre-sized buffer
+
+        :param buffer_: Buffer to write to, see :meth:`size`
+        :type buffer_: :class:`bytearray`
+        :param offset: Position in the buffer to write at
+        :type offset: :class:`int`
+        :param value: Value to serialize
+        :type value: :obj:`object`
+
+        :return: Position in the buffer right after the serialized value
+        :rtype: :class:`int`
+        '''
+
+        data = ''.join(self.serialize(value))
+        end = offset + len(data)
+        buffer_[offset:end] = data
+        return end
+
     def receive(self):
         '''Receive and parse a result from the server
 
@@ -146,6 +180,16 @@ class String(Type):
 
         yield struct.pack('<%ds' % length, value)
 
+    def size(self, value):
+        return 4 + len(value)
+
+    def pack_into(self, buffer_, offset, value):
+        length = len(value)
+        UINT32.PACKER.pack_into(buffer_, offset, length)
+        offset += 4
+        buffer_[offset:offset + length] = value
+        return offset + length
+
     def receive(self):
         length_receiver = UINT32.receive()
         request = length_receiver.next() #pylint: disable=E1101
@@ -163,7 +207,9 @@ class String(Type):
             result = ''
         else:
             data = yield Request(length)
-            result, = struct.unpack('<%ds' % length, data)
+            if len(data) != length:
+                raise ValueError('Expected %d bytes, got %d' % (length, len(data)))
+            result = str(data)  # Not copied when the data is a string already
 
         yield Result(result)
 
@@ -197,6 +243,13 @@ class UnsignedInteger(Type):
         if value > self.MAX_INT:
             raise ValueError('Integer overflow')
 
+    def size(self, value):
+        return self.PACKER.size
+
+    def pack_into(self, buffer_, offset, value):
+        self.PACKER.pack_into(buffer_, offset, value)
+        return offset + self.PACKER.size
+
 UINT32 = UnsignedInteger(32, '<I')
 UINT64 = UnsignedInteger(64, '<Q')
 
@@ -260,6 +313,13 @@ class Bool(Type):
         else:
             yield self.PACKER.pack(self.FALSE)
 
+    def size(self, value):
+        return 1
+
+    def pack_into(self, buffer_, offset, value):
+        buffer_[offset] = self.TRUE if value else self.FALSE
+        return offset + 1
+
     def receive(self):
         value_receiver = super(Bool, self).receive()
         request = value_receiver.next() #pylint: disable=E1101
@@ -319,6 +379,12 @@ class Step(Type):
         for part in value.serialize():
             yield part
 
+    def size(self, value):
+        return value.size()
+
+    def pack_into(self, buffer_, offset, value):
+        return value.pack_into(buffer_, offset)
+
     def receive(self):
         raise NotImplementedError('Steps can\'t be received')
 
@@ -350,6 +416,17 @@ class Option(Type):
             for bytes_ in self._inner_type.serialize(value):
                 yield bytes_
 
+    def size(self, value):
+        if value is None:
+            return 1
+        return 1 + self._inner_type.size(value)
+
+    def pack_into(self, buffer_, offset, value):
+        if value is None:
+            return BOOL.pack_into(buffer_, offset, False)
+        offset = BOOL.pack_into(buffer_, offset, True)
+        return self._inner_type.pack_into(buffer_, offset, value)
+
     def receive(self):
         has_value_receiver = BOOL.receive()
         request = has_value_receiver.next() #pylint: disable=E1101
@@ -407,6 +484,21 @@ class List(Type):
             for bytes_ in self._inner_type.serialize(value):
                 yield bytes_
 
+    def size(self, value):
+        inner_size = self._inner_type.size
+        size = 4
+        for value_ in value:
+            size += inner_size(value_)
+        return size
+
+    def pack_into(self, buffer_, offset, value):
+        values = tuple(value)
+        offset = UINT32.pack_into(buffer_, offset, len(values))
+        inner_pack_into = self._inner_type.pack_into
+        for value_ in values:
+            offset = inner_pack_into(buffer_, offset, value_)
+        return offset
+
     def receive(self):
         count_receiver = UINT32.receive()
         request = count_receiver.next() #pylint: disable=E1101
@@ -701,6 +793,228 @@ class Consistency(Type):
 CONSISTENCY = Consistency()
 
 
+# Non-generator decoders
+#
+# Running every value through a chain of `receive` coroutines costs several
+# generator switches per value, which dominates the time spent on large
+# results. The decoders below parse the hot return types in a plain loop,
+# using `struct.unpack_from` on offsets of the receive buffer of a reader.
+#
+# A reader provides:
+#
+# - `peek()`, returning a `(view, offset, end)` tuple: a buffer (supporting
+#   the buffer protocol and slicing into objects with a `tobytes` method,
+#   e.g. a `memoryview`) and the bounds of the bytes available in it
+# - `seek(offset)`, marking all bytes before `offset` as read
+# - `fill(count)`, making at least `count` bytes available starting from the
+#   last position passed to `seek`. This can move the data in the buffer, so
+#   `peek` must be called again afterwards
+
+_UINT32_UNPACK_FROM = UINT32.PACKER.unpack_from
+
+class BufferReader(object):
+    '''Reader on a fully received response, see :func:`decode_result`'''
+
+    __slots__ = '_view', '_offset',
+
+    def __init__(self, data):
+        '''Initialize a reader
+
+        :param data: Received data
+        :type data: :class:`str`
+        '''
+
+        self._view = memoryview(data)
+        self._offset = 0
+
+    def peek(self):
+        '''Return the buffer, the current offset and the end of the data'''
+
+        return self._view, self._offset, len(self._view)
+
+    def seek(self, offset):
+        '''Mark all data up to `offset` as read'''
+
+        self._offset = offset
+
+    def fill(self, count):
+        '''Ensure `count` bytes are available'''
+
+        if len(self._view) - self._offset < count:
+            raise ValueError('Expected %d bytes, got %d' % \
+                (count, len(self._view) - self._offset))
+
+    remaining = property(lambda self: len(self._view) - self._offset,
+        doc='Number of bytes which were not read yet')
+
+
+def decode_uint32(reader):
+    '''Decode an unsigned 32 bit integer
+
+    :param reader: Reader providing the data
+    :return: Decoded value
+    :rtype: :class:`int`
+    '''
+
+    view, offset, end = reader.peek()
+    if end - offset < 4:
+        reader.fill(4)
+        view, offset, end = reader.peek()
+
+    reader.seek(offset + 4)
+    return _UINT32_UNPACK_FROM(view, offset)[0]
+
+def decode_string(reader):
+    '''Decode a string
+
+    :param reader: Reader providing the data
+    :return: Decoded value
+    :rtype: :class:`str`
+    '''
+
+    length = decode_uint32(reader)
+
+    view, offset, end = reader.peek()
+    if end - offset < length:
+        reader.fill(length)
+        view, offset, end = reader.peek()
+
+    reader.seek(offset + length)
+    return view[offset:offset + length].tobytes()
+
+def _decode_strings(reader, count, width, reverse):
+    '''Decode `count` items of `width` strings each
+
+    Items of a width larger than 1 are returned as tuples. `reverse` fills the
+    resulting list from the end, as lists are sent in reverse order.
+    '''
+
+    values = [None] * count
+    if reverse:
+        indexes = xrange(count - 1, -1, -1)
+    else:
+        indexes = xrange(count)
+
+    unpack_from = _UINT32_UNPACK_FROM
+    view, offset, end = reader.peek()
+
+    for idx in indexes:
+        item = []
+        for _ in xrange(width):
+            if end - offset < 4:
+                reader.seek(offset)
+                reader.fill(4)
+                view, offset, end = reader.peek()
+
+            length = unpack_from(view, offset)[0]
+
+            if end - offset < 4 + length:
+                reader.seek(offset)
+                reader.fill(4 + length)
+                view, offset, end = reader.peek()
+
+            offset += 4
+            item.append(view[offset:offset + length].tobytes())
+            offset += length
+
+        values[idx] = item[0] if width == 1 else tuple(item)
+
+    reader.seek(offset)
+    return values
+
+def decode_string_list(reader):
+    '''Decode a value of type `List(STRING)`
+
+    :param reader: Reader providing the data
+    :return: Decoded values
+    :rtype: :class:`list` of :class:`str`
+    '''
+
+    return _decode_strings(reader, decode_uint32(reader), 1, True)
+
+def decode_string_pair_list(reader):
+    '''Decode a value of type `List(Product(STRING, STRING))`
+
+    :param reader: Reader providing the data
+    :return: Decoded values
+    :rtype: :class:`list` of :class:`tuple` of (:class:`str`, :class:`str`)
+    '''
+
+    return _decode_strings(reader, decode_uint32(reader), 2, True)
+
+def decode_option_string_array(reader):
+    '''Decode a value of type `Array(Option(STRING))`
+
+    :param reader: Reader providing the data
+    :return: Decoded values, `None` for missing values
+    :rtype: :class:`list` of :class:`str`
+    '''
+
+    count = decode_uint32(reader)
+    values = [None] * count
+
+    for idx in xrange(count):
+        view, offset, end = reader.peek()
+        if end - offset < 1:
+            reader.fill(1)
+            view, offset, end = reader.peek()
+
+        has_value = view[offset]
+        reader.seek(offset + 1)
+
+        if has_value == Bool.TRUE:
+            values[idx] = decode_string(reader)
+        elif has_value != Bool.FALSE:
+            raise ValueError('Unexpected bool value "0x%02x"' % ord(has_value))
+
+    return values
+
+def decode_result(message, reader):
+    '''Read and deserialize the return value of a command without coroutines
+
+    The `DECODER` of the message is used to decode a successful result. When
+    the message has no decoder, the :meth:`Message.receive` coroutine is run
+    instead.
+
+    :param message: Command whose result to read
+    :type message: :class:`Message`
+    :param reader: Reader providing the data
+    :return: Server result
+
+    :raise ArakoonError: Server returned an error code
+    '''
+
+    if message.DECODER is None:
+        def read(count):
+            view, offset, end = reader.peek()
+            if end - offset < count:
+                reader.fill(count)
+                view, offset, end = reader.peek()
+            reader.seek(offset + count)
+            return view[offset:offset + count].tobytes()
+
+        return utils.read_blocking(message.receive(), read)
+
+    code = decode_uint32(reader)
+
+    if code == RESULT_SUCCESS:
+        return message.DECODER(reader)
+
+    raise _build_error(code, decode_string(reader))
+
+def _build_error(code, message):
+    '''Build the exception matching an error code returned by the server'''
+
+    from ovs_extensions.db.arakoon.pyrakoon.pyrakoon import errors
+
+    if code in errors.ERROR_MAP:
+        return errors.ERROR_MAP[code](message)
+    else:
+        return errors.ArakoonError(
+            'Unknown error code 0x%x, server said: %s' % \
+                (code, message))
+
+
 # Protocol message definitions
 
 CONSISTENCY_ARG = ('consistency', CONSISTENCY, None)
@@ -720,6 +1034,8 @@ class Message(object):
     '''Return type of the command''' #pylint: disable=W0105
     DOC = None
     '''Docstring for methods exposing this command''' #pylint: disable=W0105
+    DECODER = None
+    '''Non-generator decoder of a successful result, see :func:`decode_result`''' #pylint: disable=W0105
 
     _tag_bytes = None
     '''Serialized representation of :attr:`TAG`''' #pylint: disable=W0105
@@ -747,6 +1063,43 @@ class Message(object):
             for bytes_ in type_.serialize(getattr(self, name)):
                 yield bytes_
 
+    def encode(self):
+        '''Serialize the command into a single buffer
+
+        :return: Serialized version of the command
+        :rtype: :class:`str` or :class:`bytearray`
+        '''
+
+        return ''.join(self.serialize())
+
+    def _encode_args(self):
+        '''Serialize the command and its arguments into a pre-sized buffer
+
+        Instead of joining the many small strings generated by
+        :meth:`serialize`, the size of the result is calculated first, after
+        which all values are written into a single :class:`bytearray`.
+
+        :return: Serialized version of the command
+        :rtype: :class:`bytearray`
+        '''
+
+        args = []
+        size = 4
+        for arg in self.ARGS:
+            type_ = arg[1]
+            value = getattr(self, arg[0])
+            if isinstance(type_, List):
+                value = tuple(value)
+            args.append((type_, value))
+            size += type_.size(value)
+
+        buffer_ = bytearray(size)
+        offset = UINT32.pack_into(buffer_, 0, self.TAG)
+        for type_, value in args:
+            offset = type_.pack_into(buffer_, offset, value)
+
+        return buffer_
+
     def receive(self):
         '''Read and deserialize the return value of the command
 
@@ -766,8 +1119,6 @@ class Message(object):
         :see: :func:`pyrakoon.utils.process_blocking`
         '''
 
-        from ovs_extensions.db.arakoon.pyrakoon.pyrakoon import errors
-
         code_receiver = UINT32.receive()
         request = code_receiver.next() #pylint: disable=E1101
 
@@ -800,12 +1151,7 @@ class Message(object):
         if code == RESULT_SUCCESS:
             yield Result(result)
         else:
-            if code in errors.ERROR_MAP:
-                raise errors.ERROR_MAP[code](result)
-            else:
-                raise errors.ArakoonError(
-                    'Unknown error code 0x%x, server said: %s' % \
-                        (code, result))
+            raise _build_error(code, result)
 
 
 class Hello(Message):
@@ -905,6 +1251,7 @@ class Get(Message):
     TAG = 0x0008 | Message.MASK
     ARGS = CONSISTENCY_ARG, ('key', STRING),
     RETURN_TYPE = STRING
+    DECODER = staticmethod(decode_string)
 
     DOC = utils.format_doc('''
         Send a "get" command to the server
@@ -959,6 +1306,9 @@ class Set(Message):
     key = property(operator.attrgetter('_key'))
     value = property(operator.attrgetter('_value'))
 
+    def encode(self):
+        return self._encode_args()
+
 
 class Delete(Message):
     '''"delete" message'''
@@ -994,6 +1344,7 @@ class PrefixKeys(Message):
     TAG = 0x000c | Message.MASK
     ARGS = CONSISTENCY_ARG, ('prefix', STRING), ('max_elements', INT32, -1),
     RETURN_TYPE = List(STRING)
+    DECODER = staticmethod(decode_string_list)
 
     DOC = utils.format_doc('''
         Send a "prefix_keys" command to the server
@@ -1118,6 +1469,18 @@ class Sequence(Message):
         for bytes_ in STRING.serialize(sequence_bytes):
             yield bytes_
 
+    def encode(self):
+        # The steps are serialized as a string, of which the length is written first
+        tag = (0x0010 if not self.sync else 0x0024) | Message.MASK
+        sequence_size = self.sequence.size()
+
+        buffer_ = bytearray(8 + sequence_size)
+        offset = UINT32.pack_into(buffer_, 0, tag)
+        offset = UINT32.pack_into(buffer_, offset, sequence_size)
+        self.sequence.pack_into(buffer_, offset)
+
+        return buffer_
+
 
 class Range(Message):
     '''"Range" message'''
@@ -1131,6 +1494,7 @@ class Range(Message):
         ('end_key', Option(STRING)), ('end_inclusive', BOOL), \
         ('max_elements', INT32, -1),
     RETURN_TYPE = List(STRING)
+    DECODER = staticmethod(decode_string_list)
 
     DOC = utils.format_doc('''
         Send a "range" command to the server
@@ -1190,6 +1554,7 @@ class RangeEntries(Message):
         ('end_key', Option(STRING)), ('end_inclusive', BOOL), \
         ('max_elements', INT32, -1),
     RETURN_TYPE = List(Product(STRING, STRING))
+    DECODER = staticmethod(decode_string_pair_list)
 
     DOC = utils.format_doc('''
         Send a "range_entries" command to the server
@@ -1246,6 +1611,7 @@ class MultiGet(Message):
     TAG = 0x0011 | Message.MASK
     ARGS = CONSISTENCY_ARG, ('keys', List(STRING)),
     RETURN_TYPE = List(STRING)
+    DECODER = staticmethod(decode_string_list)
 
     DOC = utils.format_doc('''
         Send a "multi_get" command to the server
@@ -1270,6 +1636,9 @@ class MultiGet(Message):
     consistency = property(operator.attrgetter('_consistency'))
     keys = property(operator.attrgetter('_keys'))
 
+    def encode(self):
+        return self._encode_args()
+
 
 class MultiGetOption(Message):
     '''"multi_get_option" message'''
@@ -1279,6 +1648,7 @@ class MultiGetOption(Message):
     TAG = 0x0031 | Message.MASK
     ARGS = CONSISTENCY_ARG, ('keys', List(STRING)),
     RETURN_TYPE = Array(Option(STRING))
+    DECODER = staticmethod(decode_option_string_array)
 
     DOC = utils.format_doc('''
         Send a "multi_get_option" command to the server
@@ -1485,6 +1855,7 @@ class RevRangeEntries(Message):
         ('end_key', Option(STRING)), ('end_inclusive', BOOL), \
         ('max_elements', INT32, -1),
     RETURN_TYPE = List(Product(STRING, STRING))
+    DECODER = staticmethod(decode_string_pair_list)
 
     DOC = utils.format_doc('''
         Send a "rev_range_entries" command to the server
@@ -22,6 +22,9 @@ from ovs_extensions.db.arakoon.pyrakoon.pyrakoon import protocol, utils
 
 #pylint: disable=R0903
 
+_STRING_OPTION = protocol.Option(protocol.STRING)
+'''Type of optional string arguments, see :meth:`Sequence.pack_into`''' #pylint: disable=W0105
+
 class Step(object):
     '''A step in a sequence operation'''
 
@@ -51,6 +54,35 @@ class Step(object):
             for bytes_ in type_.serialize(getattr(self, name)):
                 yield bytes_
 
+    def size(self):
+        '''Calculate the size of the serialized operation
+
+        :return: Number of bytes of the serialized operation
+        :rtype: :class:`int`
+        '''
+
+        size = 4
+        for name, type_ in self.ARGS:
+            size += type_.size(getattr(self, name))
+        return size
+
+    def pack_into(self, buffer_, offset):
+        '''Serialize the operation into a pre-sized buffer
+
+        :param buffer_: Buffer to write to, see :meth:`size`
+        :type buffer_: :class:`bytearray`
+        :param offset: Position in the buffer to write at
+        :type offset: :class:`int`
+
+        :return: Position in the buffer right after the serialized operation
+        :rtype: :class:`int`
+        '''
+
+        offset = protocol.UINT32.pack_into(buffer_, offset, self.TAG)
+        for name, type_ in self.ARGS:
+            offset = type_.pack_into(buffer_, offset, getattr(self, name))
+        return offset
+
 
 class Set(Step):
     '''"Set" operation'''
@@ -118,7 +150,7 @@ class Assert(Step):
 
     TAG = 8
     ARGS = ('key', protocol.STRING), \
-        ('value', protocol.Option(protocol.STRING)),
+        ('value', _STRING_OPTION),
 
     def __init__(self, key, value):
         super(Assert, self).__init__(key, value)
@@ -163,7 +195,7 @@ class Replace(Step):
 
     TAG = 16
     ARGS = ('key', protocol.STRING), \
-           ('wanted', protocol.Option(protocol.STRING))
+           ('wanted', _STRING_OPTION)
 
     def __init__(self, key, wanted):
         super(Replace, self).__init__(key, wanted)
@@ -216,3 +248,60 @@ class Sequence(Step):
         for step in self.steps:
             for bytes_ in step.serialize():
                 yield bytes_
+
+    # A transaction can contain many thousands of steps, so the (optional)
+    # string arguments of the steps are handled inline instead of calling
+    # the `size` and `pack_into` methods of every step and argument type
+
+    def size(self):
+        size = 8
+        for step in self.steps:
+            if isinstance(step, Sequence):
+                size += step.size()
+                continue
+
+            size += 4
+            for name, type_ in step.ARGS:
+                value = getattr(step, name)
+                if type_ is protocol.STRING:
+                    size += 4 + len(value)
+                elif type_ is _STRING_OPTION:
+                    size += 1 if value is None else 5 + len(value)
+                else:
+                    size += type_.size(value)
+        return size
+
+    def pack_into(self, buffer_, offset):
+        pack_uint32 = protocol.UINT32.PACKER.pack_into
+        view = memoryview(buffer_)
+
+        pack_uint32(buffer_, offset, self.TAG)
+        pack_uint32(buffer_, offset + 4, len(self.steps))
+        offset += 8
+
+        for step in self.steps:
+            if isinstance(step, Sequence):
+                offset = step.pack_into(buffer_, offset)
+                continue
+
+            pack_uint32(buffer_, offset, step.TAG)
+            offset += 4
+            for name, type_ in step.ARGS:
+                value = getattr(step, name)
+                if type_ is _STRING_OPTION:
+                    if value is None:
+                        view[offset] = protocol.Bool.FALSE
+                        offset += 1
+                        continue
+                    view[offset] = protocol.Bool.TRUE
+                    offset += 1
+                elif type_ is not protocol.STRING:
+                    offset = type_.pack_into(buffer_, offset, value)
+                    continue
+
+                length = len(value)
+                pack_uint32(buffer_, offset, length)
+                offset += 4
+                view[offset:offset + length] = value
+                offset += length
+        return offset
@@ -0,0 +1,184 @@
+# Copyright (C) 2019 iNuron NV
+#
+# This file is part of Open vStorage Open Source Edition (OSE),
+# as available from
+#
+#      http://www.openvstorage.org and
+#      http://www.openvstorage.com.
+#
+# This file is free software; you can redistribute it and/or modify it
+# under the terms of the GNU Affero General Public License v3 (GNU AGPLv3)
+# as published by the Free Software Foundation, in version 3 as it comes
+# in the LICENSE.txt file of the Open vStorage OSE distribution.
+#
+# Open vStorage is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY of any kind.
+
+
+"""
+Benchmarks for the pyrakoon client
+Usage: python -m ovs_extensions.db.arakoon.tests.benchmark_pyrakoon
+"""
+
+import time
+import hashlib
+import select
+import socket
+import threading
+from ovs_extensions.db.arakoon.pyrakoon.pyrakoon import protocol, sequence, utils
+from ovs_extensions.db.arakoon.pyrakoon.client import PyrakoonClient, PyrakoonClientPooled
+from ovs_extensions.db.arakoon.pyrakoon.pyrakoon.compat import _ClientConnection
+from ovs_extensions.db.arakoon.tests.server_mock import ArakoonServerMock
+
+
+def _report(title, results):
+    """ Prints the results of a benchmark. The first result is used as reference """
+    print title
+    reference = results[0][1]
+    for label, duration in results:
+        print '    {0:<30} {1:>9.4f}s {2:>7.2f}x'.format(label, duration, reference / duration if duration else 0)
+
+
+class _UnbufferedConnection(_ClientConnection):
+    """
+    Connection reading like the connections used to: a select and a receive call for every read
+    """
+    def read(self, count):
+        bytes_remaining = count
+        result = []
+        while bytes_remaining > 0:
+            reads, _, _ = select.select([self._socket], [], [], self._timeout)
+            if self._socket not in reads:
+                raise RuntimeError('Socket not readable')
+            data = self._socket.recv(bytes_remaining)
+            if len(data) == 0:
+                raise RuntimeError('Socket closed')
+            result.append(data)
+            bytes_remaining -= len(data)
+        return ''.join(result)
+
+
+def _get_range_entries_response(amount):
+    """ Builds the response of a RangeEntries message returning the given amount of entries """
+    entries = [('/ovs/framework/hosts/{0:08d}/config'.format(index), '{"ip": "10.100.1.%d", "port": 8870, "storagerouter_id": %d}' % (index % 255, index))
+               for index in xrange(amount)]
+    # Lists are sent in reversed order
+    return ''.join(protocol.UINT32.serialize(protocol.RESULT_SUCCESS)) + ''.join(protocol.RangeEntries.RETURN_TYPE.serialize(list(reversed(entries)))), entries
+
+
+def _decode(connection_class, data, message, decoder):
+    """
+    Decodes the given response, received through a socket
+    :return: The decoded response and the duration
+    """
+    reader, writer = socket.socketpair()
+    connection = connection_class(('localhost', 0), 'benchmark', False, None, None, timeout=5)
+    connection._socket = reader
+    connection._connected = True
+    sender = threading.Thread(target=writer.sendall, args=(data,))
+    sender.start()
+    try:
+        start = time.time()
+        result = decoder(connection, message)
+        return result, time.time() - start
+    finally:
+        reader.close()  # Unblocks the sender when decoding failed
+        sender.join()
+        writer.close()
+
+
+def benchmark_range_entries(amount=10000, rounds=5):
+    """
+    Decodes a RangeEntries response with the given amount of entries, comparing unbuffered with buffered reads and
+    the coroutine based decoding with the fast decoder
+    :param amount: Amount of entries in the response
+    :param rounds: Amount of times the response is decoded (the best duration is reported)
+    """
+    data, entries = _get_range_entries_response(amount)
+    message = protocol.RangeEntries(None, None, True, None, True, -1)
+    decoders = [('unbuffered reads', _UnbufferedConnection, lambda connection, msg: utils.read_blocking(msg.receive(), connection.read)),
+                ('buffered reads', _ClientConnection, lambda connection, msg: utils.read_blocking(msg.receive(), connection.read)),
+                ('buffered reads, fast decoder', _ClientConnection, lambda connection, msg: protocol.decode_result(msg, connection))]
+    results = []
+    for label, connection_class, decoder in decoders:
+        durations = []
+        for _ in xrange(rounds):
+            result, duration = _decode(connection_class, data, message, decoder)
+            if result != entries:
+                raise RuntimeError('Decoding with {0} failed'.format(label))
+            durations.append(duration)
+        results.append((label, min(durations)))
+    _report('Decoding a RangeEntries response of {0} entries ({1} bytes)'.format(amount, len(data)), results)
+
+
+def benchmark_sequence(amount=10000, rounds=5):
+    """
+    Builds and serializes a transaction of the given amount of steps, comparing joining the serialized parts with
+    serializing into a pre-sized buffer
+    :param amount: Amount of steps in the transaction
+    :param rounds: Amount of times the transaction is built and serialized (the best duration is reported)
+    """
+    serializers = [('joined parts', lambda msg: ''.join(msg.serialize())),
+                   ('pre-sized buffer', lambda msg: msg.encode())]
+    results = []
+    reference = None
+    build_durations = []
+    for label, serializer in serializers:
+        durations = []
+        for _ in xrange(rounds):
+            start = time.time()
+            steps = []
+            for index in xrange(amount):
+                key = '/ovs/framework/hosts/{0:08d}/config'.format(index)
+                if index % 2 == 0:
+                    steps.append(sequence.Assert(key, None))
+                else:
+                    steps.append(sequence.Set(key, '{"ip": "10.100.1.%d", "port": 8870}' % (index % 255)))
+            message = protocol.Sequence(steps, False)
+            build_durations.append(time.time() - start)
+            start = time.time()
+            data = serializer(message)
+            durations.append(time.time() - start)
+            data = str(data)
+            if reference is None:
+                reference = data
+            elif data != reference:
+                raise RuntimeError('Serializing with {0} failed'.format(label))
+        results.append((label, min(durations)))
+    _report('Serializing a transaction of {0} steps ({1} bytes, built in {2:.4f}s)'.format(amount, len(reference), min(build_durations)), results)
+
+
+def benchmark_prefix_scan(amount=20000, latency=0.005):
+    """
+    Lists all entries under a prefix of a mocked Arakoon server, comparing batches of a fixed size with adaptive batch
+    sizes, read-ahead and scanning sub-ranges concurrently. The sub-ranges are only scanned concurrently when gevent
+    monkey patched the standard library
+    :param amount: Amount of entries under the prefix
+    :param latency: Latency of the responses of the server
+    """
+    server = ArakoonServerMock(latency=latency)
+    try:
+        for index in xrange(amount):
+            server.values['/ovs/framework/hosts/{0}/config'.format(hashlib.md5(str(index)).hexdigest())] = '{"ip": "10.100.1.%d", "port": 8870}' % (index % 255)
+        expected = sorted(server.values.iteritems())
+        fixed_client = PyrakoonClient(server.cluster_id, server.get_nodes(), read_ahead=False)
+        fixed_client.BATCH_SIZE_MIN = fixed_client.BATCH_SIZE_MAX = 500
+        pooled_client = PyrakoonClientPooled(server.cluster_id, server.get_nodes(), pool_size=4)
+        scanners = [('fixed batches of 500', lambda: fixed_client.prefix_entries('/ovs/')),
+                    ('adaptive with read-ahead', lambda: PyrakoonClient(server.cluster_id, server.get_nodes(), pipelined=True, read_ahead=True).prefix_entries('/ovs/')),
+                    ('split over 4 pool clients', lambda: pooled_client.prefix_entries('/ovs/', parts=4))]
+        results = []
+        for label, scanner in scanners:
+            start = time.time()
+            if list(scanner()) != expected:
+                raise RuntimeError('Scanning with {0} failed'.format(label))
+            results.append((label, time.time() - start))
+        _report('Listing {0} entries with a latency of {1}s'.format(amount, latency), results)
+    finally:
+        server.stop()
+
+
+if __name__ == '__main__':
+    benchmark_range_entries()
+    benchmark_sequence()
+    benchmark_prefix_scan()
@@ -0,0 +1,396 @@
+# Copyright (C) 2019 iNuron NV
+#
+# This file is part of Open vStorage Open Source Edition (OSE),
+# as available from
+#
+#      http://www.openvstorage.org and
+#      http://www.openvstorage.com.
+#
+# This file is free software; you can redistribute it and/or modify it
+# under the terms of the GNU Affero General Public License v3 (GNU AGPLv3)
+# as published by the Free Software Foundation, in version 3 as it comes
+# in the LICENSE.txt file of the Open vStorage OSE distribution.
+#
+# Open vStorage is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY of any kind.
+
+
+"""
+Arakoon server mock module
+"""
+
+import time
+import socket
+import struct
+import threading
+from Queue import Queue
+from StringIO import StringIO
+from ovs_extensions.db.arakoon.pyrakoon.pyrakoon import consistency, errors, protocol, sequence, utils
+from ovs_extensions.db.arakoon.pyrakoon.pyrakoon.compat import ArakoonClientConfig
+
+# noinspection PyUnreachableCode
+if False:
+    from typing import Optional
+
+
+class ArakoonServerMock(object):
+    """
+    Minimal, in-memory Arakoon server speaking the client protocol over TCP on localhost.
+    It acts as the master of a single node cluster and supports the commands used by the Arakoon clients of this package.
+    Given the identifier of another node as master, it acts as a follower: updates and consistent reads fail with NotMaster,
+    AtLeast reads fail with InconsistentRead as long as the follower did not catch up (see `catch_up`).
+    A latency can be configured: every response is sent `latency` seconds after its request was received, without
+    delaying the processing of the next requests, like a network round trip would.
+    """
+    NODE_ID = 'arakoon_0'
+    SEQUENCE_TAGS = [0x0010 | protocol.Message.MASK, 0x0024 | protocol.Message.MASK]
+
+    def __init__(self, cluster_id='mock', latency=0, node_id=NODE_ID, master_id=None):
+        # type: (str, float, str, Optional[str]) -> None
+        """
+        Starts the server
+        :param cluster_id: Identifier of the cluster
+        :type cluster_id: str
+        :param latency: Amount of seconds to delay every response with
+        :type latency: float
+        :param node_id: Identifier of the node
+        :type node_id: str
+        :param master_id: Identifier of the master node. Defaults to this node
+        :type master_id: str
+        """
+        self.cluster_id = cluster_id
+        self.latency = latency
+        self.node_id = node_id
+        self.master_id = node_id if master_id is None else master_id
+        self.values = {}
+        self.requests = []  # Names of the processed messages
+        self._txid = 0
+        self._lock = threading.Lock()
+        self._running = True
+        self._connections = []
+        self._messages = dict((message.TAG, message) for message in vars(protocol).itervalues()
+                              if isinstance(message, type) and issubclass(message, protocol.Message) and message.TAG is not None)
+        self._steps = dict((step.TAG, step) for step in vars(sequence).itervalues()
+                           if isinstance(step, type) and issubclass(step, sequence.Step) and step.TAG is not None)
+        self._socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self._socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self._socket.bind(('127.0.0.1', 0))
+        self._socket.listen(64)
+        self.port = self._socket.getsockname()[1]
+        self._start_thread(self._accept)
+
+    def get_config(self):
+        # type: () -> ArakoonClientConfig
+        """
+        Builds the configuration to connect to this server
+        :return: The client configuration
+        :rtype: ArakoonClientConfig
+        """
+        return ArakoonClientConfig(self.cluster_id, self.get_nodes())
+
+    def get_nodes(self):
+        # type: () -> dict
+        """
+        Builds the node information as expected by the PyrakoonClient
+        :return: The nodes of the cluster
+        :rtype: dict
+        """
+        return {self.node_id: (['127.0.0.1'], self.port)}
+
+    def catch_up(self, master):
+        # type: (ArakoonServerMock) -> None
+        """
+        Copies the state of the master, like a follower catching up
+        :param master: The master to copy the state from
+        :type master: ArakoonServerMock
+        :return: None
+        :rtype: NoneType
+        """
+        with master._lock:
+            values, txid = dict(master.values), master._txid
+        with self._lock:
+            self.values, self._txid = values, txid
+
+    def stop(self):
+        # type: () -> None
+        """
+        Stops the server, closing all connections
+        :return: None
+        :rtype: NoneType
+        """
+        self._running = False
+        for sock in [self._socket] + self._connections:
+            try:
+                sock.shutdown(socket.SHUT_RDWR)
+            except socket.error:
+                pass
+            sock.close()
+
+    def drop_connections(self):
+        # type: () -> None
+        """
+        Closes all client connections, like a restarting node would
+        :return: None
+        :rtype: NoneType
+        """
+        for sock in self._connections:
+            try:
+                sock.shutdown(socket.SHUT_RDWR)
+            except socket.error:
+                pass
+        self._connections = []
+
+    @staticmethod
+    def _start_thread(target, *args):
+        thread = threading.Thread(target=target, args=args)
+        thread.daemon = True
+        thread.start()
+        return thread
+
+    def _accept(self):
+        """ Accepts client connections """
+        while self._running:
+            try:
+                connection, _ = self._socket.accept()
+            except socket.error:
+                return
+            connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            self._connections.append(connection)
+            responses = Queue()
+            self._start_thread(self._serve, connection, responses)
+            self._start_thread(self._respond, connection, responses)
+
+    def _serve(self, connection, responses):
+        """ Reads and processes the requests of a single connection """
+        stream = connection.makefile('rb')
+
+        def read(count):
+            data = stream.read(count)
+            if len(data) != count:
+                raise EOFError()
+            return data
+
+        try:
+            recv = lambda type_: utils.read_blocking(type_.receive(), read)
+            recv(protocol.UINT32)  # Magic
+            recv(protocol.UINT32)  # Version
+            recv(protocol.STRING)  # Cluster identifier
+            while True:
+                tag = recv(protocol.UINT32)
+                received = time.time()
+                response = self._handle(tag, recv)
+                responses.put((received + self.latency, response))
+        except (EOFError, socket.error, ValueError):
+            pass
+        finally:
+            responses.put(None)
+
+    @staticmethod
+    def _respond(connection, responses):
+        """ Sends the responses of a single connection, in order """
+        while True:
+            entry = responses.get()
+            if entry is None:
+                break
+            deadline, response = entry
+            delay = deadline - time.time()
+            if delay > 0:
+                time.sleep(delay)
+            try:
+                connection.sendall(response)
+            except socket.error:
+                break
+        connection.close()
+
+    def _handle(self, tag, recv):
+        """ Parses the arguments of a message and returns the serialized response """
+        if tag in self.SEQUENCE_TAGS:
+            name, arguments = 'Sequence', {'steps': self._parse_steps(StringIO(recv(protocol.STRING)).read)}
+        else:
+            message = self._messages[tag]
+            name, arguments = message.__name__, {}
+            for argument in message.ARGS:
+                value = recv(argument[1])
+                if isinstance(argument[1], protocol.List):  # Lists are received in reversed order
+                    value = list(reversed(value))
+                arguments[argument[0]] = value
+        with self._lock:
+            self.requests.append(name)
+            try:
+                result, return_type = getattr(self, '_handle_{0}'.format(name.lower()))(**arguments)
+            except errors.ArakoonError as ex:
+                return struct.pack('<I', ex.CODE) + ''.join(protocol.STRING.serialize(str(ex.args[0]) if ex.args else ''))
+        data = [struct.pack('<I', protocol.RESULT_SUCCESS)]
+        if isinstance(return_type, protocol.List):  # Lists are sent in reversed order
+            data.extend(return_type.serialize(list(reversed(result))))
+        elif isinstance(return_type, protocol.Array):
+            data.extend(protocol.UINT32.serialize(len(result)))
+            for entry in result:
+                data.extend(return_type._inner_type.serialize(entry))
+        elif return_type is not protocol.UNIT:
+            data.extend(return_type.serialize(result))
+        return ''.join(data)
+
+    def _parse_steps(self, read):
+        """ Parses the steps of a sequence """
+        recv = lambda type_: utils.read_blocking(type_.receive(), read)
+        tag = recv(protocol.UINT32)
+        if tag == sequence.Sequence.TAG:
+            return [step for _ in xrange(recv(protocol.UINT32)) for step in self._parse_steps(read)]
+        step = self._steps[tag]
+        return [(step.__name__, [recv(argument[1]) for argument in step.ARGS])]
+
+    def _get_keys(self, begin_key, begin_inclusive, end_key, end_inclusive, max_elements, reverse=False):
+        """ Lists the keys within the given range """
+        keys = []
+        for key in sorted(self.values, reverse=reverse):
+            lower, lower_inclusive, upper, upper_inclusive = (end_key, end_inclusive, begin_key, begin_inclusive) if reverse else (begin_key, begin_inclusive, end_key, end_inclusive)
+            if lower is not None and (key < lower or (key == lower and not lower_inclusive)):
+                continue
+            if upper is not None and (key > upper or (key == upper and not upper_inclusive)):
+                continue
+            keys.append(key)
+        return keys if max_elements < 0 else keys[:max_elements]
+
+    def _get(self, key):
+        if key not in self.values:
+            raise errors.NotFound(key)
+        return self.values[key]
+
+    def _check_master(self):
+        if self.master_id != self.node_id:
+            raise errors.NotMaster(self.master_id)
+
+    def _check_consistency(self, consistency_):
+        if consistency_ is consistency.CONSISTENT:
+            self._check_master()
+        elif isinstance(consistency_, consistency.AtLeast) and consistency_.i > self._txid:
+            raise errors.InconsistentRead('{0} > {1}'.format(consistency_.i, self._txid))
+
+    def _update(self, key, value):
+        self._check_master()
+        self._txid += 1
+        if value is None:
+            self.values.pop(key, None)
+        else:
+            self.values[key] = value
+
+    def _handle_hello(self, client_id, cluster_id):
+        _ = client_id, cluster_id
+        return 'ArakoonServerMock', protocol.STRING
+
+    def _handle_whomaster(self):
+        return self.master_id, protocol.Option(protocol.STRING)
+
+    def _handle_nop(self):
+        self._check_master()
+        self._txid += 1
+        return None, protocol.UNIT
+
+    def _handle_gettxid(self):
+        return consistency.AtLeast(self._txid), protocol.CONSISTENCY
+
+    def _handle_exists(self, consistency, key):
+        self._check_consistency(consistency)
+        return key in self.values, protocol.BOOL
+
+    def _handle_get(self, consistency, key):
+        self._check_consistency(consistency)
+        return self._get(key), protocol.STRING
+
+    def _handle_multiget(self, consistency, keys):
+        self._check_consistency(consistency)
+        return [self._get(key) for key in keys], protocol.List(protocol.STRING)
+
+    def _handle_multigetoption(self, consistency, keys):
+        self._check_consistency(consistency)
+        return [self.values.get(key) for key in keys], protocol.Array(protocol.Option(protocol.STRING))
+
+    def _handle_set(self, key, value):
+        self._update(key, value)
+        return None, protocol.UNIT
+
+    def _handle_delete(self, key):
+        self._get(key)
+        self._update(key, None)
+        return None, protocol.UNIT
+
+    def _handle_range(self, consistency, begin_key, begin_inclusive, end_key, end_inclusive, max_elements):
+        self._check_consistency(consistency)
+        return self._get_keys(begin_key, begin_inclusive, end_key, end_inclusive, max_elements), protocol.List(protocol.STRING)
+
+    def _handle_rangeentries(self, consistency, begin_key, begin_inclusive, end_key, end_inclusive, max_elements):
+        self._check_consistency(consistency)
+        keys = self._get_keys(begin_key, begin_inclusive, end_key, end_inclusive, max_elements)
+        return [(key, self.values[key]) for key in keys], protocol.List(protocol.Product(protocol.STRING, protocol.STRING))
+
+    def _handle_revrangeentries(self, consistency, begin_key, begin_inclusive, end_key, end_inclusive, max_elements):
+        self._check_consistency(consistency)
+        keys = self._get_keys(begin_key, begin_inclusive, end_key, end_inclusive, max_elements, reverse=True)
+        return [(key, self.values[key]) for key in keys], protocol.List(protocol.Product(protocol.STRING, protocol.STRING))
+
+    def _handle_prefixkeys(self, consistency, prefix, max_elements):
+        self._check_consistency(consistency)
+        keys = [key for key in sorted(self.values) if key.startswith(prefix)]
+        return keys if max_elements < 0 else keys[:max_elements], protocol.List(protocol.STRING)
+
+    def _handle_getkeycount(self):
+        return len(self.values), protocol.UINT64
+
+    def _handle_testandset(self, key, test_value, set_value):
+        original = self.values.get(key)
+        if original == test_value:
+            self._update(key, set_value)
+        return original, protocol.Option(protocol.STRING)
+
+    def _handle_replace(self, key, value):
+        original = self.values.get(key)
+        self._update(key, value)
+        return original, protocol.Option(protocol.STRING)
+
+    def _handle_deleteprefix(self, prefix):
+        self._check_master()
+        keys = [key for key in self.values if key.startswith(prefix)]
+        for key in keys:
+            self._update(key, None)
+        return len(keys), protocol.UINT32
+
+    def _handle_assert(self, consistency, key, value):
+        self._check_consistency(consistency)
+        if self.values.get(key) != value:
+            raise errors.AssertionFailed(key)
+        return None, protocol.UNIT
+
+    def _handle_assertexists(self, consistency, key):
+        self._check_consistency(consistency)
+        if key not in self.values:
+            raise errors.AssertionFailed(key)
+        return None, protocol.UNIT
+
+    def _handle_sequence(self, steps):
+        self._check_master()
+        values = dict(self.values)
+        for name, arguments in steps:  # Validated and applied on a copy, so a failing sequence has no effect
+            if name == 'Set':
+                values[arguments[0]] = arguments[1]
+            elif name == 'Delete':
+                if arguments[0] not in values:
+                    raise errors.NotFound(arguments[0])
+                values.pop(arguments[0])
+            elif name == 'DeletePrefix':
+                for key in [key for key in values if key.startswith(arguments[0])]:
+                    values.pop(key)
+            elif name == 'Assert':
+                if values.get(arguments[0]) != arguments[1]:
+                    raise errors.AssertionFailed(arguments[0])
+            elif name == 'AssertExists':
+                if arguments[0] not in values:
+                    raise errors.AssertionFailed(arguments[0])
+            elif name == 'Replace':
+                if arguments[1] is None:
+                    values.pop(arguments[0], None)
+                else:
+                    values[arguments[0]] = arguments[1]
+        self.values = values
+        self._txid += 1
+        return None, protocol.UNIT
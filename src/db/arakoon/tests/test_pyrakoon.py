@@ -18,8 +18,21 @@
 Test the Pyrakoon wrapper
 """
 
+import time
+import socket
+import threading
 import unittest
-from ovs_extensions.db.arakoon.pyrakoon.client import MockPyrakoonClient
+from cStringIO import StringIO
+from ovs_extensions.db.arakoon.pyrakoon.client import MockPyrakoonClient, PyrakoonClient, PyrakoonClientPooled, ReadPolicy, \
+    READ_FROM_LEAST_LOADED, READ_FROM_NEAREST, ArakoonSockNotReadable, ArakoonSockReadNoBytes, NoLockAvailableException, PyrakoonLock, ReadCache, TransactionTooLargeException
+from ovs_extensions.db.arakoon.pyrakoon.client.client_pool import PyrakoonPool
+from ovs_extensions.db.arakoon.pyrakoon.pyrakoon import consistency, errors, protocol, sequence, utils
+from ovs_extensions.db.arakoon.pyrakoon.pyrakoon.compat import ArakoonClient, ArakoonNotFound, _ClientConnection
+from ovs_extensions.db.arakoon.tests.server_mock import ArakoonServerMock
+try:
+    import gevent
+except ImportError:
+    gevent = None
 
 
 class TestPyrakoon(unittest.TestCase):
@@ -69,3 +82,564 @@ class TestPyrakoon(unittest.TestCase):
         self.assertEqual(self._next_key(empty_prefix), '\xff')
         with self.assertRaises(ValueError):
             MockPyrakoonClient._next_prefix(empty_prefix)
+
+    def test_presized_serialization(self):
+        """
+        Validates that serializing into a pre-sized buffer matches the generic serialization
+        """
+        steps = [sequence.Set('key', 'value'),
+                 sequence.Set('', 'x' * 1000),
+                 sequence.Delete('key'),
+                 sequence.DeletePrefix('prefix'),
+                 sequence.Assert('key', None),
+                 sequence.Assert('key', 'value'),
+                 sequence.AssertExists('key'),
+                 sequence.Replace('key', None),
+                 sequence.Replace('key', 'value'),
+                 sequence.Sequence([sequence.Set('nested', 'value'), sequence.Sequence([])])]
+        messages = [protocol.Set('key', 'value'),
+                    protocol.Set('', ''),
+                    protocol.MultiGet(None, ['key', '', 'other']),
+                    protocol.MultiGet(consistency.INCONSISTENT, []),
+                    protocol.MultiGet(consistency.AtLeast(5), ['key']),
+                    protocol.Sequence(steps, False),
+                    protocol.Sequence(steps, True),
+                    protocol.Sequence([sequence.Sequence(steps)], False),
+                    protocol.Get(None, 'key')]  # Generic implementation
+        for message in messages:
+            self.assertEqual(str(message.encode()), ''.join(message.serialize()))
+        self.assertEqual(str(protocol.MultiGet(None, (key for key in ['a', 'b'])).encode()), ''.join(protocol.MultiGet(None, ['a', 'b']).serialize()))
+
+    def test_split_prefix(self):
+        """
+        Validates that splitting a prefix results in consecutive sub-ranges covering all keys with the prefix
+        """
+        for parts in [1, 2, 7, 200]:
+            ranges = MockPyrakoonClient._split_prefix('/ovs/', parts)
+            self.assertEqual(len(ranges), min(parts, 0x7f - 0x20))
+            self.assertEqual(ranges[0][0], '/ovs/')
+            self.assertEqual(ranges[-1][1], '/ovs0')
+            for index in xrange(1, len(ranges)):
+                self.assertEqual(ranges[index - 1][1], ranges[index][0])
+                self.assertLess(ranges[index][0], ranges[index][1])
+        # Split where the first and last key differ
+        ranges = MockPyrakoonClient._split_prefix('/ovs/', 4, '/ovs/hosts/0a', '/ovs/hosts/f1')
+        self.assertEqual(ranges, [('/ovs/', '/ovs/hosts/='), ('/ovs/hosts/=', '/ovs/hosts/K'), ('/ovs/hosts/K', '/ovs/hosts/Y'), ('/ovs/hosts/Y', '/ovs0')])
+        self.assertEqual(MockPyrakoonClient._split_prefix('/ovs/', 4, '/ovs/a', '/ovs/a'), [('/ovs/', '/ovs0')])
+        self.assertEqual(len(MockPyrakoonClient._split_prefix('/ovs/', 4, '/ovs/a', '/ovs/a0')), 4)
+
+
+class TestPyrakoonClient(unittest.TestCase):
+    """
+    Tests the Arakoon clients against a mocked Arakoon server
+    """
+
+    def setUp(self):
+        """ Starts the mocked server """
+        self.server = ArakoonServerMock(latency=0.05)
+        for index in xrange(10):
+            self.server.values['key_{0}'.format(index)] = 'value_{0}'.format(index)
+
+    def tearDown(self):
+        """ Stops the mocked server """
+        self.server.stop()
+
+    @staticmethod
+    def _run_threads(function, amount):
+        """ Executes the function in the given amount of threads and returns the results and the duration """
+        results = [None] * amount
+
+        def _run(index):
+            try:
+                results[index] = function(index)
+            except Exception as ex:
+                results[index] = ex
+
+        threads = [threading.Thread(target=_run, args=(index,)) for index in xrange(amount)]
+        start = time.time()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return results, time.time() - start
+
+    def test_pipelining(self):
+        """ Validates that concurrent requests are in flight at the same time and get their own response """
+        client = ArakoonClient(self.server.get_config(), timeout=5, pipelined=True)
+        client.nop()  # Connects
+        expected = ['value_{0}'.format(index) if index % 2 == 0 else KeyError for index in xrange(10)]
+
+        def _get(index):
+            if index % 2 == 0:
+                return client.get('key_{0}'.format(index))
+            try:
+                return client.get('unknown_{0}'.format(index))
+            except ArakoonNotFound:  # Error responses do not disturb the order of the other responses
+                return KeyError
+
+        results, duration = self._run_threads(_get, 10)
+        self.assertEqual(results, expected)
+        self.assertLess(duration, 5 * self.server.latency)  # Serialized round trips would take 10 * latency
+
+        serialized_client = ArakoonClient(self.server.get_config(), timeout=5)
+        serialized_client.nop()
+        results, duration = self._run_threads(_get, 10)
+        self.assertEqual(results, expected)
+        results, duration = self._run_threads(lambda index: serialized_client.get('key_{0}'.format(index)), 10)
+        self.assertGreaterEqual(duration, 10 * self.server.latency)
+
+        pyrakoon_client = PyrakoonClient(self.server.cluster_id, self.server.get_nodes(), pipelined=True)
+        results, duration = self._run_threads(lambda index: list(pyrakoon_client.get_multi(['key_{0}'.format(index)])), 10)
+        self.assertEqual(results, [['value_{0}'.format(index)] for index in xrange(10)])
+        self.assertLess(duration, 5 * self.server.latency)
+
+    def test_pipelining_connection_loss(self):
+        """ Validates that requests in flight are retried when the connection is lost """
+        client = ArakoonClient(self.server.get_config(), timeout=5, noMasterTimeout=5, pipelined=True)
+        client.nop()
+        self.server.latency = 0.2
+
+        def _get(index):
+            if index == 0:
+                time.sleep(0.1)
+                self.server.drop_connections()
+                return 'dropped'
+            return client.get('key_{0}'.format(index))
+
+        results, _ = self._run_threads(_get, 10)
+        self.assertEqual(results, ['dropped'] + ['value_{0}'.format(index) for index in xrange(1, 10)])
+
+    def test_buffered_reads(self):
+        """ Validates the buffered reads of a connection when the socket only returns part of the data per receive call """
+        class _Socket(object):
+            def __init__(self, chunks):
+                self.chunks = list(chunks)
+                self.calls = 0
+
+            def recv_into(self, view):
+                self.calls += 1
+                if not self.chunks:
+                    return 0
+                chunk = self.chunks.pop(0)
+                if isinstance(chunk, Exception):
+                    raise chunk
+                view[0:len(chunk)] = chunk
+                return len(chunk)
+
+            def close(self):
+                pass
+
+        original_size = _ClientConnection.BUFFER_SIZE
+        _ClientConnection.BUFFER_SIZE = 8
+        try:
+            connection = _ClientConnection(('127.0.0.1', 0), 'cluster', False, None, None, timeout=5)
+            connection._connected = True
+            connection._socket = _Socket(['ab', 'cdefg', 'h', 'ijklmnopqrstuvwxyz', '0123'])
+            self.assertEqual(connection.read(1), 'a')
+            self.assertEqual(connection.read(4), 'bcde')  # Spans two partial receives
+            self.assertEqual(connection._socket.calls, 2)
+            self.assertEqual(connection.read(3), 'fgh')  # Fills the remainder of the buffer
+            self.assertEqual(len(connection._buffer), 8)
+            self.assertEqual(connection.read_view(18).tobytes(), 'ijklmnopqrstuvwxyz')  # The buffer grows for large reads
+            self.assertEqual(len(connection._buffer), 18)
+            self.assertEqual(connection.read(2), '01')  # And shrinks again afterwards
+            self.assertEqual(len(connection._buffer), 8)
+            self.assertEqual(connection.read(2), '23')
+            self.assertEqual(connection._socket.calls, 5)
+            with self.assertRaises(ArakoonSockReadNoBytes):
+                connection.read(1)
+            self.assertFalse(connection._connected)
+
+            connection._connected = True
+            connection._socket = _Socket(['ab', socket.timeout()])
+            with self.assertRaises(ArakoonSockNotReadable):
+                connection.read(3)
+            self.assertFalse(connection._connected)
+        finally:
+            _ClientConnection.BUFFER_SIZE = original_size
+
+    def test_fast_decoders(self):
+        """ Validates that the non-generator decoders return the same results as the coroutines """
+        values = ['', 'a', 'value', 'x' * 300]
+        success = ''.join(protocol.UINT32.serialize(protocol.RESULT_SUCCESS))
+        responses = [(protocol.Get(None, 'key'), ''.join(protocol.STRING.serialize('value'))),
+                     (protocol.MultiGet(None, ['key']), ''.join(protocol.List(protocol.STRING).serialize(values))),
+                     (protocol.Range(None, None, True, None, True, -1), ''.join(protocol.List(protocol.STRING).serialize([]))),
+                     (protocol.PrefixKeys(None, '', -1), ''.join(protocol.List(protocol.STRING).serialize(values))),
+                     (protocol.RangeEntries(None, None, True, None, True, -1), ''.join(protocol.List(protocol.Product(protocol.STRING, protocol.STRING)).serialize(zip(values, reversed(values))))),
+                     (protocol.MultiGetOption(None, ['key']), ''.join(protocol.UINT32.serialize(3)) + ''.join(protocol.Option(protocol.STRING).serialize('value')) + ''.join(protocol.Option(protocol.STRING).serialize(None)) + ''.join(protocol.Option(protocol.STRING).serialize('')))]
+        for message, payload in responses:
+            self.assertIsNotNone(message.DECODER)
+            data = success + payload
+            reader = protocol.BufferReader(data)
+            self.assertEqual(protocol.decode_result(message, reader), utils.read_blocking(message.receive(), StringIO(data).read))
+            self.assertEqual(reader.remaining, 0)
+            with self.assertRaises(ValueError):  # Truncated response
+                protocol.decode_result(message, protocol.BufferReader(data[:-1]))
+        error = ''.join(protocol.UINT32.serialize(0x05)) + ''.join(protocol.STRING.serialize('key'))
+        with self.assertRaises(errors.NotFound):
+            protocol.decode_result(protocol.Get(None, 'key'), protocol.BufferReader(error))
+
+    def test_fast_decoders_buffer_refills(self):
+        """ Validates the decoders when the responses do not fit the receive buffer """
+        self.server.latency = 0
+        for index in xrange(10):
+            self.server.values['big_{0}'.format(index)] = 'v' * (index * 10)
+        original_size = _ClientConnection.BUFFER_SIZE
+        _ClientConnection.BUFFER_SIZE = 7
+        try:
+            client = ArakoonClient(self.server.get_config(), timeout=5)
+            keys = sorted(self.server.values)
+            self.assertEqual(client.get('big_9'), 'v' * 90)
+            self.assertEqual(client.multiGet(keys), [self.server.values[key] for key in keys])
+            self.assertEqual(client.multiGetOption(['big_5', 'unknown', 'big_0']), ['v' * 50, None, ''])
+            self.assertEqual(client.range('big_', True, 'big_9', False), ['big_{0}'.format(index) for index in xrange(9)])
+            self.assertEqual(client.range_entries('big_', True, 'big_9', True), [('big_{0}'.format(index), 'v' * (index * 10)) for index in xrange(10)])
+            self.assertEqual(client.rev_range_entries(None, True, 'key_', True, 2), [('key_9', 'value_9'), ('key_8', 'value_8')])
+            self.assertEqual(client.prefix('key_'), ['key_{0}'.format(index) for index in xrange(10)])
+            with self.assertRaises(ArakoonNotFound):
+                client.get('unknown')
+            self.assertEqual(client.get('key_1'), 'value_1')  # Still in sync after the error
+        finally:
+            _ClientConnection.BUFFER_SIZE = original_size
+
+    def test_prefix_scan(self):
+        """ Validates the prefix scans with adaptive batch sizes and read-ahead """
+        self.server.latency = 0
+        for index in xrange(3000):
+            self.server.values['scan/{0:05d}'.format(index)] = 'v' * 200
+        self.server.values['scan0'] = 'not part of the prefix'
+        expected = sorted((key, value) for key, value in self.server.values.iteritems() if key.startswith('scan/'))
+        for pipelined, read_ahead in [(True, True), (False, False)]:
+            client = PyrakoonClient(self.server.cluster_id, self.server.get_nodes(), pipelined=pipelined, read_ahead=read_ahead)
+            client.BATCH_PAYLOAD = 20000
+            del self.server.requests[:]
+            self.assertEqual(list(client.prefix('scan/')), [key for key, _ in expected])
+            self.assertEqual(list(client.prefix_entries('scan/')), expected)
+            # The first batch has 500 keys, the next ones 1111 keys of 18 bytes and the last one is empty
+            self.assertEqual(self.server.requests.count('Range'), 5)
+            # The values are a lot larger: the batch size decreases to the minimum
+            self.assertEqual(self.server.requests.count('RangeEntries'), 1 + 25 + 1)
+        self.assertEqual(list(client.prefix('unknown/')), [])
+
+    def test_prefix_scan_locked(self):
+        """ Validates that scanning while holding the lock of the client, like transaction callbacks do, does not hang """
+        self.server.latency = 0
+        client = PyrakoonClient(self.server.cluster_id, self.server.get_nodes(), read_ahead=True)
+        client._batch_size = 2
+        results = []
+
+        def _callback():
+            results.append((list(client.prefix('key_')), client.count_prefix('key_')))
+            transaction = client.begin_transaction()
+            client.set('scanned', 'true', transaction=transaction)
+            return transaction
+
+        thread = threading.Thread(target=client.apply_callback_transaction, args=(_callback,))
+        thread.daemon = True
+        thread.start()
+        thread.join(5)
+        self.assertFalse(thread.is_alive())
+        self.assertEqual(results, [(['key_{0}'.format(index) for index in xrange(10)], 10)])
+        self.assertEqual(client.get('scanned'), 'true')
+
+        # Pipelined clients read ahead, using a single worker thread per scan
+        client = PyrakoonClient(self.server.cluster_id, self.server.get_nodes(), pipelined=True, read_ahead=True)
+        client._batch_size = 2
+        client.BATCH_SIZE_MIN = client.BATCH_SIZE_MAX = 2
+        started = []
+        original_start = threading.Thread.start
+
+        def _start(thread_self):
+            started.append(thread_self.name)
+            return original_start(thread_self)
+
+        threading.Thread.start = _start
+        try:
+            self.assertEqual(len(list(client.prefix('key_'))), 10)
+        finally:
+            threading.Thread.start = original_start
+        self.assertEqual(started.count('pyrakoon_read_ahead'), 1)
+
+    def test_prefix_scan_split(self):
+        """ Validates that splitting a prefix scan over the clients of a pool lists all keys in order """
+        self.server.latency = 0
+        for index in xrange(1000):
+            self.server.values['scan/{0}'.format(index)] = str(index)
+        expected = sorted((key, value) for key, value in self.server.values.iteritems() if key.startswith('scan/'))
+        client = PyrakoonClientPooled(self.server.cluster_id, self.server.get_nodes(), pool_size=3, backend='threading')
+        self.assertEqual(list(client.prefix_entries('scan/', parts=5)), expected)
+        self.assertEqual(list(client.prefix('scan/', parts=5)), [key for key, _ in expected])
+        self.assertEqual(list(client.prefix('scan/')), [key for key, _ in expected])
+
+    @unittest.skipIf(gevent is None, 'gevent is not installed')
+    def test_prefix_scan_split_gevent(self):
+        """ Validates splitting a prefix scan over the clients of a pool using the gevent backend """
+        self.server.latency = 0
+        for index in xrange(1000):
+            self.server.values['scan/{0}'.format(index)] = str(index)
+        expected = sorted((key, value) for key, value in self.server.values.iteritems() if key.startswith('scan/'))
+        client = PyrakoonClientPooled(self.server.cluster_id, self.server.get_nodes(), pool_size=3, backend='gevent')
+        self.assertEqual(list(client.prefix_entries('scan/', parts=5)), expected)
+
+    def test_pool(self):
+        """ Validates that the pool grows under contention, evicts idle clients and replaces broken clients """
+        pool = PyrakoonPool(self.server.cluster_id, self.server.get_nodes(), pool_size=4, min_size=1, backend='threading')
+        self.assertEqual(pool.get_metrics()['size'], 1)
+
+        def _get(index):
+            with pool.get_client() as pooled_client:
+                return pooled_client.get('key_{0}'.format(index))
+
+        results, _ = self._run_threads(_get, 10)
+        self.assertEqual(results, ['value_{0}'.format(index) for index in xrange(10)])
+        metrics = pool.get_metrics()
+        self.assertEqual((metrics['size'], metrics['idle'], metrics['in_use'], metrics['max_in_use']), (4, 4, 0, 4))
+        self.assertEqual((metrics['checkouts'], metrics['created']), (10, 4))
+        self.assertGreater(metrics['waits'], 0)
+        self.assertGreater(metrics['max_wait_time'], 0)
+
+        # Idle clients are evicted down to the minimum size
+        pool.idle_timeout = 0
+        time.sleep(0.01)
+        pool.maintain()
+        self.assertEqual((pool.get_metrics()['size'], pool.get_metrics()['evicted']), (1, 3))
+        pool.idle_timeout = 300
+
+        # Broken clients are replaced
+        with self.assertRaises(ArakoonSockNotReadable):
+            with pool.get_client() as client:
+                raise ArakoonSockNotReadable()
+        with pool.get_client() as new_client:
+            self.assertIsNot(new_client, client)
+        self.assertEqual((pool.get_metrics()['size'], pool.get_metrics()['replaced']), (1, 1))
+
+        # Idle clients are health checked before being handed out
+        pool.health_check_interval = 0
+        nops = self.server.requests.count('Nop')
+        with pool.get_client() as client:
+            client.get('key_0')
+        self.assertEqual(self.server.requests.count('Nop'), nops + 1)
+
+        def _fail():
+            raise ArakoonSockNotReadable()
+
+        client._client.nop = _fail
+        with pool.get_client() as new_client:
+            self.assertIsNot(new_client, client)
+        metrics = pool.get_metrics()
+        self.assertEqual((metrics['size'], metrics['replaced'], metrics['health_checks'], metrics['failed_health_checks']), (1, 2, 2, 1))
+
+    def test_lock(self):
+        """ Validates the lease lock: mutual exclusion, fencing tokens, refreshing and expiration """
+        self.server.latency = 0
+        client = PyrakoonClient(self.server.cluster_id, self.server.get_nodes())
+        other_client = PyrakoonClientPooled(self.server.cluster_id, self.server.get_nodes(), pool_size=2)
+        metrics = PyrakoonLock.get_metrics()
+        with client.lock('test', expiration=0.3) as lock:
+            self.assertEqual(lock.token, 1)
+            time.sleep(0.5)  # Longer than the expiration: the lease is refreshed in the background
+            self.assertTrue(lock.is_held())
+            start = time.time()
+            with self.assertRaises(NoLockAvailableException):
+                other_client.lock('test', wait=0.2).acquire()
+            self.assertLess(time.time() - start, 0.3)
+        self.assertIsNone(lock.token)
+        self.assertNotIn('/ovs/locks/test', self.server.values)
+        new_metrics = PyrakoonLock.get_metrics()
+        self.assertEqual(new_metrics['acquired'] - metrics['acquired'], 1)
+        self.assertEqual(new_metrics['timeouts'] - metrics['timeouts'], 1)
+        self.assertGreater(new_metrics['refreshes'] - metrics['refreshes'], 0)
+        self.assertGreater(new_metrics['contentions'] - metrics['contentions'], 0)
+        self.assertGreaterEqual(new_metrics['max_hold_time'], 0.5)
+
+        # A holder which stops refreshing loses the lock, the new holder gets a higher token
+        lock = client.lock('test', expiration=0.2)
+        lock.acquire()
+        self.assertEqual(lock.token, 2)
+        PyrakoonLock._refresher.unregister(lock)
+        other_lock = other_client.lock('test', wait=1)
+        other_lock.acquire()
+        self.assertEqual(other_lock.token, 3)
+        lock.refresh_lock()
+        self.assertFalse(lock.is_held())
+        lock.release()
+        self.assertTrue(other_lock.is_held())
+        self.assertIn('/ovs/locks/test', self.server.values)
+        other_lock.release()
+
+        # Contending threads get the lock one after the other
+        holders = []
+
+        def _lock(index):
+            with client.lock('test', wait=5):
+                holders.append(index)
+                time.sleep(0.01)
+                self.assertEqual(holders[-1], index)
+            return index
+
+        results, _ = self._run_threads(_lock, 5)
+        self.assertEqual(results, range(5))
+        self.assertEqual(sorted(holders), range(5))
+
+    def test_read_cache(self):
+        """ Validates the read cache: hits, invalidation by local updates, revalidation using the transaction id and TTLs """
+        self.server.latency = 0
+        cache = ReadCache(size=3, txid_interval=60)
+        client = PyrakoonClient(self.server.cluster_id, self.server.get_nodes(), cache=cache)
+        for _ in xrange(3):
+            self.assertEqual(client.get('key_0'), 'value_0')
+        self.assertEqual(self.server.requests.count('Get'), 1)
+        self.assertEqual(list(client.get_multi(['key_0', 'key_1', 'key_2'])), ['value_0', 'value_1', 'value_2'])
+        self.assertEqual(self.server.requests.count('MultiGet'), 1)  # Only key_1 and key_2 were read
+        statistics = cache.get_statistics()
+        self.assertEqual((statistics['hits'], statistics['misses'], statistics['size']), (3, 3, 3))
+        client.get('key_3')
+        self.assertEqual((cache.get_statistics()['evictions'], cache.get_statistics()['size']), (1, 3))  # key_0 was evicted
+        with self.assertRaises(ArakoonNotFound):
+            client.get('unknown')
+
+        # Local updates invalidate the cache
+        client.set('key_3', 'updated')
+        self.assertEqual(client.get('key_3'), 'updated')
+        transaction = client.begin_transaction()
+        client.set('key_2', 'updated', transaction=transaction)
+        client.apply_transaction(transaction)
+        self.assertEqual(client.get('key_2'), 'updated')
+        client.delete_prefix('key_')
+        with self.assertRaises(ArakoonNotFound):
+            client.get('key_2')
+
+        # Updates by other clients are noticed once the transaction id is fetched again
+        other_client = PyrakoonClient(self.server.cluster_id, self.server.get_nodes())
+        client.set('key_0', 'value_0')
+        self.assertEqual(client.get('key_0'), 'value_0')
+        other_client.set('key_0', 'remote')
+        self.assertEqual(client.get('key_0'), 'value_0')  # Stale within the interval
+        cache.txid_interval = 0
+        self.assertEqual(client.get('key_0'), 'remote')
+        self.assertEqual(client.get('key_0'), 'remote')
+        self.assertEqual(client.get_txid(), self.server._txid)
+
+        # Values of a prefix with a TTL are served until the TTL expires, regardless of the transaction id
+        cache = ReadCache(ttls={'key_': 0.2, '': 0}, txid_interval=None)
+        client = PyrakoonClient(self.server.cluster_id, self.server.get_nodes(), cache=cache)
+        client.set('other', 'value')
+        self.assertEqual((client.get('key_0'), client.get('other')), ('remote', 'value'))
+        other_client.set('key_0', 'remote_2')
+        other_client.set('other', 'value_2')
+        self.assertEqual((client.get('key_0'), client.get('other')), ('remote', 'value_2'))
+        time.sleep(0.2)
+        self.assertEqual(client.get('key_0'), 'remote_2')
+
+    def test_transaction_builder(self):
+        """ Validates the size limits of the transaction builder: failing atomic transactions and chunked non-atomic ones """
+        self.server.latency = 0
+        client = PyrakoonClient(self.server.cluster_id, self.server.get_nodes())
+        builder = client.transaction_builder(max_payload=1024, max_steps=5)
+        builder.assert_value('key_0', 'value_0')
+        builder.set('new_key', 'value')
+        builder.delete('key_1')
+        self.assertEqual(builder.pending_payload, 8 + (9 + 5 + 4 + 7) + (12 + 7 + 5) + (8 + 5))
+        builder.apply()
+        self.assertEqual(self.server.requests.count('Sequence'), 1)
+        self.assertEqual(client.get('new_key'), 'value')
+        with self.assertRaises(ArakoonNotFound):
+            client.get('key_1')
+
+        # Atomic transactions fail before anything is sent
+        with self.assertRaises(TransactionTooLargeException):
+            with client.transaction_builder(max_payload=1024, max_steps=5) as builder:
+                for index in xrange(6):
+                    builder.set('bulk_{0}'.format(index), 'value')
+        with self.assertRaises(TransactionTooLargeException):
+            client.transaction_builder(max_payload=64).set('key', 'v' * 64)
+        self.assertEqual(self.server.requests.count('Sequence'), 1)
+        self.assertEqual(list(client.prefix('bulk_')), [])
+
+        # Non-atomic transactions are applied in ordered chunks
+        with client.transaction_builder(atomic=False, max_payload=200, max_steps=5) as builder:
+            for index in xrange(12):
+                builder.set('bulk_{0:02d}'.format(index), 'value_{0}'.format(index))
+            builder.delete('bulk_11')
+            builder.delete_prefix('key_')
+        self.assertEqual(self.server.requests.count('Sequence'), 4)
+        self.assertEqual(list(client.prefix('bulk_')), ['bulk_{0:02d}'.format(index) for index in xrange(11)])
+        self.assertEqual(list(client.prefix('key_')), [])
+        statistics = builder.get_statistics()
+        self.assertEqual((statistics['steps'], statistics['chunks'], statistics['max_chunk_steps']), (14, 3, 5))
+        self.assertLessEqual(statistics['max_chunk_payload'], 200)
+        self.assertEqual((statistics['pending_steps'], statistics['pending_payload']), (0, 8))
+
+    def _start_followers(self, amount):
+        """ Starts followers of the mocked server and returns the nodes of the cluster """
+        nodes = self.server.get_nodes()
+        followers = []
+        for index in xrange(1, amount + 1):
+            follower = ArakoonServerMock(node_id='arakoon_{0}'.format(index), master_id=self.server.node_id)
+            follower.catch_up(self.server)
+            self.addCleanup(follower.stop)
+            nodes.update(follower.get_nodes())
+            followers.append(follower)
+        return followers, nodes
+
+    def test_read_routing(self):
+        """ Validates that reads are spread over the nodes of the cluster """
+        self.server.latency = 0
+        followers, nodes = self._start_followers(2)
+        servers = [self.server] + followers
+        client = PyrakoonClient(self.server.cluster_id, nodes, read_policy=ReadPolicy(READ_FROM_LEAST_LOADED))
+        for index in xrange(30):
+            self.assertEqual(client.get('key_{0}'.format(index % 10)), 'value_{0}'.format(index % 10))
+        self.assertEqual([server.requests.count('Get') for server in servers], [10, 10, 10])
+        statistics = client._client.getReadStatistics()
+        self.assertEqual(sorted(statistics), ['arakoon_0', 'arakoon_1', 'arakoon_2'])
+        self.assertEqual([entry['reads'] for entry in statistics.itervalues()], [10, 10, 10])
+        self.assertEqual([entry['in_flight'] for entry in statistics.itervalues()], [0, 0, 0])
+
+        self.server.latency = 0.05  # The followers are closer
+        client = PyrakoonClient(self.server.cluster_id, nodes, read_policy=ReadPolicy(READ_FROM_NEAREST))
+        self.assertEqual(list(client.prefix('key_')), ['key_{0}'.format(index) for index in xrange(10)])
+        for index in xrange(10):
+            client.exists('key_{0}'.format(index))
+        self.assertLessEqual(self.server.requests.count('Exists'), 1)
+        self.assertEqual(sum(server.requests.count('Exists') for server in servers), 10)
+
+        # Without a read policy, all reads go to the master
+        client = PyrakoonClient(self.server.cluster_id, nodes)
+        client.get('key_0')
+        self.assertEqual([server.requests.count('Get') for server in servers], [11, 10, 10])
+
+    def test_read_your_writes(self):
+        """ Validates that a session reads its own writes, even when the followers lag behind """
+        self.server.latency = 0
+        followers, nodes = self._start_followers(2)
+        policy = ReadPolicy(READ_FROM_LEAST_LOADED)
+        client = PyrakoonClient(self.server.cluster_id, nodes, read_policy=policy)
+        other_client = PyrakoonClient(self.server.cluster_id, nodes, read_policy=policy)  # Same session
+        self.assertIsNone(policy.txid)
+        self.assertIsInstance(policy.get_consistency(client._client.get_txid), type(policy.consistency))
+
+        client.set('key_0', 'updated')
+        for _ in xrange(6):
+            self.assertEqual(other_client.get('key_0'), 'updated')  # The followers did not apply the update
+        self.assertEqual(policy.txid, self.server._txid)
+        self.assertEqual(self.server.requests.count('GetTxID'), 1)  # Only fetched after the write
+        self.assertEqual(self.server.requests.count('Get'), 6)
+        statistics = other_client._client.getReadStatistics()
+        self.assertGreater(statistics['arakoon_1']['failures'] + statistics['arakoon_2']['failures'], 0)
+
+        for follower in followers:
+            follower.catch_up(self.server)
+            del follower.requests[:]
+        client = PyrakoonClient(self.server.cluster_id, nodes, read_policy=policy)  # Fresh statistics
+        for _ in xrange(6):
+            self.assertEqual(client.get('key_0'), 'updated')
+        self.assertEqual([follower.requests.count('Get') for follower in followers], [2, 2])
+
+        # Other errors are not retried on the master
+        servers = [self.server] + followers
+        requests = sum(server.requests.count('Get') for server in servers)
+        with self.assertRaises(ArakoonNotFound):
+            client.get('unknown')
+        self.assertEqual(sum(server.requests.count('Get') for server in servers), requests + 1)
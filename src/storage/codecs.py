@@ -0,0 +1,233 @@
+# Copyright (C) 2019 iNuron NV
+#
+# This file is part of Open vStorage Open Source Edition (OSE),
+# as available from
+#
+#      http://www.openvstorage.org and
+#      http://www.openvstorage.com.
+#
+# This file is free software; you can redistribute it and/or modify it
+# under the terms of the GNU Affero General Public License v3 (GNU AGPLv3)
+# as published by the Free Software Foundation, in version 3 as it comes
+# in the LICENSE.txt file of the Open vStorage OSE distribution.
+#
+# Open vStorage is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY of any kind.
+
+
+"""
+Value codecs for the stores
+A codec serializes values and optionally compresses the result. The serializers are the ones of the DAL (check
+ovs_extensions.dal.serializers), the header bytes are a concern of the stores only: every format except JSON starts with a
+header byte, so values written with different codecs can be decoded by any codec. JSON has no header, which keeps the
+values readable for clients which don't know about codecs. The header bytes are control characters, which JSON text never
+starts with.
+Note: msgpack encodes dict keys in iteration order, so asserting values containing dicts is not reliable with msgpack
+"""
+
+import zlib
+from ovs_extensions.dal.serializers import JSONSerializer, MsgPackSerializer
+
+# noinspection PyUnreachableCode
+if False:
+    from typing import Optional, Union
+
+
+class ZlibCompressor(object):
+    """
+    Compresses using zlib
+    """
+    NAME = 'zlib'
+
+    @staticmethod
+    def compress(data):
+        # type: (str) -> str
+        """
+        Compresses the given data
+        :param data: Data to compress
+        :type data: str
+        :return: The compressed data
+        :rtype: str
+        """
+        return zlib.compress(data, 6)
+
+    @staticmethod
+    def decompress(data):
+        # type: (str) -> str
+        """
+        Decompresses the given data
+        :param data: The compressed data
+        :type data: str
+        :return: The decompressed data
+        :rtype: str
+        """
+        return zlib.decompress(data)
+
+
+class LZ4Compressor(object):
+    """
+    Compresses to LZ4 frames: less compression than zlib, but a lot faster
+    Requires the lz4 package, which is only imported when this compressor is used
+    """
+    NAME = 'lz4'
+
+    @staticmethod
+    def _get_lz4():
+        """ Imports lz4 """
+        try:
+            import lz4.frame
+        except ImportError as ex:
+            raise RuntimeError('Failed to load python package: {0}'.format(ex))
+        return lz4.frame
+
+    @classmethod
+    def compress(cls, data):
+        # type: (str) -> str
+        """
+        Compresses the given data
+        :param data: Data to compress
+        :type data: str
+        :return: The compressed data
+        :rtype: str
+        """
+        return cls._get_lz4().compress(data)
+
+    @classmethod
+    def decompress(cls, data):
+        # type: (str) -> str
+        """
+        Decompresses the given data
+        :param data: The compressed data
+        :type data: str
+        :return: The decompressed data
+        :rtype: str
+        """
+        return cls._get_lz4().decompress(data)
+
+
+_serializers = {}
+_compressors = {}
+_headers = {}
+
+
+def register_serializer(serializer, header=None):
+    # type: (type, Optional[str]) -> None
+    """
+    Registers a serializer, making it available to the codecs by its name
+    :param serializer: The serializer, offering NAME, serialize and deserialize
+    :type serializer: type
+    :param header: Header byte identifying the values it serialized. Only JSON serializers can do without
+    :type header: str
+    :return: None
+    :rtype: NoneType
+    """
+    _register(serializer, header, _serializers)
+
+
+def register_compressor(compressor, header):
+    # type: (type, str) -> None
+    """
+    Registers a compressor, making it available to the codecs by its name
+    :param compressor: The compressor, offering NAME, compress and decompress
+    :type compressor: type
+    :param header: Header byte identifying the values it compressed
+    :type header: str
+    :return: None
+    :rtype: NoneType
+    """
+    _register(compressor, header, _compressors)
+
+
+def _register(entry, header, registry):
+    """ Registers a serializer or compressor, validating its header """
+    if header is not None:
+        if len(header) != 1 or header >= ' ':
+            raise ValueError('The header of {0} must be a single control character'.format(entry.NAME))
+        if _headers.get(header, (entry,))[0] is not entry:
+            raise ValueError('The header of {0} is already used by {1}'.format(entry.NAME, _headers[header][0].NAME))
+        _headers[header] = (entry, registry is _compressors)
+    registry[entry.NAME] = (entry, header)
+
+
+register_serializer(JSONSerializer)
+register_serializer(MsgPackSerializer, '\x01')
+register_compressor(ZlibCompressor, '\x02')
+register_compressor(LZ4Compressor, '\x03')
+
+
+class Codec(object):
+    """
+    Encodes values with a registered serializer and, when they are large enough, a registered compressor
+    Decoding detects the format from the header bytes, so a codec decodes the values of all other codecs
+    """
+    COMPRESSION_THRESHOLD = 4 * 1024
+
+    def __init__(self, serializer='json', compressor=None, compression_threshold=COMPRESSION_THRESHOLD):
+        # type: (str, Optional[str], int) -> None
+        """
+        Initializes the codec
+        :param serializer: Name of the serializer
+        :type serializer: str
+        :param compressor: Name of the compressor. Defaults to not compressing
+        :type compressor: str
+        :param compression_threshold: Minimal size of a serialized value to compress it, in bytes
+        :type compression_threshold: int
+        """
+        if serializer not in _serializers:
+            raise ValueError('Unknown serializer {0}'.format(serializer))
+        if compressor is not None and compressor not in _compressors:
+            raise ValueError('Unknown compressor {0}'.format(compressor))
+        self._serializer, self._serializer_header = _serializers[serializer]
+        self._compressor, self._compressor_header = (None, None) if compressor is None else _compressors[compressor]
+        self.compression_threshold = compression_threshold
+
+    def encode(self, value):
+        # type: (any) -> str
+        """
+        Encodes the given value
+        A serialized value is only kept compressed when compressing makes it smaller
+        :param value: Value to encode
+        :type value: any
+        :return: The encoded value
+        :rtype: str
+        """
+        data = str(self._serializer.serialize(value))  # The DAL msgpack serializer returns a buffer, to be stored as BLOB
+        if self._serializer_header is not None:
+            data = self._serializer_header + data
+        if self._compressor is not None and len(data) >= self.compression_threshold:
+            compressed = self._compressor_header + self._compressor.compress(data)
+            if len(compressed) < len(data):
+                return compressed
+        return data
+
+    @staticmethod
+    def decode(data):
+        # type: (str) -> any
+        """
+        Decodes the given value, regardless of the codec which encoded it
+        :param data: The encoded value
+        :type data: str
+        :return: The decoded value
+        :rtype: any
+        """
+        registration = _headers.get(data[:1])
+        if registration is None:
+            return JSONSerializer.deserialize(data)
+        entry, is_compressor = registration
+        if is_compressor is True:
+            return Codec.decode(entry.decompress(data[1:]))
+        return entry.deserialize(data[1:])
+
+
+def get_codec(codec=None):
+    # type: (Union[None, str, Codec]) -> Codec
+    """
+    Returns the codec to use for the given codec argument of a store
+    :param codec: A codec, the name of a serializer or None for the JSON codec
+    :type codec: str or Codec
+    :return: The codec
+    :rtype: Codec
+    """
+    if isinstance(codec, Codec):
+        return codec
+    return Codec(serializer=codec or JSONSerializer.NAME)
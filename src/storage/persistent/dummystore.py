@@ -154,6 +154,29 @@ class DummyPersistentStore(object):
         data = self._read()
         return [(k, copy.deepcopy(v)) for k, v in data.iteritems() if k.startswith(key)]
 
+    @synchronize()
+    def list_page(self, prefix, start_after=None, limit=100, reverse=False, entries=False):
+        """
+        Lists a page of the keys (or key, value pairs) starting with the given prefix, in order
+        The last key of a page is the cursor to pass as start_after to get the next page
+        """
+        data = self._read()
+        keys = sorted((k for k in data.iterkeys() if k.startswith(prefix)), reverse=reverse)
+        if start_after is not None:
+            keys = [k for k in keys if (k < start_after if reverse is True else k > start_after)]
+        keys = keys[:limit]
+        if entries is True:
+            return [[k, copy.deepcopy(data[k])] for k in keys]
+        return keys
+
+    @synchronize()
+    def count_prefix(self, prefix):
+        """
+        Counts the keys starting with the given prefix
+        """
+        data = self._read()
+        return len([k for k in data.iterkeys() if k.startswith(prefix)])
+
     @synchronize()
     def set(self, key, value, transaction=None):
         """
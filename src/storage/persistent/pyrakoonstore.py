@@ -18,12 +18,12 @@
 Arakoon store module, using pyrakoon
 """
 
-import ujson
 from ConfigParser import RawConfigParser
 from functools import wraps
 from StringIO import StringIO
-from ovs_extensions.db.arakoon.pyrakoon.client import PyrakoonClient
+from ovs_extensions.db.arakoon.pyrakoon.client import PyrakoonClient, ReadCache, TransactionBuilder
 from ovs_extensions.db.arakoon.pyrakoon.pyrakoon.compat import ArakoonAssertionFailed, ArakoonNotFound
+from ovs_extensions.storage.codecs import get_codec
 from ovs_extensions.storage.exceptions import AssertException, KeyNotFoundException
 
 
@@ -52,12 +52,17 @@ def convert_exception():
 class PyrakoonStore(object):
     """
     Pyrakoon client wrapper:
-    * Uses json serialisation
+    * Uses json serialisation, unless another codec is given
     * Raises generic exception
     """
-    def __init__(self, cluster, configuration):
+    def __init__(self, cluster, configuration, cache_size=0, cache_ttls=None, cache_txid_interval=1.0, codec=None):
         """
         Initializes the client
+        :param codec: Codec, or name of the serializer, to encode the values with. Defaults to JSON. Check ovs_extensions.storage.codecs
+        Values are decoded regardless of the codec which encoded them. Asserts only match values encoded by the same codec
+        :param cache_size: Number of values to cache client side. 0 disables the cache. Check ReadCache
+        :param cache_ttls: Seconds a cached value stays valid, per key prefix
+        :param cache_txid_interval: Seconds between checking whether the cluster was updated, invalidating the cached values
         """
         parser = RawConfigParser()
         parser.readfp(StringIO(configuration))
@@ -65,7 +70,11 @@ class PyrakoonStore(object):
         for node in parser.get('global', 'cluster').split(','):
             node = node.strip()
             nodes[node] = ([parser.get(node, 'ip')], parser.get(node, 'client_port'))
-        self._client = PyrakoonClient(cluster, nodes)
+        self._cache = None
+        if cache_size > 0:
+            self._cache = ReadCache(size=cache_size, ttls=cache_ttls, txid_interval=cache_txid_interval)
+        self._client = PyrakoonClient(cluster, nodes, cache=self._cache)
+        self._codec = get_codec(codec)
 
     @convert_exception()
     def get(self, key):
@@ -73,10 +82,16 @@ class PyrakoonStore(object):
         Retrieves a certain value for a given key
         """
         try:
-            return ujson.loads(self._client.get(key))
+            return self._codec.decode(self._client.get(key))
         except ValueError:
             raise KeyNotFoundException('Could not parse JSON stored for {0}'.format(key))
 
+    def get_cache_statistics(self):
+        """
+        Returns the hit, miss, eviction and invalidation counters of the cache. None when caching is disabled
+        """
+        return None if self._cache is None else self._cache.get_statistics()
+
     @convert_exception()
     def get_multi(self, keys, must_exist=True):
         """
@@ -84,7 +99,7 @@ class PyrakoonStore(object):
         """
         try:
             for item in self._client.get_multi(keys, must_exist=must_exist):
-                yield None if item is None else ujson.loads(item)
+                yield None if item is None else self._codec.decode(item)
         except ValueError:
             raise KeyNotFoundException('Could not parse JSON stored')
 
@@ -93,7 +108,7 @@ class PyrakoonStore(object):
         """
         Sets the value for a key to a given value
         """
-        return self._client.set(key, ujson.dumps(value, sort_keys=True), transaction)
+        return self._client.set(key, self._codec.encode(value), transaction)
 
     @convert_exception()
     def prefix(self, prefix):
@@ -108,7 +123,26 @@ class PyrakoonStore(object):
         Lists all keys starting with the given prefix
         """
         for item in self._client.prefix_entries(prefix):
-            yield [item[0], ujson.loads(item[1])]
+            yield [item[0], self._codec.decode(item[1])]
+
+    @convert_exception()
+    def list_page(self, prefix, start_after=None, limit=100, reverse=False, entries=False):
+        """
+        Lists a page of the keys (or key, value pairs) starting with the given prefix, in order. Only the page is fetched
+        The last key of a page is the cursor to pass as start_after to get the next page. A page with less than limit items
+        is the last one
+        """
+        page = self._client.list_page(prefix, start_after, limit, reverse, entries)
+        if entries is True:
+            return [[key, self._codec.decode(value)] for key, value in page]
+        return page
+
+    @convert_exception()
+    def count_prefix(self, prefix):
+        """
+        Counts the keys starting with the given prefix
+        """
+        return self._client.count_prefix(prefix)
 
     @convert_exception()
     def delete(self, key, must_exist=True, transaction=None):
@@ -143,7 +177,7 @@ class PyrakoonStore(object):
         """
         Asserts a key-value pair
         """
-        return self._client.assert_value(key, None if value is None else ujson.dumps(value, sort_keys=True), transaction)
+        return self._client.assert_value(key, None if value is None else self._codec.encode(value), transaction)
 
     @convert_exception()
     def assert_exists(self, key, transaction=None):
@@ -166,6 +200,24 @@ class PyrakoonStore(object):
         """
         return self._client.apply_transaction(transaction)
 
+    @convert_exception()
+    def _apply_sequence(self, sequence):
+        """
+        Applies a sequence built by a transaction builder
+        """
+        return self._client._apply_sequence(sequence)
+
+    def transaction_builder(self, atomic=True, max_payload=None, max_steps=None):
+        """
+        Returns a builder for transactions which keeps track of their size. The values are encoded by the codec of the store
+        :param atomic: Apply all steps in a single sequence, failing when the limits are exceeded. When False, the steps are
+        applied in consecutive sequences within the limits, suited for bulk loads and removals. Check TransactionBuilder
+        :param max_payload: Maximum size of a sequence, in bytes
+        :param max_steps: Maximum number of steps of a sequence
+        """
+        return TransactionBuilder(self._apply_sequence, atomic=atomic, max_payload=max_payload, max_steps=max_steps,
+                                  encode=self._codec.encode)
+
     @convert_exception()
     def lock(self, name, wait=None, expiration=60):
         # type: (str, float, float) -> any
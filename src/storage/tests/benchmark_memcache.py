@@ -0,0 +1,77 @@
+# Copyright (C) 2019 iNuron NV
+#
+# This file is part of Open vStorage Open Source Edition (OSE),
+# as available from
+#
+#      http://www.openvstorage.org and
+#      http://www.openvstorage.com.
+#
+# This file is free software; you can redistribute it and/or modify it
+# under the terms of the GNU Affero General Public License v3 (GNU AGPLv3)
+# as published by the Free Software Foundation, in version 3 as it comes
+# in the LICENSE.txt file of the Open vStorage OSE distribution.
+#
+# Open vStorage is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY of any kind.
+
+
+"""
+Benchmarks for the memcache store
+Usage: python -m ovs_extensions.storage.tests.benchmark_memcache
+"""
+
+import time
+import threading
+from ovs_extensions.storage.tests.memcached_mock import MemcachedServerMock
+from ovs_extensions.storage.volatile.memcachestore import MemcacheStore
+
+
+def _report(title, results):
+    """ Prints the results of a benchmark. The first result is used as reference """
+    print title
+    reference = results[0][1]
+    for label, duration in results:
+        print '    {0:<30} {1:>9.4f}s {2:>7.2f}x'.format(label, duration, reference / duration if duration else 0)
+
+
+def _run_threads(function, amount):
+    """ Executes the function in the given amount of threads and returns the duration """
+    threads = [threading.Thread(target=function, args=(index,)) for index in xrange(amount)]
+    start = time.time()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return time.time() - start
+
+
+def benchmark_threads(threads=16, operations=200, latency=0.001):
+    """
+    Gets and sets keys from multiple threads, comparing a single client shared under a lock with a client per thread
+    :param threads: Amount of threads
+    :param operations: Amount of gets and sets per thread
+    :param latency: Latency of the mocked memcached server
+    """
+    server = MemcachedServerMock(latency=latency)
+    try:
+        results = []
+        for label, thread_local in [('shared client, global lock', False), ('client per thread', True)]:
+            store = MemcacheStore(server.get_nodes(), thread_local=thread_local)
+
+            def _run(index):
+                key = 'key_{0}'.format(index)
+                for operation in xrange(operations):
+                    if operation % 4 == 0:
+                        store.set(key, {'index': index, 'operation': operation})
+                    elif store.get(key)['index'] != index:
+                        raise RuntimeError('Invalid value')
+
+            duration = _run_threads(_run, threads)
+            results.append(('{0} ({1:.0f} ops/s)'.format(label, threads * operations / duration), duration))
+        _report('{0} threads doing {1} operations each with a latency of {2}s'.format(threads, operations, latency), results)
+    finally:
+        server.stop()
+
+
+if __name__ == '__main__':
+    benchmark_threads()
@@ -0,0 +1,269 @@
+# Copyright (C) 2019 iNuron NV
+#
+# This file is part of Open vStorage Open Source Edition (OSE),
+# as available from
+#
+#      http://www.openvstorage.org and
+#      http://www.openvstorage.com.
+#
+# This file is free software; you can redistribute it and/or modify it
+# under the terms of the GNU Affero General Public License v3 (GNU AGPLv3)
+# as published by the Free Software Foundation, in version 3 as it comes
+# in the LICENSE.txt file of the Open vStorage OSE distribution.
+#
+# Open vStorage is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY of any kind.
+
+"""
+Memcached server mock module
+"""
+
+import time
+import socket
+import threading
+from Queue import Queue
+
+
+class MemcachedServerMock(object):
+    """
+    Minimal, in-memory memcached server speaking the text protocol over TCP on localhost.
+    It supports the storage, retrieval, deletion, touch and increment/decrement commands.
+    A latency can be configured: every response is sent `latency` seconds after its request was received, without
+    delaying the processing of the next requests, like a network round trip would.
+    """
+    MAX_RELATIVE_EXPIRATION = 60 * 60 * 24 * 30
+    STORAGE_COMMANDS = ['set', 'add', 'replace', 'append', 'prepend', 'cas']
+
+    def __init__(self, latency=0):
+        # type: (float) -> None
+        """
+        Starts the server
+        :param latency: Amount of seconds to delay every response with
+        :type latency: float
+        """
+        self.latency = latency
+        self.values = {}  # Key: (flags, data, expiration, cas unique)
+        self.requests = []  # Names of the processed commands
+        self._cas_unique = 0
+        self._lock = threading.Lock()
+        self._running = True
+        self._connections = []
+        self._socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self._socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self._socket.bind(('127.0.0.1', 0))
+        self._socket.listen(128)
+        self.port = self._socket.getsockname()[1]
+        self._start_thread(self._accept)
+
+    def get_nodes(self):
+        # type: () -> list
+        """
+        Builds the node information as expected by the MemcacheStore
+        :return: The nodes
+        :rtype: list
+        """
+        return ['127.0.0.1:{0}'.format(self.port)]
+
+    def stop(self):
+        # type: () -> None
+        """
+        Stops the server, closing all connections
+        :return: None
+        :rtype: NoneType
+        """
+        self._running = False
+        for sock in [self._socket] + self._connections:
+            try:
+                sock.shutdown(socket.SHUT_RDWR)
+            except socket.error:
+                pass
+            sock.close()
+
+    @staticmethod
+    def _start_thread(target, *args):
+        thread = threading.Thread(target=target, args=args)
+        thread.daemon = True
+        thread.start()
+        return thread
+
+    def _accept(self):
+        """ Accepts client connections """
+        while self._running:
+            try:
+                connection, _ = self._socket.accept()
+            except socket.error:
+                return
+            connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            self._connections.append(connection)
+            responses = Queue()
+            self._start_thread(self._serve, connection, responses)
+            self._start_thread(self._respond, connection, responses)
+
+    def _serve(self, connection, responses):
+        """ Reads and processes the commands of a single connection """
+        stream = connection.makefile('rb')
+        try:
+            while True:
+                line = stream.readline()
+                if not line.endswith('\r\n'):
+                    break
+                received = time.time()
+                arguments = line[:-2].split()
+                if not arguments:
+                    continue
+                data = None
+                if arguments[0] in self.STORAGE_COMMANDS:
+                    data = stream.read(int(arguments[4]) + 2)[:-2]
+                noreply = arguments[-1] == 'noreply'
+                if noreply:
+                    arguments = arguments[:-1]
+                response = self._handle(arguments[0], arguments[1:], data)
+                if not noreply:
+                    responses.put((received + self.latency, response))
+        except (socket.error, ValueError, IndexError):
+            pass
+        finally:
+            responses.put(None)
+
+    @staticmethod
+    def _respond(connection, responses):
+        """ Sends the responses of a single connection, in order """
+        while True:
+            entry = responses.get()
+            if entry is None:
+                break
+            deadline, response = entry
+            delay = deadline - time.time()
+            if delay > 0:
+                time.sleep(delay)
+            try:
+                connection.sendall(response)
+            except socket.error:
+                break
+        connection.close()
+
+    def _handle(self, command, arguments, data):
+        """ Processes a command and returns the response """
+        with self._lock:
+            self.requests.append(command)
+            handler = getattr(self, '_handle_{0}'.format(command), None)
+            if handler is None:
+                return 'ERROR\r\n'
+            return handler(arguments, data)
+
+    def _get_entry(self, key):
+        entry = self.values.get(key)
+        if entry is not None and entry[2] is not None and entry[2] <= time.time():
+            del self.values[key]
+            return None
+        return entry
+
+    def _store(self, key, flags, data, expiration):
+        self._cas_unique += 1
+        self.values[key] = (flags, data, expiration, self._cas_unique)
+
+    def _get_expiration(self, exptime):
+        exptime = int(exptime)
+        if exptime == 0:
+            return None
+        if exptime < 0:
+            return 0
+        if exptime <= self.MAX_RELATIVE_EXPIRATION:
+            return time.time() + exptime
+        return exptime
+
+    def _retrieve(self, keys, with_cas):
+        response = []
+        for key in keys:
+            entry = self._get_entry(key)
+            if entry is None:
+                continue
+            flags, data, _, cas_unique = entry
+            header = 'VALUE {0} {1} {2}'.format(key, flags, len(data))
+            if with_cas is True:
+                header += ' {0}'.format(cas_unique)
+            response.append('{0}\r\n{1}\r\n'.format(header, data))
+        response.append('END\r\n')
+        return ''.join(response)
+
+    def _handle_get(self, arguments, data):
+        _ = data
+        return self._retrieve(arguments, with_cas=False)
+
+    def _handle_gets(self, arguments, data):
+        _ = data
+        return self._retrieve(arguments, with_cas=True)
+
+    def _handle_set(self, arguments, data):
+        self._store(arguments[0], int(arguments[1]), data, self._get_expiration(arguments[2]))
+        return 'STORED\r\n'
+
+    def _handle_add(self, arguments, data):
+        if self._get_entry(arguments[0]) is not None:
+            return 'NOT_STORED\r\n'
+        return self._handle_set(arguments, data)
+
+    def _handle_replace(self, arguments, data):
+        if self._get_entry(arguments[0]) is None:
+            return 'NOT_STORED\r\n'
+        return self._handle_set(arguments, data)
+
+    def _handle_append(self, arguments, data):
+        entry = self._get_entry(arguments[0])
+        if entry is None:
+            return 'NOT_STORED\r\n'
+        self._store(arguments[0], entry[0], entry[1] + data, entry[2])
+        return 'STORED\r\n'
+
+    def _handle_prepend(self, arguments, data):
+        entry = self._get_entry(arguments[0])
+        if entry is None:
+            return 'NOT_STORED\r\n'
+        self._store(arguments[0], entry[0], data + entry[1], entry[2])
+        return 'STORED\r\n'
+
+    def _handle_cas(self, arguments, data):
+        entry = self._get_entry(arguments[0])
+        if entry is None:
+            return 'NOT_FOUND\r\n'
+        if entry[3] != int(arguments[4]):
+            return 'EXISTS\r\n'
+        return self._handle_set(arguments, data)
+
+    def _handle_delete(self, arguments, data):
+        _ = data
+        if self._get_entry(arguments[0]) is None:
+            return 'NOT_FOUND\r\n'
+        del self.values[arguments[0]]
+        return 'DELETED\r\n'
+
+    def _handle_touch(self, arguments, data):
+        _ = data
+        entry = self._get_entry(arguments[0])
+        if entry is None:
+            return 'NOT_FOUND\r\n'
+        self.values[arguments[0]] = (entry[0], entry[1], self._get_expiration(arguments[1]), entry[3])
+        return 'TOUCHED\r\n'
+
+    def _incrdecr(self, arguments, sign):
+        entry = self._get_entry(arguments[0])
+        if entry is None:
+            return 'NOT_FOUND\r\n'
+        if not entry[1].isdigit():
+            return 'CLIENT_ERROR cannot increment or decrement non-numeric value\r\n'
+        value = int(entry[1]) + sign * int(arguments[1])
+        value = max(0, value) % 2 ** 64  # Decrementing stops at 0, incrementing wraps around
+        self._store(arguments[0], entry[0], str(value), entry[2])
+        return '{0}\r\n'.format(value)
+
+    def _handle_incr(self, arguments, data):
+        _ = data
+        return self._incrdecr(arguments, 1)
+
+    def _handle_decr(self, arguments, data):
+        _ = data
+        return self._incrdecr(arguments, -1)
+
+    def _handle_version(self, arguments, data):
+        _ = arguments, data
+        return 'VERSION 1.5.6\r\n'
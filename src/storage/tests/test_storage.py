@@ -0,0 +1,306 @@
+# Copyright (C) 2019 iNuron NV
+#
+# This file is part of Open vStorage Open Source Edition (OSE),
+# as available from
+#
+#      http://www.openvstorage.org and
+#      http://www.openvstorage.com.
+#
+# This file is free software; you can redistribute it and/or modify it
+# under the terms of the GNU Affero General Public License v3 (GNU AGPLv3)
+# as published by the Free Software Foundation, in version 3 as it comes
+# in the LICENSE.txt file of the Open vStorage OSE distribution.
+#
+# Open vStorage is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY of any kind.
+
+"""
+Test module for the stores
+"""
+
+import time
+import ujson
+import threading
+import unittest
+from ovs_extensions.db.arakoon.tests.server_mock import ArakoonServerMock
+from ovs_extensions.storage.codecs import Codec, ZlibCompressor, register_compressor
+from ovs_extensions.storage.persistent.dummystore import DummyPersistentStore
+from ovs_extensions.storage.persistent.pyrakoonstore import PyrakoonStore
+from ovs_extensions.storage.tests.memcached_mock import MemcachedServerMock
+from ovs_extensions.storage.volatile.dummystore import DummyVolatileStore
+from ovs_extensions.storage.volatile.memcachestore import MemcacheStore
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+try:
+    import lz4.frame
+except ImportError:
+    lz4 = None
+
+
+class VolatileStoreTest(unittest.TestCase):
+    """
+    Tests the volatile stores
+    """
+
+    def setUp(self):
+        """ Starts the mocked memcached server """
+        self.server = MemcachedServerMock()
+        DummyVolatileStore()._clean()
+
+    def tearDown(self):
+        """ Stops the mocked memcached server """
+        self.server.stop()
+
+    def _validate_multi(self, store):
+        """ Validates the multi-key operations of a store """
+        values = dict(('key_{0}'.format(index), {'index': index}) for index in xrange(10))
+        self.assertEqual(store.set_multi(values), [])
+        self.assertEqual(store.get_multi(['key_0', 'key_5', 'unknown']), {'key_0': {'index': 0}, 'key_5': {'index': 5}})
+        self.assertEqual(store.get_multi(values.keys()), values)
+        store.delete_multi(['key_{0}'.format(index) for index in xrange(5)] + ['unknown'])
+        self.assertEqual(store.get_multi(values.keys()), dict(('key_{0}'.format(index), {'index': index}) for index in xrange(5, 10)))
+        self.assertEqual(store.get('key_5'), {'index': 5})
+        self.assertIsNone(store.get('key_0'))
+        self.assertEqual(store.get_multi([]), {})
+
+    def test_multi_dummy(self):
+        """ Validates the multi-key operations of the dummy store """
+        self._validate_multi(DummyVolatileStore())
+
+    def test_multi_memcache(self):
+        """ Validates the multi-key operations of the memcache store and the single round trip per operation """
+        store = MemcacheStore(self.server.get_nodes())
+        self._validate_multi(store)
+
+        self.server.latency = 0.05
+        values = dict(('other_{0}'.format(index), index) for index in xrange(20))
+        start = time.time()
+        store.set_multi(values)
+        self.assertEqual(store.get_multi(values.keys()), values)
+        store.delete_multi(values.keys())
+        self.assertLess(time.time() - start, 0.5)  # 3 round trips instead of 60
+        self.assertEqual(self.server.requests[-21:], ['get'] + ['delete'] * 20)
+
+        # Keys are cleaned, the values are returned for the keys as given
+        self.server.latency = 0
+        store.set_multi({'with space': 1})
+        self.assertEqual(store.get_multi(['with space', 'withspace']), {'with space': 1, 'withspace': 1})
+
+        # The validation envelope is enforced
+        store._client.set('invalid', '{"key": "other", "value": 1}')
+        with self.assertRaises(RuntimeError):
+            store.get_multi(['invalid'])
+
+    def _validate_counters(self, store):
+        """ Validates the counters of a store """
+        self.assertIsNone(store.get_counter('counter'))
+        self.assertEqual(store.incr('counter'), 1)
+        self.assertEqual(store.incr('counter', 5), 6)
+        self.assertEqual(store.decr('counter', 2), 4)
+        self.assertEqual(store.decr('counter', 10), 0)
+        self.assertEqual(store.get_counter('counter'), 0)
+        self.assertEqual(store.get('counter'), 0)
+        self.assertEqual(store.decr('other'), 0)
+        self.assertEqual(store.incr('expiring', time=1), 1)
+        time.sleep(0.6)
+        self.assertEqual(store.incr('expiring', time=60), 2)  # The expiry is kept
+        time.sleep(0.6)
+        self.assertIsNone(store.get_counter('expiring'))
+
+    def test_counters_dummy(self):
+        """ Validates the counters of the dummy store """
+        self._validate_counters(DummyVolatileStore())
+
+    def test_counters_memcache(self):
+        """ Validates the counters of the memcache store and their atomic updates by memcache """
+        store = MemcacheStore(self.server.get_nodes())
+        self._validate_counters(store)
+        self.server.requests = []
+        for _ in xrange(5):
+            store.incr('counter')
+        self.assertEqual(self.server.requests, ['incr'] * 5)
+
+        # Counters stored wrapped are converted
+        store.set('wrapped', 5)
+        self.assertEqual(store.get_counter('wrapped'), 5)
+        self.assertEqual(store.incr('wrapped'), 6)
+        self.assertEqual(store.incr('wrapped'), 7)
+        self.assertEqual(self.server.values['wrapped'][1], '7')
+        self.assertEqual(store.get('wrapped'), 7)
+        self.assertEqual(store.get_multi(['counter', 'wrapped']), {'counter': 5, 'wrapped': 7})
+
+    def test_thread_local_memcache(self):
+        """ Validates that a store using a client per thread does not serialize the threads and increments atomically """
+        self.server.latency = 0.05
+        store = MemcacheStore(self.server.get_nodes(), thread_local=True)
+
+        def _run_threads(function, amount=10):
+            threads = [threading.Thread(target=function, args=(index,)) for index in xrange(amount)]
+            start = time.time()
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            return time.time() - start
+
+        def _set_get(index):
+            for _ in xrange(5):
+                store.set('key_{0}'.format(index), index)
+                self.assertEqual(store.get('key_{0}'.format(index)), index)
+
+        self.assertLess(_run_threads(_set_get), 10 * 5 * 2 * 0.05 / 2.0)  # A global lock takes at least 10 * 5 * 2 * 0.05 seconds
+
+        def _incr(_):
+            for _ in xrange(5):
+                store.incr('counter')
+
+        self.server.latency = 0.005
+        store.set('counter', 0)
+        _run_threads(_incr)
+        self.assertEqual(store.get_counter('counter'), 50)
+
+
+class PersistentStoreTest(unittest.TestCase):
+    """
+    Tests the persistent stores
+    """
+
+    def setUp(self):
+        """ Starts the mocked Arakoon server """
+        self.server = ArakoonServerMock()
+
+    def tearDown(self):
+        """ Stops the mocked Arakoon server """
+        self.server.stop()
+
+    def _validate_pages(self, store):
+        """ Validates the pagination of the keys of a store """
+        keys = ['/ovs/disks/{0:03d}'.format(index) for index in xrange(25)]
+        for key in keys + ['/ovs/diskless', '/ovs/other', '/other']:
+            store.set(key, {'key': key})
+        self.assertEqual(store.count_prefix('/ovs/disks/'), 25)
+        self.assertEqual(store.count_prefix('/ovs/'), 27)
+        self.assertEqual(store.count_prefix('/unknown'), 0)
+
+        for reverse in [False, True]:
+            expected = sorted(keys, reverse=reverse)
+            pages = []
+            start_after = None
+            while True:
+                page = store.list_page('/ovs/disks/', start_after=start_after, limit=10, reverse=reverse)
+                pages.append(page)
+                if len(page) < 10:
+                    break
+                start_after = page[-1]
+            self.assertEqual(pages, [expected[:10], expected[10:20], expected[20:]])
+            self.assertEqual(store.list_page('/ovs/disks/', start_after=expected[4], limit=2, reverse=reverse, entries=True),
+                             [[key, {'key': key}] for key in expected[5:7]])
+
+        # Cursors outside of the prefix
+        self.assertEqual(store.list_page('/ovs/disks/', start_after='/a', limit=2), keys[:2])
+        self.assertEqual(store.list_page('/ovs/disks/', start_after='/z', limit=2), [])
+        self.assertEqual(store.list_page('/ovs/disks/', start_after='/z', limit=2, reverse=True), keys[:-3:-1])
+        self.assertEqual(store.list_page('/ovs/disks/', start_after='/a', limit=2, reverse=True), [])
+        self.assertEqual(store.list_page('', limit=2, reverse=True), ['/ovs/other', '/ovs/disks/024'])
+
+    def test_pages_dummy(self):
+        """ Validates the pagination of the dummy store """
+        self._validate_pages(DummyPersistentStore())
+
+    def test_pages_pyrakoon(self):
+        """ Validates the pagination of the pyrakoon store, which only fetches the requested page """
+        configuration = '[global]\ncluster = {0}\n\n[{0}]\nip = 127.0.0.1\nclient_port = {1}\n'.format(self.server.node_id, self.server.port)
+        store = PyrakoonStore(self.server.cluster_id, configuration)
+        self._validate_pages(store)
+        self.server.requests = []
+        self.assertEqual(len(store.list_page('/ovs/', limit=5, entries=True)), 5)
+        self.assertEqual(self.server.requests, ['RangeEntries'])
+
+
+class CodecTest(unittest.TestCase):
+    """
+    Tests the value codecs and their use by the stores
+    """
+    VALUE = {'osd_id': 'osd_1', 'metadata': [{'slot': index, 'state': 'ok', 'size': 1024 ** 3} for index in xrange(200)]}
+
+    def _validate_codec(self, codec, header):
+        """ Validates the encoding of a codec: its header, decoding by any codec and compressing large values only """
+        encoded = codec.encode(self.VALUE)
+        self.assertEqual(encoded[:1], header)
+        self.assertEqual(Codec().decode(encoded), self.VALUE)
+        self.assertEqual(codec.decode(ujson.dumps(self.VALUE)), self.VALUE)  # Values stored before codecs existed
+        self.assertEqual(codec.decode(codec.encode('small')), 'small')
+        self.assertLessEqual(len(codec.encode('small')), len('small') + 3)
+        return encoded
+
+    def test_json(self):
+        """ Validates the default codec, which stores plain JSON """
+        encoded = self._validate_codec(Codec(), '{')
+        self.assertEqual(encoded, ujson.dumps(self.VALUE, sort_keys=True))
+
+    def test_zlib(self):
+        """ Validates compressing with zlib """
+        encoded = self._validate_codec(Codec(compressor='zlib', compression_threshold=1024), '\x02')
+        self.assertLess(len(encoded), len(ujson.dumps(self.VALUE)) / 5)
+        self.assertEqual(Codec(compressor='zlib', compression_threshold=1024).encode([1, 2]), '[1,2]')
+
+    @unittest.skipIf(msgpack is None, 'msgpack is not installed')
+    def test_msgpack(self):
+        """ Validates serializing with msgpack, with and without compression """
+        encoded = self._validate_codec(Codec(serializer='msgpack'), '\x01')
+        self.assertLess(len(encoded), len(ujson.dumps(self.VALUE)))
+        self._validate_codec(Codec(serializer='msgpack', compressor='zlib', compression_threshold=0), '\x02')
+
+    @unittest.skipIf(lz4 is None, 'lz4 is not installed')
+    def test_lz4(self):
+        """ Validates compressing with lz4 """
+        self._validate_codec(Codec(compressor='lz4', compression_threshold=1024), '\x03')
+
+    def test_registry(self):
+        """ Validates the registration of serializers and compressors """
+        with self.assertRaises(ValueError):
+            Codec(serializer='unknown')
+        with self.assertRaises(ValueError):
+            Codec(compressor='unknown')
+
+        class _Compressor(ZlibCompressor):
+            NAME = 'other'
+
+        with self.assertRaises(ValueError):
+            register_compressor(_Compressor, '\x02')  # Same header as zlib
+        with self.assertRaises(ValueError):
+            register_compressor(_Compressor, '{')  # JSON text can start with the header
+
+    def test_memcache(self):
+        """ Validates the memcache store using a codec, mixed with values stored in JSON """
+        server = MemcachedServerMock()
+        self.addCleanup(server.stop)
+        json_store = MemcacheStore(server.get_nodes())
+        store = MemcacheStore(server.get_nodes(), codec=Codec(compressor='zlib', compression_threshold=1024))
+        json_store.set('json', self.VALUE)
+        store.set('compressed', self.VALUE)
+        self.assertEqual(server.values['compressed'][1][:1], '\x02')
+        for reader in [json_store, store]:
+            self.assertEqual(reader.get_multi(['json', 'compressed']), {'json': self.VALUE, 'compressed': self.VALUE})
+        store.set('counter', 1)
+        self.assertEqual(store.incr('counter'), 2)
+
+    def test_pyrakoon(self):
+        """ Validates the pyrakoon store using a codec, mixed with values stored in JSON """
+        server = ArakoonServerMock()
+        self.addCleanup(server.stop)
+        configuration = '[global]\ncluster = {0}\n\n[{0}]\nip = 127.0.0.1\nclient_port = {1}\n'.format(server.node_id, server.port)
+        json_store = PyrakoonStore(server.cluster_id, configuration)
+        store = PyrakoonStore(server.cluster_id, configuration, codec=Codec(compressor='zlib', compression_threshold=1024))
+        json_store.set('json', self.VALUE)
+        store.set('compressed', self.VALUE)
+        self.assertEqual(server.values['compressed'][:1], '\x02')
+        for reader in [json_store, store]:
+            self.assertEqual(list(reader.get_multi(['json', 'compressed'])), [self.VALUE, self.VALUE])
+            self.assertEqual(list(reader.prefix_entries('c')) + list(reader.prefix_entries('j')), [['compressed', self.VALUE], ['json', self.VALUE]])
+        store.assert_value('compressed', self.VALUE)
+        with store.transaction_builder() as builder:
+            builder.set('other', self.VALUE)
+        self.assertEqual(json_store.get('other'), self.VALUE)
@@ -85,6 +85,18 @@ class DummyVolatileStore(object):
             return copy.deepcopy(value)
         return default
 
+    def get_multi(self, keys):
+        """
+        Retrieves the values of the given keys. Returns a dict with the keys which were found and their values
+        """
+        data = self._read()
+        now = time_module.time()
+        values = {}
+        for key in keys:
+            if key in data['t'] and data['t'][key] > now:
+                values[key] = copy.deepcopy(data['s'].get(key))
+        return values
+
     def set(self, key, value, time=99999999):
         """
         Sets the value for a key to a given value
@@ -94,6 +106,18 @@ class DummyVolatileStore(object):
         data['t'][key] = time_module.time() + time
         self._save(data)
 
+    def set_multi(self, values, time=99999999):
+        """
+        Sets the values of the keys of the given dict. Returns the keys which could not be stored
+        """
+        data = self._read()
+        expiration = time_module.time() + time
+        for key, value in values.iteritems():
+            data['s'][key] = copy.deepcopy(value)
+            data['t'][key] = expiration
+        self._save(data)
+        return []
+
     def add(self, key, value, time=99999999):
         """
         Adds a given key to the store, expecting the key does not exists yet
@@ -115,16 +139,48 @@ class DummyVolatileStore(object):
             del data['t'][key]
             self._save(data)
 
-    def incr(self, key, delta=1):
+    def delete_multi(self, keys):
         """
-        Increments the value of the key, expecting it exists
+        Deletes the given keys from the store
         """
         data = self._read()
-        if key in data['s']:
-            data['s'][key] += delta
-            self._save(data)
-            return True
-        return False
+        for key in keys:
+            data['s'].pop(key, None)
+            data['t'].pop(key, None)
+        self._save(data)
+        return True
+
+    def incr(self, key, delta=1, time=60):
+        """
+        Increments a counter and returns its new value. A counter which does not exist yet is created
+        """
+        return self._update_counter(key, delta, time)
+
+    def decr(self, key, delta=1, time=60):
+        """
+        Decrements a counter and returns its new value. Counters don't go below 0
+        """
+        return self._update_counter(key, -delta, time)
+
+    def get_counter(self, key, default=None):
+        """
+        Retrieves the value of a counter
+        """
+        return self.get(key, default)
+
+    def _update_counter(self, key, delta, time):
+        """
+        Updates a counter, keeping its expiry
+        """
+        data = self._read()
+        if key in data['t'] and data['t'][key] > time_module.time():
+            value = max(0, data['s'][key] + delta)
+        else:
+            value = max(0, delta)
+            data['t'][key] = time_module.time() + time
+        data['s'][key] = value
+        self._save(data)
+        return value
 
     def _save(self, data):
         """
@@ -19,10 +19,12 @@ Memcache store module
 """
 
 import re
-import ujson
+import time as time_module
+import random
 import memcache
 from functools import wraps
-from threading import Lock
+from threading import Lock, local
+from ovs_extensions.storage.codecs import get_codec
 
 
 def locked():
@@ -36,12 +38,12 @@ def locked():
         @wraps(f)
         def new_function(self, *args, **kwargs):
             """
-            Executes the decorated function in a locked context
+            Executes the decorated function in a locked context. Stores using a client per thread are not locked
             """
             lock = kwargs.get('lock', True)
             if 'lock' in kwargs:
                 del kwargs['lock']
-            if lock:
+            if lock and self._lock is not None:
                 with self._lock:
                     return f(self, *args, **kwargs)
             else:
@@ -57,16 +59,45 @@ class MemcacheStore(object):
     """
 
     COMPRESSION_THRESHOLD = 1 * 1024 * 1024
+    CAS_RETRIES = 50
+    CAS_BACK_OFF = 0.001  # Seconds, doubled with every retry. A random part of it is waited (full jitter)
+    CAS_BACK_OFF_MAX = 0.1
 
-    def __init__(self, nodes):
+    def __init__(self, nodes, thread_local=False, codec=None):
         """
         Initializes the client
+        :param thread_local: Use a memcache client per thread instead of a single client shared under a lock.
+        The operations of different threads then run concurrently
+        :param codec: Codec, or name of the serializer, to encode the values with. Defaults to JSON. Check ovs_extensions.storage.codecs
+        Values are decoded regardless of the codec which encoded them
         """
         self._nodes = nodes
-        self._client = memcache.Client(self._nodes, cache_cas=True, socket_timeout=0.5)
-        self._lock = Lock()
+        self._codec = get_codec(codec)
+        self._thread_local = thread_local
+        self._local = local()
+        self._shared_client = None if thread_local is True else self._create_client()
+        self._lock = None if thread_local is True else Lock()
         self._validate = True
 
+    @property
+    def _client(self):
+        """
+        Returns the memcache client of the calling thread, or the shared one
+        """
+        if self._thread_local is False:
+            return self._shared_client
+        client = getattr(self._local, 'client', None)
+        if client is None:
+            client = self._create_client()
+            self._local.client = client
+        return client
+
+    def _create_client(self):
+        """
+        Creates a memcache client
+        """
+        return memcache.Client(self._nodes, cache_cas=True, socket_timeout=0.5)
+
     def _get(self, action, key, default=None):
         """
         Retrieves a certain value for a given key (get or gets)
@@ -79,7 +110,17 @@ class MemcacheStore(object):
         if data is None:
             # Cache miss
             return default
-        data = ujson.loads(data)
+        return self._unwrap(key, data)
+
+    def _unwrap(self, key, data):
+        """
+        Deserializes the data stored for a key, validating it when validation is enabled
+        Counters are stored as plain numbers, never wrapped, so those are returned as-is
+        """
+        if not isinstance(data, (int, long)):
+            data = self._codec.decode(data)
+        if isinstance(data, (int, long)):
+            return data
         if self._validate:
             if data['key'] == key:
                 return data['value']
@@ -88,6 +129,17 @@ class MemcacheStore(object):
         else:
             return data
 
+    def _wrap(self, key, value):
+        """
+        Serializes a value to store for a key, wrapping it when validation is enabled
+        """
+        if self._validate:
+            data = {'value': value,
+                    'key': key}
+        else:
+            data = value
+        return self._codec.encode(data)
+
     @locked()
     def get(self, key, default=None):
         """
@@ -107,16 +159,27 @@ class MemcacheStore(object):
         Sets the value for a key to a given value
         """
         key = MemcacheStore._clean_key(key)
-        if self._validate:
-            data = {'value': value,
-                    'key': key}
-        else:
-            data = value
-        data = ujson.dumps(data)
+        data = self._wrap(key, value)
         if action == 'set':
             return self._client.set(key, data, time, min_compress_len=MemcacheStore.COMPRESSION_THRESHOLD)
         return self._client.cas(key, data, time, min_compress_len=MemcacheStore.COMPRESSION_THRESHOLD)
 
+    @locked()
+    def get_multi(self, keys):
+        """
+        Retrieves the values of the given keys, with a single round trip per memcache node (get_multi)
+        Returns a dict with the keys which were found and their values
+        """
+        clean_keys = {}
+        for key in keys:
+            clean_keys.setdefault(MemcacheStore._clean_key(key), []).append(key)
+        values = {}
+        for clean_key, data in self._client.get_multi(clean_keys.keys()).iteritems():
+            value = self._unwrap(clean_key, data)
+            for key in clean_keys[clean_key]:
+                values[key] = value
+        return values
+
     @locked()
     def set(self, key, value, time=0):
         """
@@ -124,6 +187,21 @@ class MemcacheStore(object):
         """
         return self._set('set', key, value, time=time)
 
+    @locked()
+    def set_multi(self, values, time=0):
+        """
+        Sets the values of the keys of the given dict, with a single round trip per memcache node (set_multi)
+        Returns the keys which could not be stored
+        """
+        clean_keys = {}
+        data = {}
+        for key, value in values.iteritems():
+            clean_key = MemcacheStore._clean_key(key)
+            clean_keys[clean_key] = key
+            data[clean_key] = self._wrap(clean_key, value)
+        failed = self._client.set_multi(data, time, min_compress_len=MemcacheStore.COMPRESSION_THRESHOLD)
+        return [clean_keys[clean_key] for clean_key in failed]
+
     @locked()
     def cas(self, key, value, time=0):
         """
@@ -137,29 +215,73 @@ class MemcacheStore(object):
         Adds a given key to the store, expecting the key does not exists yet
         """
         key = MemcacheStore._clean_key(key)
-        if self._validate:
-            data = {'value': value,
-                    'key': key}
-        else:
-            data = value
-        data = ujson.dumps(data)
-        return self._client.add(key, data, time)
+        return self._client.add(key, self._wrap(key, value), time)
 
     @locked()
-    def incr(self, key, delta=1):
+    def incr(self, key, delta=1, time=60):
         """
-        Increments the value of the key, expecting it exists
+        Increments a counter atomically and returns its new value, None when it could not be updated
+        Counters are stored as plain numbers (also when validating) so memcache can increment them, which keeps their
+        expiry. A counter which does not exist yet is created with the given value and time to live. Read it with get_counter
         """
-        if self._validate:
-            value = self.get(key, lock=False)
-            if value is not None:
-                value += delta
+        return self._update_counter(key, delta, time)
+
+    @locked()
+    def decr(self, key, delta=1, time=60):
+        """
+        Decrements a counter atomically and returns its new value, None when it could not be updated. Counters don't go below 0
+        A counter which does not exist yet is created with value 0 and the given time to live
+        """
+        return self._update_counter(key, -delta, time)
+
+    @locked()
+    def get_counter(self, key, default=None):
+        """
+        Retrieves the value of a counter
+        """
+        key = MemcacheStore._clean_key(key)
+        data = self._client.get(key)
+        if data is None:
+            return default
+        return self._parse_counter(key, data)
+
+    def _update_counter(self, key, delta, time):
+        """
+        Updates a counter using the memcache incr or decr, falling back to check-and-set when the counter does not exist
+        yet or was stored wrapped
+        """
+        key = MemcacheStore._clean_key(key)
+        try:
+            if delta >= 0:
+                value = self._client.incr(key, delta)
             else:
-                value = 1
-            self.set(key, value, 60, lock=False)
-            return True
-        else:
-            return self._client.incr(MemcacheStore._clean_key(key), delta)
+                value = self._client.decr(key, -delta)
+        except ValueError:
+            # Memcache refuses to update a value which is not a plain number, like the counters stored wrapped
+            value = None
+        if value is not None:
+            return value
+        for attempt in xrange(MemcacheStore.CAS_RETRIES):
+            if attempt > 0:
+                time_module.sleep(random.uniform(0, min(MemcacheStore.CAS_BACK_OFF_MAX, MemcacheStore.CAS_BACK_OFF * 2 ** attempt)))
+            data = self._client.gets(key)
+            if data is None:
+                value = max(0, delta)
+                if self._client.add(key, str(value), time):
+                    return value
+            else:
+                value = max(0, self._parse_counter(key, data) + delta)
+                if self._client.cas(key, str(value), time):
+                    return value
+        return None
+
+    def _parse_counter(self, key, data):
+        """
+        Parses the value of a counter. Counters stored wrapped are unwrapped
+        """
+        if data.isdigit():
+            return int(data)
+        return self._unwrap(key, data)
 
     @locked()
     def delete(self, key):
@@ -168,6 +290,13 @@ class MemcacheStore(object):
         """
         return self._client.delete(MemcacheStore._clean_key(key))
 
+    @locked()
+    def delete_multi(self, keys):
+        """
+        Deletes the given keys from the store, with a single round trip per memcache node (delete_multi)
+        """
+        return self._client.delete_multi(set(MemcacheStore._clean_key(key) for key in keys))
+
     @staticmethod
     def _clean_key(key):
         return re.sub('[^\x21-\x7e\x80-\xff]', '', str(key))